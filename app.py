@@ -15,6 +15,8 @@ from services.database import database_service
 # Import services
 from services.catalog import initialize_catalog
 from services.intent import process_intent
+from services.message_buffer import submit_text_message, flush_pending_text
+from services.cache_listeners import ensure_cache_listeners
 
 # Import session and data management
 from models.session import (
@@ -110,6 +112,10 @@ def webhook():
             logger.error(f"Invalid business context: {error_message}")
             return f"Invalid business context: {error_message}", 400
         
+        # Keep this business's caches current with snapshot listeners (when enabled)
+        if database_service:
+            ensure_cache_listeners(database_service.db, business_context.business_id)
+        
         # Log business context summary
         context_summary = BusinessContextService.get_business_context_summary(business_context)
         logger.info(f"Processing webhook for business: {context_summary}")
@@ -177,9 +183,13 @@ def process_messages_with_context(messages, contacts, metadata, business_context
             set_user_name(business_context.business_id, user_id, contact_info["name"])
         
         message_type = message.get("type")
+        
+        if message_type != "text":
+            # Non-text messages bypass the debounce window; process buffered texts first to keep ordering
+            flush_pending_text(business_context.business_id, user_id)
                 
         if message_type == "text":
-            handle_text_message_with_context(user_id, message, business_context)
+            submit_text_message(business_context, user_id, message, handle_text_message_with_context)
         elif message_type == "interactive":
             handle_interactive_message_with_context(user_id, message, business_context)
         elif message_type == "button":
@@ -592,6 +602,15 @@ def setup_app():
     else:
         logger.error("Database service not available")
     
+    # Release inventory held by abandoned checkouts
+    if database_service and database_service.db:
+        from services.inventory_holds import start_hold_reaper
+        start_hold_reaper(database_service.db)
+        
+        # Snapshot stock levels and trim old inventory ledger entries
+        from services.inventory_ledger import start_ledger_compaction
+        start_ledger_compaction(database_service.db)
+    
     # Initialize product catalog (this will need updating in Phase 3)
     # initialize_catalog()
     
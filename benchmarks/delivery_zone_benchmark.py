@@ -0,0 +1,139 @@
+"""
+Delivery zone lookup benchmark
+Times point-in-zone lookups through the grid index against a linear scan
+of every zone, and checks that both find the same zones
+
+Usage:
+    python -m benchmarks.delivery_zone_benchmark
+    python -m benchmarks.delivery_zone_benchmark --zones 500 --points 20000 --json
+"""
+
+import argparse
+import json
+import math
+import random
+import time
+from typing import Any, Dict, List
+
+from benchmarks.intent_benchmark import percentile
+
+# Zones and points are scattered around Accra
+CENTER_LAT = 5.6037
+CENTER_LNG = -0.1870
+SPREAD_DEGREES = 0.4
+
+
+def generate_zone_configs(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """Mix of radius rings and polygons with random fees and priorities"""
+    configs = []
+    for i in range(count):
+        lat = CENTER_LAT + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES)
+        lng = CENTER_LNG + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES)
+        config = {
+            "id": f"zone_{i}",
+            "name": f"Zone {i}",
+            "fee": round(rng.uniform(5, 50), 2),
+            "eta": rng.choice(["Same day", "1-2 days", "2-3 days"]),
+            "priority": rng.randint(0, 3)
+        }
+
+        if i % 2:
+            config.update({"type": "radius", "center": {"lat": lat, "lng": lng}, "radius_km": rng.uniform(1, 8)})
+        else:
+            # Irregular polygon around the point
+            radius = rng.uniform(0.01, 0.06)
+            vertices = rng.randint(5, 12)
+            config.update({"type": "polygon", "polygon": [
+                [lat + radius * rng.uniform(0.6, 1.0) * math.sin(2 * math.pi * v / vertices),
+                 lng + radius * rng.uniform(0.6, 1.0) * math.cos(2 * math.pi * v / vertices)]
+                for v in range(vertices)
+            ]})
+
+        configs.append(config)
+    return configs
+
+
+def linear_lookup(zones, lat: float, lng: float):
+    """Reference lookup: test every zone, best priority then fee wins"""
+    matches = [zone for zone in zones if zone.contains(lat, lng)]
+    return min(matches, key=lambda zone: (zone.priority, zone.fee)) if matches else None
+
+
+def _latency_summary(latencies_us: List[float]) -> Dict[str, float]:
+    return {
+        "p50_us": round(percentile(latencies_us, 50), 2),
+        "p95_us": round(percentile(latencies_us, 95), 2),
+        "p99_us": round(percentile(latencies_us, 99), 2),
+        "mean_us": round(sum(latencies_us) / len(latencies_us), 2) if latencies_us else 0.0
+    }
+
+
+def run_benchmark(zone_count: int, point_count: int, seed: int = 7) -> Dict[str, Any]:
+    from services.delivery_zones import build_delivery_zone_index
+
+    rng = random.Random(seed)
+    configs = generate_zone_configs(zone_count, rng)
+
+    started_at = time.perf_counter()
+    index = build_delivery_zone_index("benchmark_business", configs)
+    build_ms = (time.perf_counter() - started_at) * 1000
+
+    points = [
+        (CENTER_LAT + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES), CENTER_LNG + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES))
+        for _ in range(point_count)
+    ]
+
+    index_latencies, linear_latencies = [], []
+    mismatches = 0
+    hits = 0
+    for lat, lng in points:
+        started_at = time.perf_counter()
+        zone = index.find_zone(lat, lng)
+        index_latencies.append((time.perf_counter() - started_at) * 1_000_000)
+
+        started_at = time.perf_counter()
+        expected = linear_lookup(index.zones, lat, lng)
+        linear_latencies.append((time.perf_counter() - started_at) * 1_000_000)
+
+        hits += zone is not None
+        if (zone.zone_id if zone else None) != (expected.zone_id if expected else None):
+            mismatches += 1
+
+    return {
+        "zones": zone_count,
+        "points": point_count,
+        "grid_cells": len(index.cells),
+        "unbucketed_zones": len(index.unbucketed),
+        "build_ms": round(build_ms, 1),
+        "points_in_a_zone": hits,
+        "mismatches": mismatches,
+        "index": _latency_summary(index_latencies),
+        "linear_scan": _latency_summary(linear_latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark delivery zone point lookups")
+    parser.add_argument("--zones", type=int, default=200, help="Number of zones")
+    parser.add_argument("--points", type=int, default=10000, help="Number of lookups")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.zones, args.points, args.seed)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"{result['zones']} zones, {result['points']} lookups, {result['grid_cells']} grid cells "
+          f"(built in {result['build_ms']}ms), {result['points_in_a_zone']} points in a zone, "
+          f"{result['mismatches']} mismatches")
+    for name in ("index", "linear_scan"):
+        stats = result[name]
+        print(f"{name:12s} p50 {stats['p50_us']:8.2f}us  p95 {stats['p95_us']:8.2f}us  "
+              f"p99 {stats['p99_us']:8.2f}us  mean {stats['mean_us']:8.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Intent classification benchmark
+Runs a labeled corpus of customer messages through each classification path
+and reports accuracy, a confusion matrix and latency percentiles
+
+Usage:
+    python -m benchmarks.intent_benchmark
+    python -m benchmarks.intent_benchmark --paths regex,llm --stub-latency-ms 300
+    python -m benchmarks.intent_benchmark --live --json
+
+By default the LLM path uses a deterministic local stub so the benchmark
+runs offline; pass --live to call the configured OpenAI model instead. The
+stub's keyword rules were written alongside the corpus, so in stub mode the
+LLM path reports latency only; its accuracy is only measured with --live.
+
+Session history reads and analytics writes are replaced with no-ops while
+the benchmark runs, so neither path touches Firestore.
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import re
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+DEFAULT_CORPUS_PATH = os.path.join(os.path.dirname(__file__), "intent_corpus.json")
+BENCHMARK_BUSINESS_ID = "benchmark_business"
+
+
+class StubChatClient:
+    """Deterministic stand-in for the OpenAI client used by process_intent"""
+
+    # Checked in order; the first matching rule wins
+    RULES = [
+        ("cancel", r"\b(cancel|stop|reset|abort|quit)\b"),
+        ("add_to_cart", r"\b(add|put)\b.*\b(cart|basket)\b"),
+        ("view_cart", r"\b(cart|basket)\b"),
+        ("order_status", r"\b(order|track|delivery|shipped)\b"),
+        ("checkout", r"\b(checkout|pay|payment|purchase|buy)\b"),
+        ("feedback", r"\b(feedback|review|rating|complain)\b"),
+        ("support", r"\b(help|support|problem|assist|faq|contact)\b"),
+        ("product_info", r"\b(how much|price|sizes?|tell me more|is the)\b"),
+        ("browse_product", r"\b(looking for|find|search|do you have|need|want)\b"),
+        ("browse_catalog", r"\b(show|browse|catalog|categories|menu|explore)\b"),
+        ("greeting", r"\b(hi|hello|hey|greetings|good (morning|afternoon|evening))\b"),
+    ]
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def classify(self, text: str) -> Dict[str, Any]:
+        """Classify a message with the stub rules"""
+        text = text.lower()
+        for intent, pattern in self.RULES:
+            if re.search(pattern, text):
+                return {"intent": intent, "entities": {}}
+        return {"intent": "unknown", "entities": {}}
+
+    def _create(self, model=None, messages=None, **kwargs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+        user_message = messages[-1]["content"] if messages else ""
+        content = json.dumps(self.classify(user_message))
+        prompt_tokens = sum(len(message.get("content", "")) // 4 + 1 for message in messages or [])
+        completion_tokens = len(content) // 4 + 1
+
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens
+            )
+        )
+
+
+def load_corpus(path: str = DEFAULT_CORPUS_PATH) -> List[Dict[str, str]]:
+    """Load a labeled corpus: a JSON list of {"text": ..., "intent": ...}"""
+    with open(path, encoding="utf-8") as corpus_file:
+        corpus = json.load(corpus_file)
+
+    return [row for row in corpus if row.get("text") and row.get("intent")]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+@contextlib.contextmanager
+def isolated_intent_service(live: bool = False, stub_latency_ms: float = 0.0):
+    """Run the intent service without session history or database logging (and with the stub client unless live)"""
+    from services import intent
+
+    original_history = intent.get_recent_history
+    original_log_event = intent._log_database_event
+    intent.get_recent_history = lambda business_id, user_id, limit=None: []
+    intent._log_database_event = lambda business_id, user_id, event_type, metadata: None
+    previous_client = None if live else intent.set_llm_client(StubChatClient(latency_ms=stub_latency_ms))
+
+    try:
+        yield intent
+    finally:
+        intent.get_recent_history = original_history
+        intent._log_database_event = original_log_event
+        if not live:
+            intent.set_llm_client(previous_client)
+
+
+def build_classifiers(intent) -> Dict[str, Callable[[str], Dict[str, Any]]]:
+    """Build the classification paths under test"""
+
+    def classify_regex(text):
+        return intent.analyze_message_content_with_business(text, BENCHMARK_BUSINESS_ID)
+
+    def classify_llm(text):
+        user_id = f"benchmark_{uuid.uuid4().hex[:12]}"
+        return intent.process_intent(text, BENCHMARK_BUSINESS_ID, user_id)
+
+    return {
+        "regex": classify_regex,
+        "llm": classify_llm
+    }
+
+
+def run_path(classify: Callable[[str], Dict[str, Any]], corpus: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Run one classification path over the corpus"""
+    latencies_ms = []
+    confusion = {}
+    correct = 0
+
+    for row in corpus:
+        started_at = time.perf_counter()
+        try:
+            predicted = (classify(row["text"]) or {}).get("intent", "unknown")
+        except Exception:
+            predicted = "error"
+        latencies_ms.append((time.perf_counter() - started_at) * 1000)
+
+        expected = row["intent"]
+        confusion.setdefault(expected, {})
+        confusion[expected][predicted] = confusion[expected].get(predicted, 0) + 1
+
+        if predicted == expected:
+            correct += 1
+
+    return {
+        "samples": len(corpus),
+        "correct": correct,
+        "accuracy": round(correct / len(corpus), 4) if corpus else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies_ms, 50), 3),
+            "p95": round(percentile(latencies_ms, 95), 3),
+            "p99": round(percentile(latencies_ms, 99), 3),
+            "mean": round(sum(latencies_ms) / len(latencies_ms), 3) if latencies_ms else 0.0
+        },
+        "confusion_matrix": confusion
+    }
+
+
+def run_benchmark(corpus: List[Dict[str, str]], paths: List[str], live: bool = False, stub_latency_ms: float = 0.0) -> Dict[str, Any]:
+    """Run every requested classification path over the corpus"""
+    results = {}
+    with isolated_intent_service(live=live, stub_latency_ms=stub_latency_ms) as intent:
+        classifiers = build_classifiers(intent)
+        for path in paths:
+            if path not in classifiers:
+                raise ValueError(f"Unknown classification path: {path}")
+            results[path] = run_path(classifiers[path], corpus)
+
+    if "llm" in results and not live:
+        # The stub's rules were tuned to this corpus; its hit rate says nothing about the model
+        results["llm"].update(stub=True, accuracy=None, correct=None, confusion_matrix={})
+
+    return results
+
+
+def format_confusion_matrix(confusion: Dict[str, Dict[str, int]]) -> str:
+    """Render a confusion matrix (rows: expected, columns: predicted)"""
+    labels = sorted(set(confusion) | {p for row in confusion.values() for p in row})
+    width = max(len(label) for label in labels) + 2
+
+    lines = ["expected \\ predicted".ljust(width) + "".join(label[:10].rjust(11) for label in labels)]
+    for expected in labels:
+        row = confusion.get(expected, {})
+        lines.append(expected.ljust(width) + "".join(str(row.get(p, 0) or ".").rjust(11) for p in labels))
+
+    return "\n".join(lines)
+
+
+def format_report(results: Dict[str, Any]) -> str:
+    """Render benchmark results as text"""
+    sections = []
+
+    for path, result in results.items():
+        latency = result["latency_ms"]
+        if result.get("stub"):
+            accuracy = f"accuracy: n/a with the stub client, pass --live to measure ({result['samples']} samples)"
+        else:
+            accuracy = f"accuracy: {result['accuracy']:.2%} ({result['correct']}/{result['samples']})"
+
+        section = (
+            f"== {path} ==\n"
+            f"{accuracy}\n"
+            f"latency ms: p50={latency['p50']:.3f} p95={latency['p95']:.3f} "
+            f"p99={latency['p99']:.3f} mean={latency['mean']:.3f}\n"
+        )
+        if result["confusion_matrix"]:
+            section += f"\n{format_confusion_matrix(result['confusion_matrix'])}\n"
+        sections.append(section)
+
+    return "\n".join(sections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark intent classification accuracy and latency")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_PATH, help="Path to the labeled corpus JSON file")
+    parser.add_argument("--paths", default="regex,llm", help="Comma-separated classification paths to run")
+    parser.add_argument("--live", action="store_true", help="Use the configured OpenAI client instead of the local stub")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="Simulated latency of the stub LLM")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    paths = [path.strip() for path in args.paths.split(",") if path.strip()]
+    results = run_benchmark(corpus, paths, live=args.live, stub_latency_ms=args.stub_latency_ms)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(format_report(results))
+
+
+if __name__ == "__main__":
+    main()
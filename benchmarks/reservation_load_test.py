@@ -0,0 +1,132 @@
+"""
+Inventory reservation load test
+Simulates many concurrent checkouts reserving the same product and checks
+that nothing is oversold, reporting throughput and latency percentiles
+
+Runs against the Firestore emulator; start it first and point the test at it:
+    gcloud emulators firestore start --host-port=localhost:8080
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m benchmarks.reservation_load_test
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m benchmarks.reservation_load_test --shards 10 --checkouts 500
+
+Without FIRESTORE_EMULATOR_HOST the test is skipped (it prints the reason and
+exits 0) rather than run against a real project: reservations rely on
+Firestore transaction contention, which an in-process fake would not reproduce.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from benchmarks.intent_benchmark import percentile
+
+LOAD_TEST_BUSINESS_ID = "load_test_business"
+
+
+EMULATOR_SKIP_REASON = (
+    "FIRESTORE_EMULATOR_HOST is not set; the reservation load test only runs against the "
+    "Firestore emulator, never a real project"
+)
+
+
+def create_emulator_client(project: str):
+    """Create a Firestore client for the emulator (no credentials needed)"""
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        raise RuntimeError(EMULATOR_SKIP_REASON)
+
+    from google.cloud import firestore as cloud_firestore
+    return cloud_firestore.Client(project=project)
+
+
+def seed_product(db, stock: int) -> str:
+    """Create a fresh inventory document for the test product"""
+    product_id = f"load_test_{uuid.uuid4().hex[:8]}"
+    db.collection('inventory').document(product_id).set({
+        'business_id': LOAD_TEST_BUSINESS_ID,
+        'product_id': product_id,
+        'product_name': 'Load test product',
+        'stock_quantity': stock,
+        'reserved_quantity': 0,
+        'stock_status': 'in_stock'
+    })
+    return product_id
+
+
+def run_load_test(db, stock: int, checkouts: int, concurrency: int, quantity: int = 1, shards: int = 0) -> Dict[str, Any]:
+    """Run concurrent reservations against one product and summarize the outcome"""
+    from services.reservations import enable_sharded_reservations, get_reserved_quantity, reserve_stock
+
+    business_context = {'db': db, 'business_id': LOAD_TEST_BUSINESS_ID}
+    product_id = seed_product(db, stock)
+
+    if shards:
+        enable_sharded_reservations(business_context, product_id, shards)
+
+    def checkout(_):
+        started_at = time.perf_counter()
+        result = reserve_stock(business_context, product_id, quantity)
+        return result, (time.perf_counter() - started_at) * 1000
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(checkout, range(checkouts)))
+    elapsed = time.perf_counter() - started_at
+
+    latencies_ms = [latency for _, latency in outcomes]
+    failures = {}
+    for result, _ in outcomes:
+        if not result["success"]:
+            failures[result["reason"]] = failures.get(result["reason"], 0) + 1
+
+    successful = sum(1 for result, _ in outcomes if result["success"])
+    reserved = get_reserved_quantity(business_context, product_id)
+
+    return {
+        "product_id": product_id,
+        "stock": stock,
+        "checkouts": checkouts,
+        "concurrency": concurrency,
+        "shards": shards,
+        "successful": successful,
+        "failures": failures,
+        "reserved_quantity": reserved,
+        # Reserved units must match accepted checkouts and never exceed stock
+        "oversold": reserved > stock,
+        "consistent": reserved == successful * quantity,
+        "throughput_per_s": round(checkouts / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies_ms, 50), 1),
+            "p95": round(percentile(latencies_ms, 95), 1),
+            "p99": round(percentile(latencies_ms, 99), 1)
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test concurrent inventory reservations on one product")
+    parser.add_argument("--project", default="wacommerce-load-test", help="Emulator project ID")
+    parser.add_argument("--stock", type=int, default=100, help="Starting stock of the product")
+    parser.add_argument("--checkouts", type=int, default=300, help="Number of simulated checkouts")
+    parser.add_argument("--concurrency", type=int, default=50, help="Checkouts running at the same time")
+    parser.add_argument("--quantity", type=int, default=1, help="Units reserved per checkout")
+    parser.add_argument("--shards", type=int, default=0, help="Reservation shards (0 reserves on the inventory document)")
+    args = parser.parse_args()
+
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        print(json.dumps({"skipped": True, "reason": EMULATOR_SKIP_REASON}, indent=2))
+        return
+
+    db = create_emulator_client(args.project)
+    result = run_load_test(db, args.stock, args.checkouts, args.concurrency, args.quantity, args.shards)
+    print(json.dumps(result, indent=2))
+
+    if result["oversold"] or not result["consistent"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
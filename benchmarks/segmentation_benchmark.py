@@ -0,0 +1,75 @@
+"""
+Segmentation benchmark
+Times RFM aggregation and scoring over synthetic orders, the part of the
+segmentation job that runs after orders are streamed
+
+Usage:
+    python -m benchmarks.segmentation_benchmark
+    python -m benchmarks.segmentation_benchmark --orders 1000000 --customers 50000 --json
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Dict
+
+
+def run_benchmark(order_count: int, customer_count: int, seed: int = 7) -> Dict[str, Any]:
+    import numpy as np
+    from services.segmentation import OrderColumns, SEGMENT_LABELS, aggregate_orders, score_customers
+
+    rng = np.random.default_rng(seed)
+    now = time.time()
+    # Skewed like real stores: a few customers place most orders
+    codes = np.minimum(rng.zipf(1.3, order_count) - 1, customer_count - 1)
+    amounts = rng.lognormal(3.5, 0.8, order_count)
+    timestamps = now - rng.uniform(0, 365 * 86400, order_count)
+
+    started_at = time.perf_counter()
+    columns = OrderColumns()
+    for code, amount, timestamp in zip(codes.tolist(), amounts.tolist(), timestamps.tolist()):
+        columns.append(code, amount, timestamp)
+    fill_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    aggregates = aggregate_orders(*columns.as_arrays(), customer_count)
+    aggregate_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    scores = score_customers(aggregates, now)
+    score_seconds = time.perf_counter() - started_at
+
+    segment_counts = np.bincount(scores['segment_codes'][scores['active']], minlength=len(SEGMENT_LABELS))
+    return {
+        "orders": order_count,
+        "customers": customer_count,
+        "customers_with_orders": int(scores['active'].sum()),
+        "column_fill_seconds": round(fill_seconds, 3),
+        "aggregate_seconds": round(aggregate_seconds, 3),
+        "score_seconds": round(score_seconds, 3),
+        "segments": {label: int(count) for label, count in zip(SEGMENT_LABELS, segment_counts)}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RFM segmentation over synthetic orders")
+    parser.add_argument("--orders", type=int, default=1000000, help="Number of orders")
+    parser.add_argument("--customers", type=int, default=50000, help="Number of customers")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.orders, args.customers, args.seed)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"{result['orders']} orders, {result['customers_with_orders']} of {result['customers']} customers with orders")
+    print(f"column fill {result['column_fill_seconds']}s, aggregate {result['aggregate_seconds']}s, "
+          f"score {result['score_seconds']}s")
+    print(", ".join(f"{label} {count}" for label, count in result['segments'].items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -37,6 +37,11 @@ except Exception as e:
 # OpenAI settings
 OPENAI_MODEL = "gpt-3.5-turbo"
 
+# Intent prompt budgeting
+INTENT_HISTORY_LIMIT = 5
+INTENT_PROMPT_TOKEN_BUDGET = int(os.getenv("INTENT_PROMPT_TOKEN_BUDGET", "600"))
+INTENT_HISTORY_MESSAGE_MAX_CHARS = 280
+
 # Flask configuration
 DEBUG = os.getenv("DEBUG", "True").lower() in ("true", "1", "t")
 PORT = int(os.getenv("PORT", "5000"))
@@ -46,6 +51,73 @@ INVENTORY_CACHE_DURATION_MINUTES = 30
 INVENTORY_CHECK_ENABLED = True
 DEFAULT_STOCK_QUANTITY = 7
 
+# Inbound message coalescing: consecutive texts from the same user that arrive
+# within this window are merged into a single intent-processing pass. Off (0)
+# unless a business sets whatsapp.message_debounce_ms, e.g. 1500
+MESSAGE_DEBOUNCE_MS = int(os.getenv("MESSAGE_DEBOUNCE_MS", "0"))
+MESSAGE_DEBOUNCE_MAX_MESSAGES = 10
+
+# Worker threads for background tasks such as cache refreshes
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "4"))
+# Worker threads for parallel Firestore queries within one request
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "8"))
+
+# Transaction attempts for inventory reservations before giving up under contention
+RESERVATION_MAX_ATTEMPTS = int(os.getenv("RESERVATION_MAX_ATTEMPTS", "10"))
+
+# How long stock reserved at checkout is held for an unpaid order
+INVENTORY_HOLD_MINUTES = int(os.getenv("INVENTORY_HOLD_MINUTES", "15"))
+HOLD_REAPER_INTERVAL_SECONDS = int(os.getenv("HOLD_REAPER_INTERVAL_SECONDS", "60"))
+HOLD_REAPER_BATCH_SIZE = 200
+
+# Inventory ledger compaction
+LEDGER_RETENTION_DAYS = int(os.getenv("LEDGER_RETENTION_DAYS", "90"))
+LEDGER_COMPACTION_INTERVAL_HOURS = int(os.getenv("LEDGER_COMPACTION_INTERVAL_HOURS", "24"))
+
+# Snapshot listeners that keep caches current in real time (off by default)
+CACHE_LISTENERS_ENABLED = os.getenv("CACHE_LISTENERS_ENABLED", "false").lower() == "true"
+CACHE_LISTENER_CHECK_SECONDS = 30
+CACHE_LISTENER_MAX_BUSINESSES = int(os.getenv("CACHE_LISTENER_MAX_BUSINESSES", "50"))
+
+# Store a compact line_items array on order documents so summaries need one read
+ORDER_LINE_ITEMS_ENABLED = os.getenv("ORDER_LINE_ITEMS_ENABLED", "true").lower() == "true"
+ORDER_LINE_ITEMS_BACKFILL_BATCH_SIZE = int(os.getenv("ORDER_LINE_ITEMS_BACKFILL_BATCH_SIZE", "200"))
+
+# Checkout lookups prefetched when checkout starts are reused for this long
+CHECKOUT_CACHE_TTL_SECONDS = int(os.getenv("CHECKOUT_CACHE_TTL_SECONDS", "300"))
+CHECKOUT_PREFETCH_WAIT_SECONDS = 3
+
+# Customer profiles (customer, addresses, payment accounts) kept in memory, LRU
+CUSTOMER_PROFILE_CACHE_SIZE = int(os.getenv("CUSTOMER_PROFILE_CACHE_SIZE", "1000"))
+CUSTOMER_PROFILE_CACHE_TTL_SECONDS = int(os.getenv("CUSTOMER_PROFILE_CACHE_TTL_SECONDS", "600"))
+
+# Reverse geocoding of shared locations
+GEOCODER_BACKEND = os.getenv("GEOCODER_BACKEND", "nominatim")  # "nominatim" or "offline"
+GEOCODER_USER_AGENT = os.getenv("GEOCODER_USER_AGENT", "whatsapp_store")
+GEOCODE_TIMEOUT_SECONDS = 10
+GEOCODE_MIN_INTERVAL_SECONDS = 1.0  # Public Nominatim allows one request per second
+GEOCODE_GEOHASH_PRECISION = 7  # About 150m cells
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "5000"))
+GEOCODE_PERSISTENT_CACHE_ENABLED = os.getenv("GEOCODE_PERSISTENT_CACHE_ENABLED", "true").lower() == "true"
+GEOCODE_CACHE_DAYS = 30
+
+# Delivery zones (business_settings checkout.delivery_zones) and their grid index
+DELIVERY_ZONE_CELL_DEGREES = 0.01  # About 1.1km cells
+DELIVERY_ZONE_MAX_CELLS = 10000  # Larger zones are checked for every point instead
+DELIVERY_ZONES_CACHE_MINUTES = 15
+
+# RFM customer segmentation (services/segmentation.py)
+SEGMENTATION_QUANTILES = int(os.getenv("SEGMENTATION_QUANTILES", "5"))  # Scores run 1..N
+
+# Orders read per query by the order export (services/order_export.py)
+ORDER_EXPORT_PAGE_SIZE = int(os.getenv("ORDER_EXPORT_PAGE_SIZE", "500"))
+
+# Documents read per query by the bulk data deletion (services/data_deletion.py)
+DATA_DELETION_PAGE_SIZE = int(os.getenv("DATA_DELETION_PAGE_SIZE", "2500"))
+
+# Repeated checkouts of the same cart within this window return the same order
+ORDER_IDEMPOTENCY_WINDOW_SECONDS = int(os.getenv("ORDER_IDEMPOTENCY_WINDOW_SECONDS", "120"))
+
 # Business context caching
 BUSINESS_CONFIG_CACHE_DURATION_MINUTES = 15
 BUSINESS_CONFIG_CACHE = {}
@@ -76,7 +148,8 @@ DEFAULT_WHATSAPP_CONFIG = {
     "business_hours_message": "We're currently closed. Our business hours are Mon-Sat: 9AM-6PM.",
     "auto_reply_enabled": True,
     "inventory_check_enabled": True,
-    "low_stock_threshold": 5
+    "low_stock_threshold": 5,
+    "message_debounce_ms": MESSAGE_DEBOUNCE_MS
 }
 
 DEFAULT_CHECKOUT_CONFIG = {
@@ -1,33 +1,35 @@
 from datetime import datetime, timedelta
-from models.cart import get_cart, format_cart_summary, clear_cart
-from models.order import create_order, get_order_by_id, update_order_status, update_payment_status, set_shipping_address, set_shipping_method
+from models.cart import get_cart, format_cart_summary, clear_cart, restore_cart_items
+from models.order import create_order, get_order_by_id, update_order_status, set_shipping_address, set_shipping_method, set_delivery_quote, parse_address_string
 from models.session import get_current_action, set_current_action, get_last_context, set_last_context, update_session_history
-from models.customer import get_customer_payment_accounts, get_customer_addresses, save_customer_address, save_customer_payment_account, get_or_create_customer
+from models.customer import get_customer_payment_accounts, get_customer_addresses, save_customer_address, save_customer_payment_account
 from services.messenger import send_payment_link_message, send_text_message, send_button_message, send_list_message, send_location_message, send_location_request_message
 from services.inventory import check_inventory_availability, format_inventory_message, update_cart_with_available_stock
+from services import checkout_cache
+from services.settings_cache import get_settings_entry
 from utils.logger import get_logger
-from geopy.geocoders import Nominatim
 
 logger = get_logger(__name__)
 
 def handle_checkout(business_context, user_id):
     """Handle checkout intent, starting the checkout flow with business context"""
     logger.info(f"Handling checkout for user {user_id}, business={business_context.get('business_id')}")
-    business_id = business_context.get('business_id')
     
-    # Ensure customer exists in database
+    # Start the customer, payment account and address lookups while we read the cart
     try:
         from models.session import get_user_name
-        user_name = get_user_name(user_id)
-        customer = get_or_create_customer(user_id, user_name, business_id)
-        if customer:
-            logger.info(f"Customer ready for checkout: {customer.get('id', 'unknown')}")
+        user_name = get_user_name(business_context.get('business_id'), user_id)
+        checkout_cache.start_checkout_prefetch(business_context, user_id, user_name)
     except Exception as e:
-        logger.warning(f"Could not create/get customer for {user_id}: {str(e)}")
+        logger.warning(f"Could not start checkout prefetch for {user_id}: {str(e)}")
     
     # Check if cart has items
     cart = get_cart(business_context, user_id)
     
+    if cart:
+        checkout_cache.remember(business_context, user_id, 'cart', cart)
+        checkout_cache.prefetch_inventory(business_context, user_id, cart)
+    
     if not cart or len(cart) == 0:
         send_text_message(business_context, user_id, "Your cart is empty. Please add some products before checking out.")
         
@@ -72,7 +74,7 @@ def handle_confirm_checkout(business_context, user_id):
     logger.info(f"Handling checkout confirmation for user {user_id}, business={business_context.get('business_id')}")
     
     # Check if cart has items
-    cart = get_cart(business_context, user_id)
+    cart = checkout_cache.get_prefetched(business_context, user_id, 'cart', lambda: get_cart(business_context, user_id))
     
     if not cart or len(cart) == 0:
         send_text_message(business_context, user_id, "Your cart is empty. Please add some products before checking out.")
@@ -86,7 +88,10 @@ def handle_confirm_checkout(business_context, user_id):
     
     # Check inventory availability before proceeding
     try:
-        inventory_results = check_inventory_availability(business_context, cart)
+        inventory_results = checkout_cache.get_prefetched(
+            business_context, user_id, 'inventory',
+            lambda: check_inventory_availability(business_context, cart)
+        )
         
         if inventory_results["has_issues"]:
             # Store inventory results in context for later use
@@ -149,6 +154,20 @@ def proceed_to_payment_selection(business_context, user_id):
         send_text_message(business_context, user_id, "Sorry, there was a problem creating your order. Please try again.")
         return False
     
+    # Hold the stock for this order until it is paid or the hold expires
+    # (a repeated checkout returns the existing order, whose stock is already held)
+    from services.inventory_holds import place_order_holds
+    if not order.get("idempotent_replay") and not place_order_holds(business_context, order["order_id"], user_id, order.get("items", [])):
+        update_order_status(order["order_id"], "cancelled")
+        # Creating the order cleared the cart; give the customer their items back to adjust
+        restore_cart_items(business_context, user_id, order.get("items", []))
+        send_text_message(
+            business_context,
+            user_id,
+            "Sorry, some items in your order just sold out. Please review your cart and try again."
+        )
+        return False
+    
     # Store order ID in context
     set_last_context(user_id, {
         "action": "checkout",
@@ -158,7 +177,7 @@ def proceed_to_payment_selection(business_context, user_id):
     
     # Get customer's saved payment accounts
     try:
-        payment_accounts = get_customer_payment_accounts(business_context, user_id)
+        payment_accounts = checkout_cache.get_prefetched(business_context, user_id, 'payment_accounts', lambda: get_customer_payment_accounts(business_context, user_id))
         logger.info(f"Found {len(payment_accounts)} payment accounts for user {user_id}")
     except Exception as e:
         logger.error(f"Error fetching payment accounts: {str(e)}")
@@ -343,27 +362,8 @@ def handle_payment_selection(business_context, user_id, payment_method):
 
 def handle_new_momo_request(business_context, user_id, order_id):
     """Request details for a new mobile money account"""
-    # Get available networks from business settings or use default
-    db = business_context.get('db')
-    business_id = business_context.get('business_id')
-    
-    # Default networks
-    mobile_money_networks = ["MTN", "Vodafone", "AirtelTigo"]
-    
-    # Try to get business-specific networks
-    if db and business_id:
-        try:
-            settings_ref = db.collection('business_settings').document(business_id)
-            settings_doc = settings_ref.get()
-            
-            if settings_doc.exists:
-                settings_data = settings_doc.to_dict()
-                checkout_settings = settings_data.get('checkout', {})
-                custom_networks = checkout_settings.get('payment_methods', {}).get('mobile_money_networks')
-                if custom_networks:
-                    mobile_money_networks = custom_networks
-        except Exception as e:
-            logger.warning(f"Could not fetch business payment networks: {str(e)}")
+    # Networks from the cached business settings, or the defaults
+    mobile_money_networks = get_settings_entry(business_context)['mobile_money_networks']
     
     # Display network selection options
     network_rows = []
@@ -466,9 +466,6 @@ def handle_momo_number_submission(business_context, user_id, number_text):
         # Generate payment URL (replace with real payment gateway)
         payment_url = f"https://payment.example.com/pay/{order_id}?network={network}&phone={number_text}"
         
-        # Update payment status in order
-        update_payment_status(order_id, "pending_momo")
-        
         # Store payment details in order
         order = get_order_by_id(order_id)
         if order:
@@ -498,8 +495,8 @@ def handle_momo_number_submission(business_context, user_id, number_text):
         # Clear current action
         set_current_action(user_id, None)
         
-        # Proceed to shipping options
-        return handle_shipping_options(business_context, user_id, order_id)
+        # Proceed to shipping options; the payment status is recorded when the order is confirmed
+        return handle_shipping_options(business_context, user_id, order_id, "pending_momo")
         
     except Exception as e:
         logger.error(f"Error handling mobile money number submission: {str(e)}")
@@ -564,9 +561,6 @@ def handle_current_momo_network_selection(business_context, user_id, network):
     # Generate a payment URL
     payment_url = f"https://payment.example.com/pay/{order_id}?network={network}&phone={current_number}"
     
-    # Update payment status
-    update_payment_status(order_id, "pending_momo")
-    
     # Store payment details in order
     order = get_order_by_id(order_id)
     if order:
@@ -596,13 +590,13 @@ def handle_current_momo_network_selection(business_context, user_id, network):
         logger.warning(f"Could not save payment account: {str(e)}")
     
     # Proceed to shipping options
-    return handle_shipping_options(business_context, user_id, order_id)
+    return handle_shipping_options(business_context, user_id, order_id, "pending_momo")
 
 def handle_existing_momo_payment(business_context, user_id, order_id, account_id):
     """Handle payment with existing mobile money account"""
     try:
         # Get saved payment accounts from database
-        saved_payment_accounts = get_customer_payment_accounts(business_context, user_id)
+        saved_payment_accounts = checkout_cache.get_prefetched(business_context, user_id, 'payment_accounts', lambda: get_customer_payment_accounts(business_context, user_id))
         
         # Find the selected account
         selected_account = None
@@ -618,9 +612,6 @@ def handle_existing_momo_payment(business_context, user_id, order_id, account_id
         # Generate a payment URL
         payment_url = f"https://payment.example.com/pay/{order_id}?network={selected_account.get('account_provider', '')}&phone={selected_account.get('account_number', '')}"
         
-        # Update payment status
-        update_payment_status(order_id, "pending_momo")
-        
         # Store payment details in order
         order = get_order_by_id(order_id)
         if order:
@@ -642,7 +633,7 @@ def handle_existing_momo_payment(business_context, user_id, order_id, account_id
         )
         
         # Proceed to shipping options
-        return handle_shipping_options(business_context, user_id, order_id)
+        return handle_shipping_options(business_context, user_id, order_id, "pending_momo")
         
     except Exception as e:
         logger.error(f"Error handling existing momo payment: {str(e)}")
@@ -658,22 +649,27 @@ def handle_cod_payment(business_context, user_id, order_id):
         f"You'll pay when your order is delivered."
     )
     
-    # Set payment status
-    update_payment_status(order_id, "cash_on_delivery")
-    
     # Proceed to shipping options
-    return handle_shipping_options(business_context, user_id, order_id)
+    return handle_shipping_options(business_context, user_id, order_id, "cash_on_delivery")
 
-def handle_shipping_options(business_context, user_id, order_id):
-    """Handle shipping options with business context"""
-    logger.info(f"Handling shipping options for user {user_id}, order_id={order_id}, business={business_context.get('business_id')}")
+def handle_shipping_options(business_context, user_id, order_id, payment_status=None):
+    """Handle shipping options with business context; payment_status is confirmed with the order"""
+    business_id = business_context.get('business_id')
+    logger.info(f"Handling shipping options for user {user_id}, order_id={order_id}, business={business_id}")
+    
+    # Asking again for the same order keeps the payment status chosen before
+    if payment_status is None:
+        context = get_last_context(business_id, user_id) or {}
+        if context.get("order_id") == order_id:
+            payment_status = context.get("payment_status")
     
     # Store in context
-    set_last_context(user_id, {
+    set_last_context(business_id, user_id, {
         "action": "checkout",
         "order_id": order_id,
         "step": "shipping",
-        "business_id": business_context.get('business_id')
+        "payment_status": payment_status,
+        "business_id": business_id
     })
     
     # Present shipping options
@@ -681,7 +677,7 @@ def handle_shipping_options(business_context, user_id, order_id):
     
     # Get saved addresses from database
     try:
-        saved_addresses = get_customer_addresses(business_context, user_id)
+        saved_addresses = checkout_cache.get_prefetched(business_context, user_id, 'addresses', lambda: get_customer_addresses(business_context, user_id))
         logger.info(f"Found {len(saved_addresses)} saved addresses for user {user_id}")
     except Exception as e:
         logger.error(f"Error fetching saved addresses: {str(e)}")
@@ -689,13 +685,24 @@ def handle_shipping_options(business_context, user_id, order_id):
     
     # Add saved addresses section if available
     if saved_addresses:
+        from services.delivery_zones import quote_delivery
+        
         saved_addresses_rows = []
         for address in saved_addresses:
             address_display = f"{address.get('street', '')}, {address.get('city', '')}"
+            
+            # Show the delivery fee and ETA of the address's zone
+            latitude, longitude = _address_coordinates(address)
+            deliverable, quote = quote_delivery(business_context, latitude, longitude, address.get('city'))
+            if not deliverable:
+                address_display = f"Outside delivery area - {address_display}"
+            elif quote:
+                address_display = f"GHS{quote['fee']:.2f}, {quote['eta']} - {address_display}"
+            
             saved_addresses_rows.append({
                 "id": f"shipping_address_{address['id']}",
                 "title": f"{address.get('name', 'Address')} - {'(Default)' if address.get('is_default', False) else ''}",
-                "description": f"{address_display}"
+                "description": address_display[:72]
             })
         
         sections.append({
@@ -732,7 +739,33 @@ def handle_shipping_options(business_context, user_id, order_id):
     )
     
     # Set current action
-    set_current_action(user_id, "awaiting_shipping_option")
+    set_current_action(business_id, user_id, "awaiting_shipping_option")
+    
+    return True
+
+def _address_coordinates(address):
+    """(latitude, longitude) of a saved address, or (None, None)"""
+    coordinates = address.get('coordinates')
+    if coordinates is None or not hasattr(coordinates, 'latitude'):
+        return None, None
+    return coordinates.latitude, coordinates.longitude
+
+def apply_delivery_zone(business_context, user_id, order_id, latitude=None, longitude=None, city=None):
+    """Price delivery for the order's location; returns False (and asks again) if it's outside every zone"""
+    from services.delivery_zones import quote_delivery
+    deliverable, quote = quote_delivery(business_context, latitude, longitude, city)
+    
+    if not deliverable:
+        send_text_message(
+            business_context,
+            user_id,
+            "Sorry, we don't deliver to that location yet. Please choose another address."
+        )
+        handle_shipping_options(business_context, user_id, order_id)
+        return False
+    
+    if quote:
+        set_delivery_quote(order_id, quote)
     
     return True
 
@@ -741,7 +774,7 @@ def handle_shipping_selection(business_context, user_id, shipping_option):
     logger.info(f"Handling shipping selection for user {user_id}, option={shipping_option}, business={business_context.get('business_id')}")
     
     # Get order ID from context
-    context = get_last_context(user_id)
+    context = get_last_context(business_context.get('business_id'), user_id)
     
     if not context or "order_id" not in context:
         send_text_message(business_context, user_id, "Sorry, there was a problem with your order. Please try again.")
@@ -775,7 +808,7 @@ def handle_shipping_selection(business_context, user_id, shipping_option):
     elif shipping_option.startswith("shipping_address_"):
         # Existing address selected
         address_id = shipping_option.replace("shipping_address_", "")
-        return handle_existing_address_selection(business_context, user_id, order_id, address_id)
+        return handle_existing_address_selection(business_context, user_id, order_id, address_id, context.get("payment_status"))
         
     else:
         send_text_message(business_context, user_id, "Sorry, that shipping option is not supported. Please choose another option.")
@@ -783,11 +816,11 @@ def handle_shipping_selection(business_context, user_id, shipping_option):
     
     return True
 
-def handle_existing_address_selection(business_context, user_id, order_id, address_id):
+def handle_existing_address_selection(business_context, user_id, order_id, address_id, payment_status=None):
     """Handle selection of an existing saved address"""
     try:
         # Get saved addresses from database
-        saved_addresses = get_customer_addresses(business_context, user_id)
+        saved_addresses = checkout_cache.get_prefetched(business_context, user_id, 'addresses', lambda: get_customer_addresses(business_context, user_id))
         
         # Find the selected address
         selected_address = None
@@ -808,11 +841,16 @@ def handle_existing_address_selection(business_context, user_id, order_id, addre
             f"Phone: {selected_address.get('phone', '')}"
         )
         
+        # Price delivery for the address's zone
+        latitude, longitude = _address_coordinates(selected_address)
+        if not apply_delivery_zone(business_context, user_id, order_id, latitude, longitude, selected_address.get('city')):
+            return True
+        
         # Set shipping address
         set_shipping_address(order_id, formatted_address)
         
         # Complete the order
-        return complete_order(business_context, user_id, order_id)
+        return complete_order(business_context, user_id, order_id, payment_status)
         
     except Exception as e:
         logger.error(f"Error handling existing address selection: {str(e)}")
@@ -833,43 +871,79 @@ def handle_location_message(business_context, user_id, message):
         
         logger.info(f"Location data received: {name}, {address}, Coordinates: {latitude}, {longitude}")
         
-        # Format a complete location text
-        location_text = ""
-        if name:
-            location_text += f"{name}\n"
-        if address:
-            location_text += f"{address}\n"
-        location_text += f"Coordinates: {latitude}, {longitude}"
+        # Nearby locations are usually cached; otherwise acknowledge now and resolve in the background
+        from services.geocoding import get_cached_reverse_geocode, reverse_geocode_async
+        geocoded = get_cached_reverse_geocode(latitude, longitude)
+        if geocoded:
+            return handle_resolved_location(business_context, user_id, location, geocoded)
+        
+        send_text_message(business_context, user_id, "📍 Thanks, we've received your location. Looking up the address...")
+        reverse_geocode_async(
+            latitude,
+            longitude,
+            lambda result: handle_resolved_location(business_context, user_id, location, result),
+            business_context.get('db')
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Error processing location message: {str(e)}")
         
-        try:
-            geolocator = Nominatim(user_agent="whatsapp_store")
-            location_info = geolocator.reverse(f"{latitude}, {longitude}", timeout=10)
-            if location_info and location_info.address:
-                location_text = str(location_info.address)
-        except Exception as e:
-            logger.warning(f"Error geocoding location: {str(e)}")
+        # Send error message to user
+        send_text_message(
+            business_context,
+            user_id, 
+            "Sorry, there was a problem processing your location. Please try again or contact our support team."
+        )
+        return False
+
+def format_location_text(location, area=None):
+    """Text for a shared WhatsApp location: the name and address it came with, then the area and coordinates"""
+    lines = [location[field] for field in ('name', 'address') if location.get(field)]
+    if area:
+        lines.append(area)
+    lines.append(f"Coordinates: {location.get('latitude', 0)}, {location.get('longitude', 0)}")
+    return "\n".join(lines)
+
+def handle_resolved_location(business_context, user_id, location, geocoded=None):
+    """Continue handling a shared location once its address is known (or couldn't be found)"""
+    try:
+        business_id = business_context.get('business_id')
+        latitude = location.get("latitude", 0)
+        longitude = location.get("longitude", 0)
+        location_text = format_location_text(location)
+        location_raw = None
+        if geocoded and geocoded.get('address'):
+            location_raw = geocoded.get('raw')
+            if geocoded.get('cached'):
+                # A cached result only describes the area, so the customer's own lines stay first
+                location_text = format_location_text(location, geocoded['address'])
+            else:
+                location_text = geocoded['address']
         
         # Update user session history
-        update_session_history(user_id, "user", f"Shared location: {location_text}")
+        update_session_history(business_id, user_id, "user", f"Shared location: {location_text}")
         
         # Check if we're waiting for a location for shipping
-        current_action = get_current_action(user_id)
+        current_action = get_current_action(business_id, user_id)
         
         if current_action == "awaiting_shipping_location" or current_action == "awaiting_shipping_address_or_location":
             # User shared location for shipping during checkout
-            context = get_last_context(user_id)
+            context = get_last_context(business_id, user_id)
             
             if not context or "order_id" not in context:
                 send_text_message(business_context, user_id, "Sorry, there was a problem with your order. Please try again.")
                 return False
             
             order_id = context["order_id"]
-            business_id = business_context.get('business_id')
+            
+            # Price delivery for the shared location's zone
+            if not apply_delivery_zone(business_context, user_id, order_id, latitude, longitude):
+                return True
             
             # Save the location as an address in the database
             try:
-                if hasattr(location_info, 'raw'):
-                    address_id = save_customer_address(user_id, location_info.raw, "Location Address", business_id)
+                if location_raw:
+                    address_id = save_customer_address(business_context, user_id, location_raw, "Location Address")
                     logger.info(f"Saved location as address {address_id}")
             except Exception as e:
                 logger.warning(f"Could not save location as address: {str(e)}")
@@ -885,7 +959,7 @@ def handle_location_message(business_context, user_id, message):
             )
             
             # Complete the order
-            return complete_order(business_context, user_id, order_id)
+            return complete_order(business_context, user_id, order_id, context.get("payment_status"))
         else:
             # User shared location but we weren't expecting it
             send_text_message(
@@ -924,7 +998,7 @@ def handle_shipping_address(business_context, user_id, address_text):
     logger.info(f"Handling shipping address for user {user_id}, business={business_context.get('business_id')}")
     
     # Get order ID from context
-    context = get_last_context(user_id)
+    context = get_last_context(business_context.get('business_id'), user_id)
     
     if not context or "order_id" not in context:
         send_text_message(business_context, user_id, "Sorry, there was a problem with your order. Please try again.")
@@ -932,6 +1006,10 @@ def handle_shipping_address(business_context, user_id, address_text):
     
     order_id = context["order_id"]
     
+    # Price delivery by the address's city when it has one
+    if not apply_delivery_zone(business_context, user_id, order_id, city=parse_address_string(address_text).get('city')):
+        return True
+    
     # Set shipping address
     set_shipping_address(order_id, address_text)
     
@@ -943,93 +1021,35 @@ def handle_shipping_address(business_context, user_id, address_text):
     )
     
     # Complete order
-    return complete_order(business_context, user_id, order_id)
+    return complete_order(business_context, user_id, order_id, context.get("payment_status"))
 
-def complete_order(business_context, user_id, order_id):
+def complete_order(business_context, user_id, order_id, payment_status=None):
     """Complete the order process with business context"""
     try:
         logger.info(f"Completing order for user {user_id}, order_id={order_id}, business={business_context.get('business_id')}")
-        business_id = business_context.get('business_id')
         
-        # Get order details
-        order = get_order_by_id(order_id)
+        # Confirm the order, keep its held stock and update the customer and analytics in one transaction
+        from models.order import confirm_order
+        from services.inventory_holds import HoldsExpiredError
+        try:
+            order = confirm_order(business_context, user_id, order_id, payment_status)
+        except HoldsExpiredError:
+            return handle_expired_order_holds(business_context, user_id, order_id)
         
         if not order:
-            logger.error(f"Order {order_id} not found when completing")
+            logger.error(f"Order {order_id} could not be confirmed")
             send_text_message(business_context, user_id, "❌ Sorry, there was an error with your order. Please contact support.")
             return False
         
-        # Update order status to confirmed
-        update_order_status(order_id, "confirmed")
-        
-        # Try to update customer's total orders count
-        try:
-            db = business_context.get('db')
-            if db:
-                from firebase_admin import firestore
-                customers_ref = db.collection('customers')
-                query = customers_ref.where('whatsapp_number', '==', user_id).where('business_id', '==', business_id)
-                
-                for doc in query.stream():
-                    doc.reference.update({
-                        'total_whatsapp_orders': firestore.FieldValue.increment(1),
-                        'last_whatsapp_interaction': firestore.SERVER_TIMESTAMP
-                    })
-                    break
-        except Exception as e:
-            logger.warning(f"Could not update customer order count: {str(e)}")
-        
-        # Format order confirmation message
-        from models.order import format_order_summary
-        order_summary = format_order_summary(order_id)
-        
-        confirmation_message = (
-            f"🎉 *Order Confirmed Successfully!*\n\n"
-            f"{order_summary}\n\n"
-            f"📧 You'll receive updates via WhatsApp as your order progresses.\n"
-            f"📦 Estimated delivery: 3-5 business days\n\n"
-            f"Thank you for shopping with us!"
-        )
-        
-        # Send order management options
-        buttons = [
-            {"type": "reply", "reply": {"id": f"track_{order_id}", "title": "Track Order"}},
-            {"type": "reply", "reply": {"id": "browse", "title": "Continue Shopping"}},
-            {"type": "reply", "reply": {"id": "support", "title": "Get Help"}}
-        ]
-        
-        send_button_message(
-            business_context,
-            user_id,
-            "Order Management",
-            confirmation_message,
-            buttons
-        )
-        
-        # Log analytics event
-        try:
-            db = business_context.get('db')
-            if db:
-                from firebase_admin import firestore
-                analytics_data = {
-                    'event_type': 'order_completed',
-                    'user_id': user_id,
-                    'business_id': business_id,
-                    'metadata': {
-                        'order_id': order_id,
-                        'order_total': order.get('total', 0),
-                        'item_count': order.get('item_count', 0),
-                        'payment_method': order.get('payment_details', {}).get('method', 'unknown')
-                    },
-                    'created_at': firestore.SERVER_TIMESTAMP
-                }
-                db.collection('whatsapp_analytics').add(analytics_data)
-        except Exception as e:
-            logger.warning(f"Could not log analytics event: {str(e)}")
+        # Clear current action, context and prefetched checkout data
+        business_id = business_context.get('business_id')
+        set_current_action(business_id, user_id, None)
+        set_last_context(business_id, user_id, {})
+        checkout_cache.invalidate(business_context, user_id)
         
-        # Clear current action and context
-        set_current_action(user_id, None)
-        set_last_context(user_id, {})
+        # Send the confirmation once the order is committed, without holding up the webhook
+        from utils.background import run_in_background
+        run_in_background(send_order_confirmation, business_context, user_id, order)
         
         logger.info(f"✅ Order {order_id} completed successfully for user {user_id}")
         return True
@@ -1058,4 +1078,56 @@ def complete_order(business_context, user_id, order_id):
             buttons
         )
         
-        return False
\ No newline at end of file
+        return False
+
+def handle_expired_order_holds(business_context, user_id, order_id):
+    """Cancel an order whose reserved stock sold while checkout took too long, giving the items back to the cart"""
+    from models.order import get_order_line_items
+    
+    items = get_order_line_items(business_context.get('db'), order_id, get_order_by_id(order_id))
+    update_order_status(order_id, "cancelled")
+    restore_cart_items(business_context, user_id, items)
+    
+    business_id = business_context.get('business_id')
+    set_current_action(business_id, user_id, None)
+    set_last_context(business_id, user_id, {})
+    checkout_cache.invalidate(business_context, user_id)
+    
+    send_text_message(
+        business_context,
+        user_id,
+        f"Sorry, the items in Order #{order_id} were no longer reserved and some have sold out in the meantime. "
+        f"They are back in your cart, so please review it and check out again."
+    )
+    return False
+
+def send_order_confirmation(business_context, user_id, order):
+    """Send the order confirmation and order management options"""
+    order_id = order["order_id"]
+    
+    # Format order confirmation message
+    from models.order import format_order_summary
+    order_summary = format_order_summary(order_id, order)
+    
+    confirmation_message = (
+        f"🎉 *Order Confirmed Successfully!*\n\n"
+        f"{order_summary}\n\n"
+        f"📧 You'll receive updates via WhatsApp as your order progresses.\n"
+        f"📦 Estimated delivery: 3-5 business days\n\n"
+        f"Thank you for shopping with us!"
+    )
+    
+    # Send order management options
+    buttons = [
+        {"type": "reply", "reply": {"id": f"track_{order_id}", "title": "Track Order"}},
+        {"type": "reply", "reply": {"id": "browse", "title": "Continue Shopping"}},
+        {"type": "reply", "reply": {"id": "support", "title": "Get Help"}}
+    ]
+    
+    return send_button_message(
+        business_context,
+        user_id,
+        "Order Management",
+        confirmation_message,
+        buttons
+    )
\ No newline at end of file
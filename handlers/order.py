@@ -1,7 +1,7 @@
 import json
 from models.order import get_user_orders, get_order_by_id, format_order_summary
 from models.session import update_session_history
-from models.cart import clear_cart, add_to_cart_with_details
+from models.cart import import_items_to_cart
 from services.messenger import send_text_message, send_button_message, send_list_message
 from utils.logger import get_logger
 
@@ -28,8 +28,11 @@ def handle_order_status(business_context, user_id, order_id=None):
         send_text_message(business_context, user_id, "Sorry, I couldn't find that order. Please check the order number and try again.")
         return False
     
+    # Use the stored ID from here on; a typed one may differ in case
+    order_id = order["order_id"]
+    
     # Format order summary
-    order_summary = format_order_summary(order_id)
+    order_summary = format_order_summary(order_id, order)
     
     # Send order status
     send_text_message(business_context, user_id, order_summary)
@@ -146,31 +149,18 @@ def handle_order_message(business_context, user_id, message):
         # Update user session history
         update_session_history(user_id, "user", f"Placed an order with {len(product_items)} item(s)")
         
-        # Initialize cart with ordered items
-        clear_cart(business_context, user_id)
-        
-        # Add items to cart
-        total_items = 0 
-        for item in product_items:
-            product_id = item.get("product_retailer_id", "")
-            quantity = item.get("quantity", 1)
-            
-            # Get item price and currency
-            item_price = item.get("item_price", 0)
-            currency = item.get("currency", "GHS")
-            
-            # Add to cart with provided details
-            success = add_to_cart_with_details(
-                business_context,
-                user_id, 
-                product_id, 
-                quantity, 
-                price=item_price,
-                currency=currency
-            )
-            
-            if success:
-                total_items += quantity
+        # Replace the cart with the ordered items in one write
+        cart_items = [
+            {
+                "product_id": item.get("product_retailer_id", ""),
+                "quantity": item.get("quantity", 1),
+                "price": item.get("item_price", 0),
+                "currency": item.get("currency", "GHS")
+            }
+            for item in product_items
+        ]
+        total_items = import_items_to_cart(business_context, user_id, cart_items, replace=True)
+        logger.info(f"Added {total_items} unit(s) to cart from order message for {user_id}")
         
         # Create order from cart
         from handlers.checkout import handle_confirm_checkout
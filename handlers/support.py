@@ -1,5 +1,6 @@
 from services.messenger import send_text_message, send_button_message, send_list_message
 from models.session import set_current_action
+from services.settings_cache import get_settings_entry
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -36,44 +37,8 @@ def handle_support_faq(business_context, user_id):
     """Handle FAQ support option with business context"""
     logger.info(f"Handling FAQ for user {user_id}, business={business_context.get('business_id')}")
     
-    # Get business-specific FAQ content
-    db = business_context.get('db')
-    business_id = business_context.get('business_id')
-    
-    # Default FAQ content
-    faq_text = (
-        "*Frequently Asked Questions*\n\n"
-        "*How long does shipping take?*\n"
-        "Standard shipping takes 3-5 business days. Express shipping takes 1-2 business days.\n\n"
-        
-        "*Do you ship internationally?*\n"
-        "Yes, we ship to most countries worldwide. International shipping typically takes 7-14 business days.\n\n"
-        
-        "*How can I track my order?*\n"
-        "You'll receive a tracking number via WhatsApp once your order ships. You can also check your order status by sending 'order status'.\n\n"
-        
-        "*What payment methods do you accept?*\n"
-        "We accept mobile money (MTN, Vodafone, AirtelTigo) and cash on delivery.\n\n"
-        
-        "*How do I return an item?*\n"
-        "Contact our support team within 30 days of receiving your order. We'll guide you through the return process."
-    )
-    
-    # Try to get business-specific FAQ content
-    if db and business_id:
-        try:
-            # Check for business-specific FAQ content in business_settings
-            settings_ref = db.collection('business_settings').document(business_id)
-            settings_doc = settings_ref.get()
-            
-            if settings_doc.exists:
-                settings_data = settings_doc.to_dict()
-                custom_faq = settings_data.get('support', {}).get('faq_content')
-                if custom_faq:
-                    faq_text = custom_faq
-                    
-        except Exception as e:
-            logger.warning(f"Could not fetch business FAQ for {business_id}: {str(e)}")
+    # FAQ text is rendered from the business settings when they are cached
+    faq_text = get_settings_entry(business_context)['faq_text']
     
     send_text_message(business_context, user_id, faq_text)
     
@@ -97,58 +62,8 @@ def handle_support_shipping(business_context, user_id):
     """Handle shipping information support option with business context"""
     logger.info(f"Handling shipping info for user {user_id}, business={business_context.get('business_id')}")
     
-    # Get business-specific shipping policies
-    db = business_context.get('db')
-    business_id = business_context.get('business_id')
-    
-    # Default shipping text
-    shipping_text = (
-        "*Shipping Information*\n\n"
-        "*Standard Delivery (Free)*\n"
-        "• Delivery in 3-5 business days\n"
-        "• Available for all domestic orders\n"
-        "• Free for orders over GHS50\n\n"
-        
-        "*Express Delivery (GHS9.99)*\n"
-        "• Delivery in 1-2 business days\n"
-        "• Available for orders placed before 2PM\n"
-        "• Includes weekend delivery\n\n"
-        
-        "*International Shipping*\n"
-        "• Delivery in 7-14 business days\n"
-        "• Shipping costs vary by destination\n"
-        "• Customs fees may apply\n\n"
-        
-        "*Store Pickup (Free)*\n"
-        "• Available for collection same day if ordered before 3PM\n"
-        "• Please bring ID and order number"
-    )
-    
-    # Try to get business-specific shipping info
-    if db and business_id:
-        try:
-            settings_ref = db.collection('business_settings').document(business_id)
-            settings_doc = settings_ref.get()
-            
-            if settings_doc.exists:
-                settings_data = settings_doc.to_dict()
-                checkout_settings = settings_data.get('checkout', {})
-                shipping_methods = checkout_settings.get('shipping_methods', [])
-                
-                if shipping_methods:
-                    # Build custom shipping text from business settings
-                    custom_shipping_text = "*Shipping Information*\n\n"
-                    for method in shipping_methods:
-                        method_name = method.get('name', 'Standard')
-                        method_cost = method.get('cost', 'Free')
-                        method_time = method.get('delivery_time', '3-5 business days')
-                        custom_shipping_text += f"*{method_name}* ({method_cost})\n"
-                        custom_shipping_text += f"• Delivery in {method_time}\n\n"
-                    
-                    shipping_text = custom_shipping_text
-                    
-        except Exception as e:
-            logger.warning(f"Could not fetch business shipping info for {business_id}: {str(e)}")
+    # Shipping text is rendered from the business's shipping methods when its settings are cached
+    shipping_text = get_settings_entry(business_context)['shipping_text']
     
     send_text_message(business_context, user_id, shipping_text)
     
@@ -218,66 +133,8 @@ def handle_support_contact(business_context, user_id):
     """Handle contact support team option with business context"""
     logger.info(f"Handling contact support for user {user_id}, business={business_context.get('business_id')}")
     
-    # Get business contact information
-    db = business_context.get('db')
-    business_id = business_context.get('business_id')
-    
-    # Default contact text
-    contact_text = (
-        "*Contact Our Support Team*\n\n"
-        "Our customer service team is here to help!\n\n"
-        
-        "*Support Hours:*\n"
-        "Monday-Friday: 9AM-6PM\n"
-        "Saturday: 10AM-4PM\n"
-        "Sunday: Closed\n\n"
-        
-        "*Contact Options:*\n"
-        "• Email: support@example.com\n"
-        "• Phone: 1-800-123-4567\n"
-        "• Live Chat: www.example.com/support\n\n"
-        
-        "You can also continue this conversation for support. How can we help you today?"
-    )
-    
-    # Try to get business-specific contact info
-    if db and business_id:
-        try:
-            # Get business contact details
-            business_ref = db.collection('businesses').document(business_id)
-            business_doc = business_ref.get()
-            
-            if business_doc.exists:
-                business_data = business_doc.to_dict()
-                business_name = business_data.get('name', 'Our Team')
-                
-                # Get business contacts
-                contacts_ref = db.collection('business_contacts').document(business_id)
-                contacts_doc = contacts_ref.get()
-                
-                if contacts_doc.exists:
-                    contacts_data = contacts_doc.to_dict()
-                    email = contacts_data.get('email', 'support@example.com')
-                    phone = contacts_data.get('phone', '1-800-123-4567')
-                    whatsapp = contacts_data.get('whatsapp', '')
-                    
-                    # Build custom contact text
-                    contact_text = (
-                        f"*Contact {business_name} Support*\n\n"
-                        "Our customer service team is here to help!\n\n"
-                        
-                        "*Contact Options:*\n"
-                        f"• Email: {email}\n"
-                        f"• Phone: {phone}\n"
-                    )
-                    
-                    if whatsapp:
-                        contact_text += f"• WhatsApp: {whatsapp}\n"
-                    
-                    contact_text += "\nYou can also continue this conversation for support. How can we help you today?"
-                    
-        except Exception as e:
-            logger.warning(f"Could not fetch business contact info for {business_id}: {str(e)}")
+    # Contact text is rendered from the businesses and business_contacts documents when they are cached
+    contact_text = get_settings_entry(business_context)['contact_text']
     
     send_text_message(business_context, user_id, contact_text)
     
@@ -10,7 +10,7 @@ from cryptography.fernet import Fernet
 import base64
 import os
 
-from config import logger, BUSINESS_CONFIG_CACHE, BUSINESS_CONFIG_CACHE_UPDATED, BUSINESS_CONFIG_CACHE_DURATION_MINUTES
+from config import logger, BUSINESS_CONFIG_CACHE, BUSINESS_CONFIG_CACHE_UPDATED, BUSINESS_CONFIG_CACHE_DURATION_MINUTES, MESSAGE_DEBOUNCE_MS
 from services.database import database_service
 
 class BusinessConfig:
@@ -86,6 +86,14 @@ class BusinessConfig:
         whatsapp_settings = self.settings.get('whatsapp', {})
         return whatsapp_settings.get('inventory_check_enabled', True)
     
+    def get_message_debounce_ms(self) -> int:
+        """Get the window (in milliseconds) for coalescing consecutive text messages"""
+        whatsapp_settings = self.settings.get('whatsapp', {})
+        try:
+            return max(0, int(whatsapp_settings.get('message_debounce_ms', MESSAGE_DEBOUNCE_MS)))
+        except (TypeError, ValueError):
+            return MESSAGE_DEBOUNCE_MS
+    
     def get_payment_methods(self) -> List[str]:
         """Get enabled payment methods"""
         checkout_settings = self.settings.get('checkout', {})
@@ -116,6 +124,9 @@ class BusinessConfig:
             'cached_at': datetime.now().isoformat()
         }
 
+# Businesses whose cached configs are kept current by snapshot listeners
+live_config_businesses = set()
+
 class BusinessManager:
     """Business configuration manager with caching"""
     
@@ -163,6 +174,10 @@ class BusinessManager:
             # Cache the result
             BusinessManager._cache_business_config(cache_key, config)
             
+            # Support handlers read settings and render their texts from this cache
+            from services.settings_cache import prime_settings_cache
+            prime_settings_cache(database_service.db, business_id, config.business_data, settings)
+            
             # Update business activity
             database_service.update_business_last_activity(business_id)
             
@@ -235,6 +250,11 @@ class BusinessManager:
         if cache_key not in BUSINESS_CONFIG_CACHE_UPDATED:
             return False
         
+        # Snapshot listeners keep these entries current, so the TTL doesn't apply
+        cached_data = BUSINESS_CONFIG_CACHE.get(cache_key) or {}
+        if cached_data.get('business_id') in live_config_businesses:
+            return True
+        
         cache_time = BUSINESS_CONFIG_CACHE_UPDATED[cache_key]
         cache_age = datetime.now() - cache_time
         
@@ -265,6 +285,9 @@ class BusinessManager:
             cache_key = f"business_{business_id}"
             BUSINESS_CONFIG_CACHE.pop(cache_key, None)
             BUSINESS_CONFIG_CACHE_UPDATED.pop(cache_key, None)
+            
+            from services.settings_cache import invalidate_settings_cache
+            invalidate_settings_cache(business_id)
         
         if phone_number_id:
             cache_key = f"phone_{phone_number_id}"
@@ -273,6 +296,41 @@ class BusinessManager:
         
         logger.info(f"Invalidated cache for business_id: {business_id}, phone_id: {phone_number_id}")
     
+    @staticmethod
+    def apply_settings_update(business_id: str, settings: Optional[Dict[str, Any]]):
+        """Update cached configs of a business with changed settings; None drops them"""
+        for cache_key, cached_data in list(BUSINESS_CONFIG_CACHE.items()):
+            if cached_data.get('business_id') != business_id:
+                continue
+            
+            if settings is None:
+                BUSINESS_CONFIG_CACHE.pop(cache_key, None)
+                BUSINESS_CONFIG_CACHE_UPDATED.pop(cache_key, None)
+            else:
+                BUSINESS_CONFIG_CACHE[cache_key] = dict(cached_data, settings=settings)
+        
+        logger.debug(f"Applied settings update to cached configs for business {business_id}")
+    
+    @staticmethod
+    def apply_whatsapp_config_update(business_id: str, whatsapp_config: Optional[Dict[str, Any]]):
+        """Update cached configs of a business with a changed WhatsApp config; None or inactive drops them"""
+        active = bool(whatsapp_config and whatsapp_config.get('active', True))
+        phone_number_id = whatsapp_config.get('phone_number_id') if whatsapp_config else None
+        
+        for cache_key, cached_data in list(BUSINESS_CONFIG_CACHE.items()):
+            if cached_data.get('business_id') != business_id:
+                continue
+            
+            # Phone-keyed entries are only valid for the config's current number
+            stale_phone_key = cache_key.startswith('phone_') and cache_key != f"phone_{phone_number_id}"
+            if not active or stale_phone_key:
+                BUSINESS_CONFIG_CACHE.pop(cache_key, None)
+                BUSINESS_CONFIG_CACHE_UPDATED.pop(cache_key, None)
+            else:
+                BUSINESS_CONFIG_CACHE[cache_key] = dict(cached_data, whatsapp_config=whatsapp_config)
+        
+        logger.debug(f"Applied WhatsApp config update to cached configs for business {business_id}")
+    
     @staticmethod
     def get_cache_stats() -> Dict[str, Any]:
         """Get cache statistics"""
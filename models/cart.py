@@ -2,9 +2,70 @@ from models.session import init_user_session
 from services.catalog import get_product_by_id, get_product_by_retailer_id
 from utils.logger import get_logger
 from datetime import datetime
+from firebase_admin import firestore
 
 logger = get_logger(__name__)
 
+def calculate_cart_totals(cart):
+    """Calculate the total price and item count of a list of cart items"""
+    total = sum(item.get("price", 0) * item.get("quantity", 0) for item in cart)
+    item_count = sum(item.get("quantity", 0) for item in cart)
+    return total, item_count
+
+def _cart_update_fields(cart):
+    """Build the session fields written with every cart change, including stored totals"""
+    total, item_count = calculate_cart_totals(cart)
+    return {
+        'cart': cart,
+        'cart_total': total,
+        'cart_item_count': item_count,
+        'cart_version': firestore.Increment(1),
+        'last_active': datetime.now()
+    }
+
+def _cart_changed(business_context, user_id):
+    """Drop checkout data prefetched for the previous cart contents"""
+    from services.checkout_cache import invalidate, CART_ENTRIES
+    invalidate(business_context, user_id, *CART_ENTRIES)
+
+def _mutate_cart(business_context, user_id, mutate):
+    """
+    Apply a change to the user's cart atomically in a Firestore transaction
+    
+    mutate(cart) edits the cart list in place and returns a truthy value when the
+    cart should be written. The transaction retries it if the session changes
+    concurrently, so simultaneous button taps can't overwrite each other.
+    """
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+    session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
+    
+    @firestore.transactional
+    def apply_mutation(transaction):
+        session_doc = session_ref.get(transaction=transaction)
+        cart = session_doc.to_dict().get('cart', []) if session_doc.exists else []
+        
+        result = mutate(cart)
+        if not result:
+            return result
+        
+        fields = _cart_update_fields(cart)
+        if session_doc.exists:
+            transaction.update(session_ref, fields)
+        else:
+            fields.update({
+                'user_id': user_id,
+                'business_id': business_id,
+                'created_at': datetime.now()
+            })
+            transaction.set(session_ref, fields)
+        return result
+    
+    result = apply_mutation(db.transaction())
+    if result:
+        _cart_changed(business_context, user_id)
+    return result
+
 def get_cart(business_context, user_id):
     """Get the user's current shopping cart with business context"""
     try:
@@ -22,6 +83,8 @@ def get_cart(business_context, user_id):
                 # Initialize empty cart in Firebase
                 session_ref.set({
                     'cart': [],
+                    'cart_total': 0,
+                    'cart_item_count': 0,
                     'user_id': user_id,
                     'business_id': business_id,
                     'created_at': datetime.now(),
@@ -75,22 +138,6 @@ def add_to_cart_with_details(business_context, user_id, product_identifier, quan
         return False
     
     try:
-        session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
-        session_doc = session_ref.get()
-        
-        if session_doc.exists:
-            current_cart = session_doc.to_dict().get('cart', [])
-        else:
-            current_cart = []
-            # Initialize session
-            session_ref.set({
-                'cart': [],
-                'user_id': user_id,
-                'business_id': business_id,
-                'created_at': datetime.now(),
-                'last_active': datetime.now()
-            })
-        
         # Resolve SKU to product option ID if needed
         from services.inventory import get_product_option_id_by_sku
         product_option_id = get_product_option_id_by_sku(business_context, product_identifier)
@@ -148,19 +195,6 @@ def add_to_cart_with_details(business_context, user_id, product_identifier, quan
             price_float = 0
             logger.warning(f"Could not parse price '{price}' for product {product_identifier}")
         
-        # Check if product already in cart (check by both product_id and product_option_id)
-        for item in current_cart:
-            if (item["product_id"] == product_identifier or 
-                (product_option_id and item.get("product_option_id") == product_option_id)):
-                item["quantity"] += quantity
-                session_ref.update({
-                    'cart': current_cart,
-                    'last_active': datetime.now()
-                })
-                logger.info(f"Updated quantity for product {product_identifier} in cart for user {user_id} in business {business_id}")
-                return True
-        
-        # Add new item to cart
         cart_item = {
             "product_id": product_identifier,
             "product_option_id": product_option_id or "",  # Store resolved option ID
@@ -173,19 +207,154 @@ def add_to_cart_with_details(business_context, user_id, product_identifier, quan
             "business_id": business_id  # Ensure cart items are business-scoped
         }
         
-        current_cart.append(cart_item)
-        session_ref.update({
-            'cart': current_cart,
-            'last_active': datetime.now()
-        })
+        def add_item(current_cart):
+            # Check if product already in cart (check by both product_id and product_option_id)
+            for item in current_cart:
+                if (item["product_id"] == product_identifier or 
+                    (product_option_id and item.get("product_option_id") == product_option_id)):
+                    item["quantity"] += quantity
+                    return "updated"
+            
+            current_cart.append(cart_item)
+            return "added"
+        
+        outcome = _mutate_cart(business_context, user_id, add_item)
         
-        logger.info(f"Added product {product_identifier} to cart for user {user_id} in business {business_id} with price {price_float} {currency}")
+        if outcome == "updated":
+            logger.info(f"Updated quantity for product {product_identifier} in cart for user {user_id} in business {business_id}")
+        else:
+            logger.info(f"Added product {product_identifier} to cart for user {user_id} in business {business_id} with price {price_float} {currency}")
         return True
         
     except Exception as e:
         logger.error(f"Error adding to cart with details for business {business_id}: {str(e)}")
         return False
 
+def import_items_to_cart(business_context, user_id, items, replace=True):
+    """
+    Add many products to the user's cart with a constant number of Firestore round trips
+    
+    Args:
+        business_context: Business context
+        user_id: WhatsApp number of the customer
+        items: List of dicts with product_id, quantity and optional price/currency
+        replace: Replace the current cart instead of merging into it
+        
+    Returns:
+        Total quantity added to the cart
+    """
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+    
+    if not db or not business_id:
+        logger.error("Missing db or business_id in business context")
+        return 0
+    
+    try:
+        from services.inventory import get_product_options_by_skus
+        
+        identifiers = [item.get("product_id") for item in items if item.get("product_id")]
+        
+        # One batched query per 30 SKUs instead of one query per item
+        options_by_sku = get_product_options_by_skus(business_context, identifiers)
+        
+        # Fetch the remaining products in a single batched read
+        products = {}
+        missing_ids = [identifier for identifier in dict.fromkeys(identifiers) if identifier not in options_by_sku]
+        if missing_ids:
+            product_refs = [db.collection('products').document(identifier) for identifier in missing_ids]
+            for product_doc in db.get_all(product_refs):
+                if product_doc.exists:
+                    product_data = product_doc.to_dict()
+                    if product_data.get('business_id') == business_id:
+                        products[product_doc.id] = product_data
+        
+        total_quantity = 0
+        resolved_items = []
+        
+        for item in items:
+            product_identifier = item.get("product_id")
+            quantity = item.get("quantity", 1)
+            price = item.get("price")
+            currency = item.get("currency")
+            
+            if not product_identifier:
+                continue
+            
+            option_data = options_by_sku.get(product_identifier)
+            product_option_id = option_data.get('id') if option_data else None
+            product = products.get(product_identifier)
+            
+            product_name = f"Product {product_identifier}"
+            product_image_url = ""
+            
+            if price is None:
+                if not product:
+                    # Not in Firestore; fall back to the catalog lookup for this item only
+                    product = get_product_by_retailer_id(business_context, product_identifier)
+                    if not product or product.get('business_id') != business_id:
+                        logger.error(f"Failed to add product {product_identifier} to cart - product not found")
+                        continue
+                
+                price = product.get("price", "0")
+                if isinstance(price, str) and ' ' in price:
+                    # Handle price format like "10 GHS"
+                    price = price.split()[0]
+                currency = product.get("currency", currency or "GHS")
+            
+            if option_data:
+                product_name = option_data.get("name", product_name)
+                product_image_url = option_data.get("whatsapp_image_url", "")
+            elif product:
+                product_name = product.get("name", product_name)
+                product_image_url = product.get("whatsapp_image_url", product.get("image_url", ""))
+            
+            try:
+                price_float = float(price)
+            except ValueError:
+                price_float = 0
+                logger.warning(f"Could not parse price '{price}' for product {product_identifier}")
+            
+            total_quantity += quantity
+            resolved_items.append({
+                "product_id": product_identifier,
+                "product_option_id": product_option_id or "",
+                "name": product_name,
+                "price": price_float,
+                "quantity": quantity,
+                "image_url": product_image_url,
+                "whatsapp_image_id": product_image_url,
+                "currency": currency or "GHS",
+                "business_id": business_id
+            })
+        
+        def merge_items(current_cart):
+            for new_item in resolved_items:
+                existing_item = next(
+                    (cart_item for cart_item in current_cart
+                     if cart_item["product_id"] == new_item["product_id"] or
+                     (new_item["product_option_id"] and cart_item.get("product_option_id") == new_item["product_option_id"])),
+                    None
+                )
+                if existing_item:
+                    existing_item["quantity"] += new_item["quantity"]
+                else:
+                    current_cart.append(dict(new_item))
+            return True
+        
+        def replace_items(current_cart):
+            current_cart.clear()
+            return merge_items(current_cart)
+        
+        _mutate_cart(business_context, user_id, replace_items if replace else merge_items)
+        
+        logger.info(f"Imported {len(items)} item(s) ({total_quantity} units) into cart for user {user_id} in business {business_id}")
+        return total_quantity
+        
+    except Exception as e:
+        logger.error(f"Error importing items to cart for business {business_id}: {str(e)}")
+        return 0
+
 def remove_from_cart(business_context, user_id, product_id):
     """Remove a product from the user's cart with business context"""
     db = business_context.get('db')
@@ -196,22 +365,17 @@ def remove_from_cart(business_context, user_id, product_id):
         return False
     
     try:
-        session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
-        session_doc = session_ref.get()
-        
-        if session_doc.exists:
-            current_cart = session_doc.to_dict().get('cart', [])
-            
+        def remove_item(current_cart):
             # Find and remove product
             for i, item in enumerate(current_cart):
                 if item["product_id"] == product_id:
                     current_cart.pop(i)
-                    session_ref.update({
-                        'cart': current_cart,
-                        'last_active': datetime.now()
-                    })
-                    logger.info(f"Removed product {product_id} from cart for user {user_id} in business {business_id}")
                     return True
+            return False
+        
+        if _mutate_cart(business_context, user_id, remove_item):
+            logger.info(f"Removed product {product_id} from cart for user {user_id} in business {business_id}")
+            return True
         
         logger.warning(f"Failed to remove product {product_id} from cart - not found")
         return False
@@ -232,22 +396,17 @@ def update_cart_quantity(business_context, user_id, product_id, quantity):
         if quantity <= 0:
             return remove_from_cart(business_context, user_id, product_id)
         
-        session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
-        session_doc = session_ref.get()
-        
-        if session_doc.exists:
-            current_cart = session_doc.to_dict().get('cart', [])
-            
+        def set_quantity(current_cart):
             # Find and update product quantity
             for item in current_cart:
                 if item["product_id"] == product_id:
                     item["quantity"] = quantity
-                    session_ref.update({
-                        'cart': current_cart,
-                        'last_active': datetime.now()
-                    })
-                    logger.info(f"Updated quantity for product {product_id} to {quantity} for user {user_id} in business {business_id}")
                     return True
+            return False
+        
+        if _mutate_cart(business_context, user_id, set_quantity):
+            logger.info(f"Updated quantity for product {product_id} to {quantity} for user {user_id} in business {business_id}")
+            return True
         
         logger.warning(f"Failed to update quantity for product {product_id} - not found in cart")
         return False
@@ -256,6 +415,35 @@ def update_cart_quantity(business_context, user_id, product_id, quantity):
         logger.error(f"Error updating cart quantity for business {business_id}: {str(e)}")
         return False
 
+def restore_cart_items(business_context, user_id, items):
+    """Put an order's items back into the cart, e.g. when the order could not be placed"""
+    business_id = business_context.get('business_id')
+    
+    if not business_context.get('db') or not business_id or not items:
+        return False
+    
+    try:
+        def restore_items(current_cart):
+            for restored_item in items:
+                existing_item = next(
+                    (cart_item for cart_item in current_cart if cart_item["product_id"] == restored_item["product_id"]),
+                    None
+                )
+                if existing_item:
+                    # Items added since the order was created keep their own quantity
+                    existing_item["quantity"] = max(existing_item["quantity"], restored_item["quantity"])
+                else:
+                    current_cart.append(dict(restored_item))
+            return True
+        
+        _mutate_cart(business_context, user_id, restore_items)
+        logger.info(f"Restored {len(items)} item(s) to cart for user {user_id} in business {business_id}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error restoring cart items for business {business_id}: {str(e)}")
+        return False
+
 def clear_cart(business_context, user_id):
     """Clear the user's shopping cart with business context"""
     db = business_context.get('db')
@@ -266,10 +454,8 @@ def clear_cart(business_context, user_id):
     
     try:
         session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
-        session_ref.update({
-            'cart': [],
-            'last_active': datetime.now()
-        })
+        session_ref.update(_cart_update_fields([]))
+        _cart_changed(business_context, user_id)
         logger.info(f"Cleared cart for user {user_id} in business {business_id}")
         return True
         
@@ -277,11 +463,64 @@ def clear_cart(business_context, user_id):
         logger.error(f"Error clearing cart for business {business_id}: {str(e)}")
         return False
 
+def add_clear_cart_to_batch(batch, business_context, user_id):
+    """Add clearing the user's cart to a write batch, e.g. the one creating an order"""
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+    session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
+    batch.update(session_ref, _cart_update_fields([]))
+
+def get_cart_with_totals(business_context, user_id):
+    """Get the user's cart together with its stored total and item count"""
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+    
+    if not db or not business_id:
+        cart = get_cart(business_context, user_id)
+        total, item_count = calculate_cart_totals(cart)
+        return cart, total, item_count
+    
+    session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
+    session_doc = session_ref.get()
+    session_data = session_doc.to_dict() if session_doc.exists else {}
+    cart = session_data.get('cart', [])
+    
+    if 'cart_total' in session_data and 'cart_item_count' in session_data:
+        return cart, session_data['cart_total'], session_data['cart_item_count']
+    
+    # Sessions written before totals were stored
+    total, item_count = calculate_cart_totals(cart)
+    return cart, total, item_count
+
+def _get_stored_cart_totals(business_context, user_id):
+    """Read only the stored cart totals from the session, or None if they aren't stored"""
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+    
+    if not db or not business_id:
+        return None
+    
+    session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
+    session_doc = session_ref.get(field_paths=['cart_total', 'cart_item_count'])
+    
+    if not session_doc.exists:
+        return 0, 0
+    
+    session_data = session_doc.to_dict() or {}
+    if 'cart_total' not in session_data or 'cart_item_count' not in session_data:
+        return None
+    
+    return session_data['cart_total'], session_data['cart_item_count']
+
 def get_cart_total(business_context, user_id):
     """Calculate the total price of items in the cart with business context"""
     try:
+        stored_totals = _get_stored_cart_totals(business_context, user_id)
+        if stored_totals is not None:
+            return stored_totals[0]
+        
         cart = get_cart(business_context, user_id)
-        total = sum(item["price"] * item["quantity"] for item in cart)
+        total, _ = calculate_cart_totals(cart)
         return total
     except Exception as e:
         logger.error(f"Error calculating cart total for business {business_context.get('business_id')}: {str(e)}")
@@ -290,8 +529,13 @@ def get_cart_total(business_context, user_id):
 def get_cart_item_count(business_context, user_id):
     """Get the total number of items in the cart with business context"""
     try:
+        stored_totals = _get_stored_cart_totals(business_context, user_id)
+        if stored_totals is not None:
+            return stored_totals[1]
+        
         cart = get_cart(business_context, user_id)
-        return sum(item["quantity"] for item in cart)
+        _, item_count = calculate_cart_totals(cart)
+        return item_count
     except Exception as e:
         logger.error(f"Error getting cart item count for business {business_context.get('business_id')}: {str(e)}")
         return 0
@@ -299,19 +543,17 @@ def get_cart_item_count(business_context, user_id):
 def format_cart_summary(business_context, user_id):
     """Format a text summary of the cart contents with business context"""
     try:
-        cart = get_cart(business_context, user_id)
+        cart, total, _ = get_cart_with_totals(business_context, user_id)
         
         if not cart:
             return "Your cart is empty."
         
         summary = "*Your Shopping Cart*\n\n"
-        total = 0
         currency = cart[0].get("currency", "GHS")
         
         for item in cart:
             item_total = item["price"] * item["quantity"]
             summary += f"• {item['name']} x {item['quantity']} = {currency}{item_total:.2f}\n"
-            total += item_total
         
         summary += f"\n*Total: {currency}{total:.2f}*"
         return summary
@@ -330,10 +572,8 @@ def update_cart_with_available_stock(business_context, user_id, modified_cart):
     
     try:
         session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
-        session_ref.update({
-            'cart': modified_cart,
-            'last_active': datetime.now()
-        })
+        session_ref.update(_cart_update_fields(modified_cart))
+        _cart_changed(business_context, user_id)
         
         logger.info(f"Updated cart for user {user_id} in business {business_id} with available stock quantities")
         return True
@@ -345,33 +585,28 @@ def update_cart_with_available_stock(business_context, user_id, modified_cart):
 def validate_cart_business_scope(business_context, user_id):
     """Validate that all cart items belong to the current business"""
     try:
-        cart = get_cart(business_context, user_id)
         business_id = business_context.get('business_id')
+        db = business_context.get('db')
         
-        invalid_items = []
-        for item in cart:
-            # Check if item has business_id and if it matches current business
-            item_business_id = item.get('business_id')
-            if item_business_id and item_business_id != business_id:
-                invalid_items.append(item)
-        
-        # Remove invalid items if any found
-        if invalid_items:
-            valid_cart = [item for item in cart if item.get('business_id') == business_id or not item.get('business_id')]
-            
-            # Update cart with only valid items
-            db = business_context.get('db')
-            if db:
-                session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
-                session_ref.update({
-                    'cart': valid_cart,
-                    'last_active': datetime.now()
-                })
-                
-            logger.info(f"Removed {len(invalid_items)} invalid items from cart for user {user_id} in business {business_id}")
-            return len(valid_cart)
+        if not db:
+            return len(get_cart(business_context, user_id))
+        
+        removed = {'count': 0, 'remaining': 0}
+        
+        def remove_foreign_items(current_cart):
+            # Keep items that match the current business or predate business scoping
+            valid_cart = [item for item in current_cart if item.get('business_id') == business_id or not item.get('business_id')]
+            removed['count'] = len(current_cart) - len(valid_cart)
+            removed['remaining'] = len(valid_cart)
+            current_cart[:] = valid_cart
+            return removed['count'] > 0
+        
+        _mutate_cart(business_context, user_id, remove_foreign_items)
         
-        return len(cart)
+        if removed['count']:
+            logger.info(f"Removed {removed['count']} invalid items from cart for user {user_id} in business {business_id}")
+        
+        return removed['remaining']
         
     except Exception as e:
         logger.error(f"Error validating cart business scope: {str(e)}")
@@ -393,14 +628,12 @@ def migrate_cart_to_business(business_context, user_id, old_cart_data):
         db = business_context.get('db')
         if db:
             session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
-            session_ref.update({
-                'cart': updated_cart,
-                'last_active': datetime.now()
-            })
+            session_ref.update(_cart_update_fields(updated_cart))
+            _cart_changed(business_context, user_id)
             
         logger.info(f"Migrated cart data for user {user_id} to business {business_id}")
         return True
         
     except Exception as e:
         logger.error(f"Error migrating cart to business scope: {str(e)}")
-        return False
\ No newline at end of file
+        return False
@@ -1,5 +1,9 @@
+import threading
+import time
 import uuid
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timezone
+from config import CUSTOMER_PROFILE_CACHE_SIZE, CUSTOMER_PROFILE_CACHE_TTL_SECONDS
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -15,6 +19,128 @@ except ImportError as e:
     FIREBASE_AVAILABLE = False
     db = None
 
+class CustomerProfileCache:
+    """
+    Bounded LRU cache of customer profiles
+    
+    A profile holds the customer document together with its addresses and
+    payment accounts (each loaded on first use) and an index of account
+    numbers for duplicate checks. Saves write through to the cached profile.
+    """
+    
+    def __init__(self, capacity=CUSTOMER_PROFILE_CACHE_SIZE, ttl_seconds=CUSTOMER_PROFILE_CACHE_TTL_SECONDS):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, business_id, user_id):
+        """Cached profile, marking it most recently used; None if absent or expired"""
+        key = (business_id, user_id)
+        with self._lock:
+            profile = self._profiles.get(key)
+            if profile is None or time.monotonic() - profile['loaded_at'] > self.ttl_seconds:
+                self._profiles.pop(key, None)
+                self.misses += 1
+                return None
+            
+            self._profiles.move_to_end(key)
+            self.hits += 1
+            return profile
+    
+    def put(self, business_id, user_id, customer):
+        """Cache a customer document, starting a new profile"""
+        profile = {
+            'customer': customer,
+            'addresses': None,
+            'payment_accounts': None,
+            'account_index': {},
+            'loaded_at': time.monotonic()
+        }
+        key = (business_id, user_id)
+        with self._lock:
+            self._profiles[key] = profile
+            self._profiles.move_to_end(key)
+            while len(self._profiles) > self.capacity:
+                self._profiles.popitem(last=False)
+                self.evictions += 1
+        return profile
+    
+    def set_payment_accounts(self, profile, accounts):
+        """Store a profile's payment accounts, newest first, and index them for duplicate checks"""
+        with self._lock:
+            profile['payment_accounts'] = accounts
+            profile['account_index'] = {
+                (account.get('account_number'), account.get('account_provider')): account
+                for account in accounts
+            }
+    
+    def add_payment_account(self, profile, account):
+        """Record a saved or reused payment account as the most recently used"""
+        with self._lock:
+            accounts = [existing for existing in profile['payment_accounts'] or [] if existing.get('id') != account.get('id')]
+            profile['payment_accounts'] = [account] + accounts
+            profile['account_index'][(account.get('account_number'), account.get('account_provider'))] = account
+    
+    def set_addresses(self, profile, addresses):
+        with self._lock:
+            profile['addresses'] = addresses
+    
+    def add_address(self, profile, address):
+        """Record a saved address as the most recently used"""
+        with self._lock:
+            profile['addresses'] = [address] + (profile['addresses'] or [])
+    
+    def update_customer(self, business_id, user_id, fields):
+        """Apply fields written to the customer document to its cached copy"""
+        with self._lock:
+            profile = self._profiles.get((business_id, user_id))
+            if profile:
+                profile['customer'] = {**profile['customer'], **fields}
+    
+    def evict(self, business_id, user_id):
+        with self._lock:
+            self._profiles.pop((business_id, user_id), None)
+    
+    def evict_business(self, business_id):
+        """Drop every cached profile of a business, e.g. after a bulk job wrote its customers"""
+        with self._lock:
+            for key in [key for key in self._profiles if key[0] == business_id]:
+                del self._profiles[key]
+    
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+    
+    def get_stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._profiles),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0
+            }
+
+customer_profile_cache = CustomerProfileCache()
+
+def _get_customer_profile(db_instance, user_id, business_id):
+    """Cached profile for a customer, loading the customer document on a miss; None if there is no customer"""
+    profile = customer_profile_cache.get(business_id, user_id)
+    if profile:
+        return profile
+    
+    customer = get_customer_by_whatsapp_internal(db_instance, user_id, business_id)
+    if not customer:
+        return None
+    
+    return customer_profile_cache.put(business_id, user_id, customer)
+
 def get_customer_payment_accounts(business_context, user_id):
     """Get customer's saved payment accounts from database"""
     try:
@@ -28,12 +154,15 @@ def get_customer_payment_accounts(business_context, user_id):
         # Import here to avoid circular imports
         from firebase_admin import firestore
         
-        # First get customer ID
-        customer = get_customer_by_whatsapp_internal(db_instance, user_id, business_id)
-        if not customer:
+        # First get the customer profile
+        profile = _get_customer_profile(db_instance, user_id, business_id)
+        if not profile:
             return []
         
-        customer_id = customer.get('id')
+        if profile['payment_accounts'] is not None:
+            return list(profile['payment_accounts'])
+        
+        customer_id = profile['customer'].get('id')
         
         # Query payment accounts for this customer and business
         accounts_ref = db_instance.collection('payment_accounts').where(
@@ -48,8 +177,10 @@ def get_customer_payment_accounts(business_context, user_id):
             account_data['id'] = doc.id
             accounts.append(account_data)
         
+        customer_profile_cache.set_payment_accounts(profile, accounts)
+        
         logger.info(f"Retrieved {len(accounts)} payment accounts for user {user_id} in business {business_id}")
-        return accounts
+        return list(accounts)
         
     except Exception as e:
         logger.error(f"Error fetching payment accounts for user {user_id}: {str(e)}")
@@ -75,17 +206,20 @@ def save_customer_payment_account(business_context, user_id, network, number, na
         
         customer_id = customer.get('id')
         
-        # Check if account already exists for this customer and business
+        # Load the accounts into the customer's profile, then check for duplicates in memory
         existing_accounts = get_customer_payment_accounts(business_context, user_id)
-        for account in existing_accounts:
-            if (account.get('account_number') == number and 
-                account.get('account_provider') == network and
-                account.get('business_id') == business_id):
-                logger.info(f"Payment account already exists for {number} ({network}) in business {business_id}")
-                # Update last used
-                account_ref = db_instance.collection('payment_accounts').document(account['id'])
-                account_ref.update({'last_used': firestore.SERVER_TIMESTAMP})
-                return account['id']
+        profile = customer_profile_cache.get(business_id, user_id) or customer_profile_cache.put(business_id, user_id, customer)
+        if profile['payment_accounts'] is None:
+            customer_profile_cache.set_payment_accounts(profile, existing_accounts)
+        
+        account = profile['account_index'].get((number, network))
+        if account:
+            logger.info(f"Payment account already exists for {number} ({network}) in business {business_id}")
+            # Update last used
+            account_ref = db_instance.collection('payment_accounts').document(account['id'])
+            account_ref.update({'last_used': firestore.SERVER_TIMESTAMP})
+            customer_profile_cache.add_payment_account(profile, {**account, 'last_used': datetime.now(timezone.utc)})
+            return account['id']
         
         # Create new payment account
         account_data = {
@@ -105,6 +239,15 @@ def save_customer_payment_account(business_context, user_id, network, number, na
         doc_ref = db_instance.collection('payment_accounts').add(account_data)
         account_id = doc_ref[1].id
         
+        # Write through to the cached profile, with the current UTC time standing in for server timestamps
+        now = datetime.now(timezone.utc)
+        customer_profile_cache.add_payment_account(profile, {
+            **account_data, 'id': account_id, 'last_used': now, 'created_at': now, 'updated_at': now
+        })
+        
+        from services.checkout_cache import invalidate
+        invalidate(business_context, user_id, 'payment_accounts')
+        
         logger.info(f"Saved payment account {account_id} for user {user_id} in business {business_id}")
         return account_id
         
@@ -125,12 +268,15 @@ def get_customer_addresses(business_context, user_id):
         # Import here to avoid circular imports
         from firebase_admin import firestore
         
-        # First get customer ID
-        customer = get_customer_by_whatsapp_internal(db_instance, user_id, business_id)
-        if not customer:
+        # First get the customer profile
+        profile = _get_customer_profile(db_instance, user_id, business_id)
+        if not profile:
             return []
         
-        customer_id = customer.get('id')
+        if profile['addresses'] is not None:
+            return list(profile['addresses'])
+        
+        customer_id = profile['customer'].get('id')
         
         # Query addresses for this customer and business
         addresses_ref = db_instance.collection('customer_addresses').where(
@@ -145,8 +291,10 @@ def get_customer_addresses(business_context, user_id):
             address_data['id'] = doc.id
             addresses.append(address_data)
         
+        customer_profile_cache.set_addresses(profile, addresses)
+        
         logger.info(f"Retrieved {len(addresses)} addresses for user {user_id} in business {business_id}")
-        return addresses
+        return list(addresses)
         
     except Exception as e:
         logger.error(f"Error fetching addresses for user {user_id}: {str(e)}")
@@ -256,6 +404,17 @@ def save_customer_address(business_context, user_id, address_text, name):
         doc_ref = db_instance.collection('customer_addresses').add(address_data)
         address_id = doc_ref[1].id
         
+        # Write through to the cached profile if its addresses are loaded
+        profile = customer_profile_cache.get(business_id, user_id)
+        if profile and profile['addresses'] is not None:
+            now = datetime.now(timezone.utc)
+            customer_profile_cache.add_address(profile, {
+                **address_data, 'id': address_id, 'last_used': now, 'created_at': now, 'updated_at': now
+            })
+        
+        from services.checkout_cache import invalidate
+        invalidate(business_context, user_id, 'addresses')
+        
         logger.info(f"Saved address {address_id} for user {user_id} in business {business_id}")
         return address_id
         
@@ -272,10 +431,27 @@ def get_or_create_customer(business_context, user_id, name=None):
         
         # Import here to avoid circular imports
         from firebase_admin import firestore
+        from google.api_core.exceptions import NotFound
         
         business_id = business_context.get('business_id')
         db_instance = business_context.get('db', db)
         
+        profile = customer_profile_cache.get(business_id, user_id)
+        if profile:
+            customer_data = dict(profile['customer'])
+            
+            # Update last interaction
+            try:
+                db_instance.collection('customers').document(customer_data['id']).update({
+                    'last_whatsapp_interaction': firestore.SERVER_TIMESTAMP,
+                    'updated_at': firestore.SERVER_TIMESTAMP
+                })
+                return customer_data
+            except NotFound:
+                # Deleted elsewhere (e.g. by services.data_deletion); look the customer up again
+                logger.info(f"Cached customer {customer_data['id']} for user {user_id} no longer exists")
+                customer_profile_cache.evict(business_id, user_id)
+        
         # Check if customer exists for this business
         customers_ref = db_instance.collection('customers')
         query = customers_ref.where(
@@ -298,6 +474,8 @@ def get_or_create_customer(business_context, user_id, name=None):
                 'updated_at': firestore.SERVER_TIMESTAMP
             })
             
+            customer_profile_cache.put(business_id, user_id, dict(customer_data))
+            
             logger.info(f"Found existing customer {customer_data['id']} for user {user_id} in business {business_id}")
             return customer_data
         else:
@@ -325,6 +503,7 @@ def get_or_create_customer(business_context, user_id, name=None):
             doc_ref = db_instance.collection('customers').add(customer_data)
             customer_id = doc_ref[1].id
             customer_data['id'] = customer_id
+            customer_profile_cache.put(business_id, user_id, dict(customer_data))
             
             logger.info(f"Created new customer {customer_id} for user {user_id} in business {business_id}")
             return customer_data
@@ -357,6 +536,7 @@ def update_customer_payment_method(business_context, user_id, payment_method):
                 'preferred_payment_method': payment_method,
                 'updated_at': firestore.SERVER_TIMESTAMP
             })
+            customer_profile_cache.update_customer(business_id, user_id, {'preferred_payment_method': payment_method})
             return True
         
         logger.warning(f"No customer found to update payment method for user {user_id} in business {business_id}")
@@ -422,6 +602,35 @@ def get_business_customers(business_context, limit=50):
         logger.error(f"Error getting business customers: {str(e)}")
         return []
 
+def get_customers_by_segment(business_context, segment, limit=50):
+    """Get customers in an RFM segment (set by services.segmentation), e.g. 'champions'"""
+    db_instance = business_context.get('db')
+    business_id = business_context.get('business_id')
+
+    if not db_instance or not business_id:
+        return []
+
+    try:
+        from firebase_admin import firestore
+
+        customers = db_instance.collection('customers').where(
+            filter=firestore.FieldFilter('business_id', '==', business_id)
+        ).where(
+            filter=firestore.FieldFilter('segment', '==', segment)
+        ).limit(limit).get()
+
+        customer_list = []
+        for customer_doc in customers:
+            customer_data = customer_doc.to_dict()
+            customer_data['id'] = customer_doc.id
+            customer_list.append(customer_data)
+
+        return customer_list
+
+    except Exception as e:
+        logger.error(f"Error getting customers in segment {segment}: {str(e)}")
+        return []
+
 def update_customer_profile(business_context, user_id, profile_data):
     """Update customer profile information"""
     db_instance = business_context.get('db')
@@ -453,6 +662,9 @@ def update_customer_profile(business_context, user_id, profile_data):
         
         customer_ref = db_instance.collection('customers').document(customer_id)
         customer_ref.update(update_data)
+        customer_profile_cache.update_customer(business_id, user_id, {
+            field: value for field, value in update_data.items() if field != 'updated_at'
+        })
         
         logger.info(f"Updated customer profile for {customer_id}")
         return True
@@ -470,47 +682,15 @@ def delete_customer_data(business_context, user_id):
         return False
     
     try:
-        from firebase_admin import firestore
+        from services.data_deletion import delete_customer
         
-        customer = get_customer_by_whatsapp_internal(db_instance, user_id, business_id)
-        if not customer:
-            return True  # Already deleted
-        
-        customer_id = customer.get('id')
+        customer_profile_cache.evict(business_id, user_id)
         
-        # Delete customer addresses
-        addresses_ref = db_instance.collection('customer_addresses').where('customer_id', '==', customer_id)
-        addresses = addresses_ref.get()
-        for address in addresses:
-            address.reference.delete()
-        
-        # Delete payment accounts
-        accounts_ref = db_instance.collection('payment_accounts').where('customer_id', '==', customer_id)
-        accounts = accounts_ref.get()
-        for account in accounts:
-            account.reference.delete()
-        
-        # Delete WhatsApp session
-        session_ref = db_instance.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
-        session_ref.delete()
-        
-        # Anonymize orders (keep for business records but remove personal data)
-        orders_ref = db_instance.collection('orders').where('customer.id', '==', customer_id)
-        orders = orders_ref.get()
-        for order in orders:
-            order.reference.update({
-                'customer.name': 'Deleted Customer',
-                'customer.phone': 'DELETED',
-                'customer.whatsapp_number': 'DELETED',
-                'shipping_address': 'DELETED',
-                'updated_at': firestore.SERVER_TIMESTAMP
-            })
-        
-        # Delete customer record
-        customer_ref = db_instance.collection('customers').document(customer_id)
-        customer_ref.delete()
+        # Addresses, payment accounts, the session and the customer record are deleted
+        # and orders anonymized in parallel batches; an interrupted run resumes
+        stats = delete_customer(db_instance, business_id, user_id)
         
-        logger.info(f"Deleted customer data for {customer_id} in business {business_id}")
+        logger.info(f"Deleted customer data for {user_id} in business {business_id}: {stats['counts']}")
         return True
         
     except Exception as e:
@@ -1,12 +1,20 @@
-import uuid
 from datetime import datetime
 from models.session import init_user_session
-from models.cart import get_cart, clear_cart, get_cart_total
+from models.cart import get_cart_with_totals, add_clear_cart_to_batch
+from utils.ids import (
+    new_order_id, normalize_order_id, is_time_sortable_order_id, is_legacy_order_id,
+    order_id_created_at, order_id_key_range
+)
 from utils.logger import get_logger
+from config import ORDER_LINE_ITEMS_ENABLED, ORDER_LINE_ITEMS_BACKFILL_BATCH_SIZE
 from firebase_admin import firestore
+from google.api_core.exceptions import Conflict
 
 logger = get_logger(__name__)
 
+# Fields copied from each order item into the order's line_items array
+ORDER_LINE_ITEM_FIELDS = ('product_id', 'product_option_id', 'name', 'variant_details', 'price', 'quantity', 'total')
+
 def create_order(business_context, user_id):
     """Create a new order from the user's cart with business context"""
     db = business_context.get('db')
@@ -17,9 +25,17 @@ def create_order(business_context, user_id):
         return None
     
     try:
-        cart = get_cart(business_context, user_id)
+        from services import order_idempotency
+        
+        # One session read gives both the cart and its stored total
+        cart, total, _ = get_cart_with_totals(business_context, user_id)
         
         if not cart:
+            # A retry after the order was created finds the cart already cleared
+            recent_order = _get_replayed_order(business_context, order_idempotency.find_recent_order_id(db, business_id, user_id))
+            if recent_order:
+                return recent_order
+            
             logger.warning(f"Attempted to create order with empty cart for user {user_id} in business {business_id}")
             return None
         
@@ -30,11 +46,17 @@ def create_order(business_context, user_id):
                 logger.error(f"Cart contains items from different business: {item_business_id} vs {business_id}")
                 return None
         
-        # Calculate total
-        total = get_cart_total(business_context, user_id)
+        # Return the existing order for a double tap or webhook retry of the same cart
+        idempotency_keys = order_idempotency.candidate_keys(business_id, user_id, cart)
+        existing_order_id = order_idempotency.find_local_order(idempotency_keys) or order_idempotency.find_marked_order(db, idempotency_keys)
+        if existing_order_id:
+            existing_order = _get_replayed_order(business_context, existing_order_id)
+            if existing_order:
+                return existing_order
+            order_idempotency.clear_markers(db, idempotency_keys)
         
         # Generate order ID
-        order_id = f"ORD-{uuid.uuid4().hex[:8].upper()}"
+        order_id = new_order_id(business_id)
         
         # Get customer name from session if available
         from models.session import get_user_name
@@ -80,26 +102,27 @@ def create_order(business_context, user_id):
             "completed_at": None
         }
         
-        # Try to get customer ID from database
-        try:
-            customers_ref = db.collection('customers')
-            customer_query = customers_ref.where('whatsapp_number', '==', user_id).where('business_id', '==', business_id).limit(1)
-            customer_docs = customer_query.get()
-            
-            for customer_doc in customer_docs:
-                order_data["customer"]["id"] = customer_doc.id
-                customer_data = customer_doc.to_dict()
-                order_data["customer"]["name"] = customer_data.get('name', customer_name)
-                break
-        except Exception as e:
-            logger.warning(f"Could not fetch customer data: {str(e)}")
+        # Fetch the customer and all product options at the same time
+        from utils.background import map_concurrently
+        option_ids = list(dict.fromkeys(item["product_option_id"] for item in cart if item.get("product_option_id")))
+        customer_doc, options = map_concurrently(
+            lambda fetch: fetch(),
+            [
+                lambda: _find_order_customer(db, business_id, user_id),
+                lambda: _get_product_options(db, option_ids)
+            ]
+        )
         
-        # Create order document
+        if customer_doc:
+            order_data["customer"]["id"] = customer_doc.id
+            order_data["customer"]["name"] = customer_doc.to_dict().get('name', customer_name)
+        
+        # Write the order, its items and the cart clear atomically
+        batch = db.batch()
         order_ref = db.collection('orders').document(order_id)
-        order_ref.set(order_data)
         
-        # Create order items subcollection
         items_ref = order_ref.collection('items')
+        line_items = []
         for i, item in enumerate(cart):
             item_data = {
                 "product_id": item["product_id"],
@@ -114,37 +137,104 @@ def create_order(business_context, user_id):
             }
             
             # Add variant details if product option exists
-            if item.get("product_option_id"):
-                try:
-                    option_ref = db.collection('product_options').document(item["product_option_id"])
-                    option_doc = option_ref.get()
-                    if option_doc.exists:
-                        option_data = option_doc.to_dict()
-                        attributes = option_data.get('attributes', {})
-                        variant_details = []
-                        for key, value in attributes.items():
-                            if value:
-                                variant_details.append(f"{key.title()}: {value}")
-                        item_data["variant_details"] = ", ".join(variant_details)
-                except Exception as e:
-                    logger.warning(f"Could not fetch product option details: {str(e)}")
+            option_data = options.get(item.get("product_option_id"))
+            if option_data:
+                item_data["variant_details"] = format_variant_details(option_data.get('attributes', {}))
             
-            items_ref.document(f"item_{i}").set(item_data)
+            batch.set(items_ref.document(f"item_{i}"), item_data)
+            line_items.append(_line_item_summary(item_data))
+        
+        if ORDER_LINE_ITEMS_ENABLED:
+            order_data["line_items"] = line_items
+        batch.set(order_ref, order_data)
         
-        # Add order_id to the order data for return
+        add_clear_cart_to_batch(batch, business_context, user_id)
+        order_idempotency.add_markers_to_batch(batch, db, business_id, user_id, idempotency_keys, order_id)
+        
+        try:
+            batch.commit()
+        except Conflict:
+            # A concurrent attempt claimed this cart first; return its order
+            existing_order = _get_replayed_order(business_context, order_idempotency.find_marked_order(db, idempotency_keys))
+            if existing_order:
+                return existing_order
+            raise
+        
+        from services.checkout_cache import invalidate, CART_ENTRIES
+        invalidate(business_context, user_id, *CART_ENTRIES)
+        order_idempotency.remember_order(idempotency_keys + [order_idempotency.latest_order_marker_id(business_id, user_id)], order_id)
+        
+        # Add order_id and items to the order data for return
         order_data["order_id"] = order_id
+        order_data["items"] = cart
         
         logger.info(f"Created order {order_id} for user {user_id} in business {business_id}")
         
-        # Clear cart after order creation
-        clear_cart(business_context, user_id)
-        
         return order_data
         
     except Exception as e:
         logger.error(f"Error creating order for business {business_id}: {str(e)}")
         return None
 
+def _get_replayed_order(business_context, order_id):
+    """Existing order to return for a repeated checkout, or None if there is no usable one"""
+    if not order_id:
+        return None
+    
+    order = get_order_by_id_with_business_context(business_context, order_id)
+    if not order or order.get('status') == 'cancelled':
+        return None
+    
+    logger.info(f"Returning existing order {order_id} for repeated checkout in business {business_context.get('business_id')}")
+    order["items"] = []
+    order["idempotent_replay"] = True
+    return order
+
+def _find_order_customer(db, business_id, user_id):
+    """Find the customer document for an order, or None"""
+    try:
+        customers_ref = db.collection('customers')
+        customer_query = customers_ref.where('whatsapp_number', '==', user_id).where('business_id', '==', business_id).limit(1)
+        
+        for customer_doc in customer_query.get():
+            return customer_doc
+    except Exception as e:
+        logger.warning(f"Could not fetch customer data: {str(e)}")
+    
+    return None
+
+def _get_product_options(db, option_ids):
+    """Fetch product options with one batched read, keyed by option ID"""
+    if not option_ids:
+        return {}
+    
+    try:
+        option_refs = [db.collection('product_options').document(option_id) for option_id in option_ids]
+        return {doc.id: doc.to_dict() for doc in db.get_all(option_refs) if doc.exists}
+    except Exception as e:
+        logger.warning(f"Could not fetch product option details: {str(e)}")
+        return {}
+
+def _line_item_summary(item):
+    """Compact copy of an order item for the order's line_items array"""
+    return {field: item.get(field) for field in ORDER_LINE_ITEM_FIELDS}
+
+def get_order_line_items(db, order_id, order=None):
+    """An order's line items from the order document, falling back to its items subcollection"""
+    if order and order.get('line_items') is not None:
+        return order['line_items']
+    
+    items = db.collection('orders').document(order_id).collection('items').get()
+    return [item_doc.to_dict() for item_doc in items]
+
+def format_variant_details(attributes):
+    """Format product option attributes as "Key: value" pairs"""
+    variant_details = []
+    for key, value in attributes.items():
+        if value:
+            variant_details.append(f"{key.title()}: {value}")
+    return ", ".join(variant_details)
+
 def get_user_orders(business_context, user_id):
     """Get all orders for a user within the current business context"""
     db = business_context.get('db')
@@ -178,6 +268,7 @@ def get_order_by_id(order_id):
     """Get an order by its ID (business context will be validated by caller)"""
     # Note: This function doesn't take business_context because order_id should be unique
     # Business validation should be done by the caller
+    order_id = normalize_order_id(order_id)
     try:
         # Try to get from environment first (for backward compatibility)
         from config import db
@@ -207,6 +298,7 @@ def get_order_by_id_with_business_context(business_context, order_id):
     if not db or not business_id:
         return None
     
+    order_id = normalize_order_id(order_id)
     try:
         order_ref = db.collection('orders').document(order_id)
         order_doc = order_ref.get()
@@ -258,6 +350,11 @@ def update_order_status(order_id, status):
         # Add to order history
         add_order_note(order_id, f"Status changed to: {status}")
         
+        # Stock held for a shipped order is sold, not just reserved
+        from services.inventory_holds import fulfill_order_holds, FULFILLED_ORDER_STATUSES
+        if status in FULFILLED_ORDER_STATUSES:
+            fulfill_order_holds(db, order_id)
+        
         logger.info(f"Updated order {order_id} status to {status}")
         return True
         
@@ -265,6 +362,135 @@ def update_order_status(order_id, status):
         logger.error(f"Error updating order status: {str(e)}")
         return False
 
+def confirm_order(business_context, user_id, order_id, payment_status=None):
+    """
+    Confirm an order in one transaction
+
+    Covers the order and payment status, committing the order's inventory
+    holds, the customer's total_whatsapp_orders counter, order history and
+    the order_completed analytics event, so a failure leaves nothing half
+    written. Confirming an already confirmed order changes nothing; a cancelled
+    order (whose holds were released) is not confirmed.
+
+    If the order's holds expired before it was confirmed, they are placed
+    again first; HoldsExpiredError is raised when the stock is gone.
+    Returns the confirmed order, or None on failure.
+    """
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+    
+    if not db or not business_id:
+        return None
+    
+    from services.inventory_holds import (
+        read_active_order_holds, commit_holds_in_transaction, record_committed_holds, HoldsExpiredError
+    )
+    
+    order_ref = db.collection('orders').document(order_id)
+    customer_query = db.collection('customers').where(
+        filter=firestore.FieldFilter('whatsapp_number', '==', user_id)
+    ).where(
+        filter=firestore.FieldFilter('business_id', '==', business_id)
+    ).limit(1)
+    
+    @firestore.transactional
+    def confirm(transaction):
+        # All reads come before any write
+        order_doc = order_ref.get(transaction=transaction)
+        if not order_doc.exists:
+            return None, 0
+        
+        order = order_doc.to_dict()
+        order["order_id"] = order_id
+        if order.get('business_id') != business_id:
+            logger.warning(f"Order {order_id} does not belong to business {business_id}")
+            return None, 0
+        
+        if order.get('status') == 'confirmed':
+            return order, 0
+        
+        if order.get('status') == 'cancelled':
+            logger.warning(f"Order {order_id} was cancelled and can't be confirmed")
+            return None, 0
+        
+        hold_docs = read_active_order_holds(transaction, db, order_id)
+        if not hold_docs and order.get('inventory_hold_status'):
+            # The reaper released the stock; confirming now would sell it unreserved
+            raise HoldsExpiredError(order_id)
+        customer_docs = list(transaction.get(customer_query))
+        
+        now = datetime.now()
+        order_update = {'status': 'confirmed', 'updated_at': now}
+        if payment_status:
+            order_update['payment_status'] = payment_status
+        if hold_docs:
+            order_update['inventory_hold_status'] = 'committed'
+        transaction.update(order_ref, order_update)
+        order.update(order_update)
+        
+        history_ref = db.collection('order_history')
+        for note in ["Status changed to: confirmed"] + ([f"Payment status changed to: {payment_status}"] if payment_status else []):
+            transaction.set(history_ref.document(), {
+                "order_id": order_id,
+                "status": note,
+                "notes": note,
+                "notification_sent": False,
+                "created_by": "system",
+                "created_at": now
+            })
+        
+        committed = commit_holds_in_transaction(transaction, hold_docs)
+        
+        if customer_docs:
+            transaction.update(customer_docs[0].reference, {
+                'total_whatsapp_orders': firestore.Increment(1),
+                'last_whatsapp_interaction': firestore.SERVER_TIMESTAMP
+            })
+        
+        transaction.set(db.collection('whatsapp_analytics').document(), {
+            'event_type': 'order_completed',
+            'user_id': user_id,
+            'business_id': business_id,
+            'metadata': {
+                'order_id': order_id,
+                'order_total': order.get('total', 0),
+                'item_count': order.get('item_count', 0),
+                'payment_method': order.get('payment_details', {}).get('method', 'unknown')
+            },
+            'created_at': firestore.SERVER_TIMESTAMP
+        })
+        
+        return order, committed
+    
+    try:
+        try:
+            order, committed = confirm(db.transaction())
+        except HoldsExpiredError:
+            if not _replace_order_holds(business_context, user_id, order_id):
+                raise
+            order, committed = confirm(db.transaction())
+        record_committed_holds(committed)
+        
+        if order:
+            logger.info(f"Confirmed order {order_id} for business {business_id}")
+        return order
+        
+    except HoldsExpiredError:
+        logger.warning(f"Stock for order {order_id} is no longer available; its holds expired")
+        raise
+    except Exception as e:
+        logger.error(f"Error confirming order {order_id} for business {business_id}: {str(e)}")
+        return None
+
+def _replace_order_holds(business_context, user_id, order_id):
+    """Hold an order's stock again after its holds expired; False if it is no longer available"""
+    from services.inventory_holds import place_order_holds
+    
+    db = business_context.get('db')
+    order = db.collection('orders').document(order_id).get().to_dict() or {}
+    logger.info(f"Holds of order {order_id} expired before confirmation; placing them again")
+    return place_order_holds(business_context, order_id, user_id, get_order_line_items(db, order_id, order))
+
 def update_payment_status(order_id, status):
     """Update an order's payment status"""
     try:
@@ -342,6 +568,36 @@ def set_shipping_method(order_id, method):
         logger.error(f"Error setting shipping method: {str(e)}")
         return False
 
+def set_delivery_quote(order_id, quote):
+    """Apply a delivery zone quote to an order: shipping fee, method, ETA and total"""
+    try:
+        from config import db
+        if not db:
+            return False
+        
+        order_ref = db.collection('orders').document(order_id)
+        order = order_ref.get(field_paths=['subtotal', 'tax']).to_dict() or {}
+        shipping_fee = quote.get('fee', 0)
+        
+        order_ref.update({
+            'shipping_fee': shipping_fee,
+            'shipping_method': quote.get('zone_name'),
+            'delivery_zone': quote.get('zone_id'),
+            'estimated_delivery': quote.get('eta'),
+            'total': order.get('subtotal', 0) + order.get('tax', 0) + shipping_fee,
+            'updated_at': datetime.now()
+        })
+        
+        # Add to order history
+        add_order_note(order_id, f"Delivery zone set to: {quote.get('zone_name')} (fee {shipping_fee:.2f})")
+        
+        logger.info(f"Applied delivery zone {quote.get('zone_id')} to order {order_id}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error applying delivery quote: {str(e)}")
+        return False
+
 def set_tracking_number(order_id, tracking_number):
     """Set an order's tracking number"""
     try:
@@ -388,10 +644,10 @@ def add_order_note(order_id, note):
         logger.error(f"Error adding order note: {str(e)}")
         return False
 
-def format_order_summary(order_id):
-    """Format a text summary of an order"""
+def format_order_summary(order_id, order=None):
+    """Format a text summary of an order (pass the order if it has already been read)"""
     try:
-        order = get_order_by_id(order_id)
+        order = order or get_order_by_id(order_id)
         
         if not order:
             return "Order not found."
@@ -411,16 +667,14 @@ def format_order_summary(order_id):
         summary += f"*Date:* {date_str}\n"
         summary += f"*Payment:* {order['payment_status'].title()}\n\n"
         
-        # Get order items from subcollection
+        # Get order items from the order document, or the subcollection for older orders
         try:
             from config import db
             if db:
-                items_ref = db.collection('orders').document(order_id).collection('items')
-                items = items_ref.get()
+                items = get_order_line_items(db, order['order_id'], order)
                 
                 summary += "*Items:*\n"
-                for item_doc in items:
-                    item = item_doc.to_dict()
+                for item in items:
                     item_name = item.get('name', 'Unknown Item')
                     item_quantity = item.get('quantity', 1)
                     item_total = item.get('total', 0)
@@ -495,8 +749,15 @@ def parse_address_string(address_string):
         logger.error(f"Error parsing address string: {str(e)}")
         return {}
 
-def get_business_orders(business_context, limit=50, status=None):
-    """Get orders for a specific business with optional filtering"""
+def get_business_orders(business_context, limit=50, status=None, before_order_id=None):
+    """
+    Get orders for a specific business, newest first, with optional filtering
+
+    Pass the last order ID of a page as before_order_id to get the next page.
+    Unfiltered listings are served from the order ID key range (composite
+    index business_id ASC, __name__ DESC); orders with legacy IDs follow,
+    ordered by created_at.
+    """
     db = business_context.get('db')
     business_id = business_context.get('business_id')
     
@@ -504,23 +765,25 @@ def get_business_orders(business_context, limit=50, status=None):
         return []
     
     try:
-        orders_ref = db.collection('orders').where(
-            filter=firestore.FieldFilter('business_id', '==', business_id)
-        ).order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit)
-        
-        # Add status filter if provided
         if status:
+            orders_ref = db.collection('orders').where(
+                filter=firestore.FieldFilter('business_id', '==', business_id)
+            ).order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit)
+            
+            # Add status filter if provided
             orders_ref = orders_ref.where(
                 filter=firestore.FieldFilter('status', '==', status)
             )
+            
+            return _order_list(orders_ref.get())
         
-        orders = orders_ref.get()
-        
+        before_order_id = normalize_order_id(before_order_id) if before_order_id else None
         order_list = []
-        for order in orders:
-            order_data = order.to_dict()
-            order_data["order_id"] = order.id
-            order_list.append(order_data)
+        if not is_legacy_order_id(before_order_id):
+            order_list = _get_orders_by_key_range(db, business_id, limit, before_order_id)
+        
+        if len(order_list) < limit:
+            order_list += _get_legacy_orders(db, business_id, limit - len(order_list), before_order_id, order_list)
         
         return order_list
         
@@ -528,6 +791,78 @@ def get_business_orders(business_context, limit=50, status=None):
         logger.error(f"Error getting business orders: {str(e)}")
         return []
 
+def get_recent_business_orders(business_context, since, limit=50):
+    """Get a business's orders created since a time, newest first, from the order ID key range"""
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+    
+    if not db or not business_id:
+        return []
+    
+    try:
+        return _get_orders_by_key_range(db, business_id, limit, since=since)
+        
+    except Exception as e:
+        logger.error(f"Error getting recent orders for business {business_id}: {str(e)}")
+        return []
+
+def _order_list(order_docs):
+    order_list = []
+    for order in order_docs:
+        order_data = order.to_dict()
+        order_data["order_id"] = order.id
+        order_list.append(order_data)
+    return order_list
+
+def _get_orders_by_key_range(db, business_id, limit, before_order_id=None, since=None):
+    """Orders with time-sortable IDs, newest first, read straight from the document key range"""
+    orders_collection = db.collection('orders')
+    low, high = order_id_key_range(business_id, since, before_order_id)
+    
+    order_list = []
+    while len(order_list) < limit:
+        page_size = limit - len(order_list)
+        orders_ref = orders_collection.where(
+            filter=firestore.FieldFilter('business_id', '==', business_id)
+        ).where(
+            filter=firestore.FieldFilter('__name__', '>=', orders_collection.document(low))
+        ).where(
+            filter=firestore.FieldFilter('__name__', '<', orders_collection.document(high))
+        ).order_by('__name__', direction=firestore.Query.DESCENDING).limit(page_size)
+        
+        page = _order_list(orders_ref.get())
+        # Legacy IDs can sort into the range by accident; they are listed separately
+        order_list += [order for order in page if is_time_sortable_order_id(order["order_id"])]
+        
+        if len(page) < page_size:
+            break
+        high = page[-1]["order_id"]
+    
+    return order_list
+
+def _get_legacy_orders(db, business_id, limit, before_order_id, newer_orders):
+    """Orders with legacy IDs, newest first; they carry no time so they are paged by created_at"""
+    orders_ref = db.collection('orders').where(
+        filter=firestore.FieldFilter('business_id', '==', business_id)
+    ).order_by('created_at', direction=firestore.Query.DESCENDING)
+    
+    if is_legacy_order_id(before_order_id):
+        before_doc = db.collection('orders').document(before_order_id).get()
+        if not before_doc.exists:
+            return []
+        orders_ref = orders_ref.start_after(before_doc)
+    else:
+        # Every legacy order predates the oldest time-sortable one listed so far
+        cutoff = order_id_created_at(newer_orders[-1]["order_id"]) if newer_orders else order_id_created_at(before_order_id)
+        if cutoff:
+            orders_ref = orders_ref.where(filter=firestore.FieldFilter('created_at', '<', cutoff))
+    
+    legacy_orders = []
+    for order in _order_list(orders_ref.limit(limit).get()):
+        if not is_time_sortable_order_id(order["order_id"]):
+            legacy_orders.append(order)
+    return legacy_orders
+
 def get_order_analytics(business_context, start_date=None, end_date=None):
     """Get order analytics for a business within a date range"""
     db = business_context.get('db')
@@ -633,17 +968,18 @@ def cancel_order(business_context, order_id, reason="Customer request"):
         update_order_status(order_id, 'cancelled')
         
         # Release reserved inventory if any
-        if order.get('inventory_reserved', False):
+        if order.get('inventory_hold_status') in ('active', 'committed'):
+            from services.inventory_holds import release_order_holds
+            release_order_holds(business_context, order_id, status='cancelled')
+        elif order.get('inventory_reserved', False) and not order.get('inventory_hold_status'):
             try:
                 # Get order items and release inventory
                 db = business_context.get('db')
                 if db:
-                    items_ref = db.collection('orders').document(order_id).collection('items')
-                    items = items_ref.get()
+                    items = get_order_line_items(db, order_id, order)
                     
                     from services.inventory import release_inventory
-                    for item_doc in items:
-                        item = item_doc.to_dict()
+                    for item in items:
                         product_id = item.get('product_id')
                         quantity = item.get('quantity', 0)
                         if product_id and quantity > 0:
@@ -688,4 +1024,49 @@ def migrate_order_to_business_context(order_id, business_id):
         
     except Exception as e:
         logger.error(f"Error migrating order to business context: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+def backfill_order_line_items(db, business_id=None, batch_size=ORDER_LINE_ITEMS_BACKFILL_BATCH_SIZE, start_after_order_id=None):
+    """
+    Add the line_items array to existing orders that don't have one
+
+    Pages through orders by document ID and updates each page in one batch,
+    so it can be stopped and resumed with the last order ID it logged.
+    Returns counts of orders scanned and updated.
+    """
+    stats = {"scanned": 0, "updated": 0, "last_order_id": start_after_order_id}
+    
+    orders_ref = db.collection('orders')
+    if business_id:
+        orders_ref = orders_ref.where(filter=firestore.FieldFilter('business_id', '==', business_id))
+    orders_ref = orders_ref.order_by('__name__').select(['line_items']).limit(batch_size)
+    
+    while True:
+        page_ref = orders_ref
+        if stats["last_order_id"]:
+            page_ref = page_ref.start_after({'__name__': db.collection('orders').document(stats["last_order_id"])})
+        
+        order_docs = list(page_ref.stream())
+        if not order_docs:
+            break
+        
+        missing = [order_doc for order_doc in order_docs if (order_doc.to_dict() or {}).get('line_items') is None]
+        if missing:
+            # Read the items subcollections of the page in parallel
+            from utils.background import map_concurrently
+            page_items = map_concurrently(lambda order_doc: get_order_line_items(db, order_doc.id), missing)
+            
+            batch = db.batch()
+            for order_doc, items in zip(missing, page_items):
+                batch.update(order_doc.reference, {"line_items": [_line_item_summary(item) for item in items]})
+            batch.commit()
+            stats["updated"] += len(missing)
+        
+        stats["scanned"] += len(order_docs)
+        stats["last_order_id"] = order_docs[-1].id
+        logger.info(f"Backfilled line items up to order {stats['last_order_id']} ({stats['updated']}/{stats['scanned']} updated)")
+        
+        if len(order_docs) < batch_size:
+            break
+    
+    return stats
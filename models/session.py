@@ -5,6 +5,13 @@ from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Cart fields are written by models.cart in transactions; session saves leave them alone
+CART_FIELDS = ('cart', 'cart_total', 'cart_item_count', 'cart_version')
+
+def _session_fields(session):
+    """Session data to save, without the cart fields"""
+    return {key: value for key, value in session.items() if key not in CART_FIELDS}
+
 def init_user_session(business_id, user_id):
     """Initialize a new user session or return existing one with business context"""
     
@@ -44,7 +51,7 @@ def init_user_session(business_id, user_id):
         # Save to database if available
         if database_service:
             try:
-                database_service.save_session(business_id, user_id, session_data)
+                database_service.save_session(business_id, user_id, _session_fields(session_data))
             except Exception as e:
                 logger.error(f"Error saving session to database: {str(e)}")
         
@@ -56,7 +63,7 @@ def init_user_session(business_id, user_id):
         # Save updated timestamp to database
         if database_service:
             try:
-                database_service.save_session(business_id, user_id, business_sessions[user_id])
+                database_service.save_session(business_id, user_id, _session_fields(business_sessions[user_id]))
             except Exception as e:
                 logger.error(f"Error updating session in database: {str(e)}")
         
@@ -87,7 +94,7 @@ def update_session_history(business_id, user_id, role, content):
     # Save to database if available
     if database_service:
         try:
-            database_service.save_session(business_id, user_id, session)
+            database_service.save_session(business_id, user_id, _session_fields(session))
         except Exception as e:
             logger.error(f"Error saving session history to database: {str(e)}")
 
@@ -109,7 +116,7 @@ def mark_user_returning(business_id, user_id):
     # Save to database if available
     if database_service:
         try:
-            database_service.save_session(business_id, user_id, session)
+            database_service.save_session(business_id, user_id, _session_fields(session))
         except Exception as e:
             logger.error(f"Error marking user returning in database: {str(e)}")
 
@@ -128,7 +135,7 @@ def set_current_action(business_id, user_id, action):
     # Save to database if available
     if database_service:
         try:
-            database_service.save_session(business_id, user_id, session)
+            database_service.save_session(business_id, user_id, _session_fields(session))
         except Exception as e:
             logger.error(f"Error setting current action in database: {str(e)}")
 
@@ -150,7 +157,7 @@ def set_last_context(business_id, user_id, context):
     # Save to database if available
     if database_service:
         try:
-            database_service.save_session(business_id, user_id, session)
+            database_service.save_session(business_id, user_id, _session_fields(session))
         except Exception as e:
             logger.error(f"Error setting last context in database: {str(e)}")
 
@@ -172,7 +179,7 @@ def set_user_name(business_id, user_id, name):
     # Save to database if available
     if database_service:
         try:
-            database_service.save_session(business_id, user_id, session)
+            database_service.save_session(business_id, user_id, _session_fields(session))
         except Exception as e:
             logger.error(f"Error setting user name in database: {str(e)}")
 
@@ -201,6 +208,8 @@ def clear_session(business_id, user_id):
         "business_id": business_id,
         "history": [],
         "cart": [],
+        "cart_total": 0,
+        "cart_item_count": 0,
         "current_action": None,
         "last_context": None,
         "inventory_results": None,
@@ -242,7 +251,7 @@ def set_inventory_results(business_id, user_id, inventory_results):
     # Save to database if available
     if database_service:
         try:
-            database_service.save_session(business_id, user_id, session)
+            database_service.save_session(business_id, user_id, _session_fields(session))
         except Exception as e:
             logger.error(f"Error setting inventory results in database: {str(e)}")
 
@@ -265,7 +274,7 @@ def clear_inventory_decision(business_id, user_id):
     # Save to database if available
     if database_service:
         try:
-            database_service.save_session(business_id, user_id, session)
+            database_service.save_session(business_id, user_id, _session_fields(session))
         except Exception as e:
             logger.error(f"Error clearing inventory decision in database: {str(e)}")
 
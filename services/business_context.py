@@ -40,6 +40,9 @@ class BusinessContext:
         # Feature flags
         self.inventory_check_enabled = config.is_inventory_check_enabled()
         self.auto_reply_enabled = config.is_auto_reply_enabled()
+        
+        # Inbound message handling
+        self.message_debounce_ms = config.get_message_debounce_ms()
     
     def get_greeting_message(self) -> str:
         """Get business-specific greeting message"""
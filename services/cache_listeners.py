@@ -0,0 +1,307 @@
+"""
+Real-time cache invalidation
+Keeps in-memory caches current with Firestore snapshot listeners
+
+Optional, enabled with CACHE_LISTENERS_ENABLED. For every active business,
+listeners on inventory, product_options, products, business_settings and
+whatsapp_configs apply changed documents to the in-memory caches as they
+happen (product_options keeps the inventory snapshot's SKU index current). The first
+snapshot after a listener (re)connects reloads that cache wholesale; after
+that only the changed documents are applied.
+
+The apply_* functions only touch in-memory caches, so they can be driven
+directly with fake documents and changes in tests, or by the Firestore
+emulator through the real listeners.
+"""
+
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from firebase_admin import firestore
+
+from config import CACHE_LISTENERS_ENABLED, CACHE_LISTENER_CHECK_SECONDS, CACHE_LISTENER_MAX_BUSINESSES
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+LISTENED_COLLECTIONS = ('inventory', 'product_options', 'products', 'business_settings', 'whatsapp_configs')
+
+
+def _change_type(change) -> str:
+    """Name of a DocumentChange type: ADDED, MODIFIED or REMOVED"""
+    return getattr(change.type, 'name', str(change.type))
+
+
+def _doc_exists(doc) -> bool:
+    return getattr(doc, 'exists', True)
+
+
+def apply_inventory_snapshot(business_id: str, docs: List[Any], changes: List[Any], initial: bool,
+                             sku_index: Optional[Dict[str, str]] = None):
+    """Apply an inventory listener snapshot to the inventory cache"""
+    from services.inventory import apply_inventory_changes, build_inventory_snapshot, set_inventory_snapshot
+
+    if initial:
+        inventory_docs = [(doc.id, doc.to_dict()) for doc in docs]
+        set_inventory_snapshot(business_id, build_inventory_snapshot(business_id, inventory_docs, sku_index or {}, live=True))
+        return
+
+    changed_docs = [(change.document.id, change.document.to_dict()) for change in changes if _change_type(change) != 'REMOVED']
+    removed_doc_ids = [change.document.id for change in changes if _change_type(change) == 'REMOVED']
+    apply_inventory_changes(business_id, changed_docs, removed_doc_ids)
+
+
+def apply_product_options_snapshot(business_id: str, docs: List[Any], changes: List[Any], initial: bool):
+    """Apply a product_options listener snapshot to the SKU index of the inventory cache"""
+    from services.inventory import apply_sku_changes
+
+    if initial:
+        apply_sku_changes(business_id, {doc.id: (doc.to_dict() or {}).get('sku') for doc in docs}, replace=True)
+        return
+
+    option_skus = {
+        change.document.id: (change.document.to_dict() or {}).get('sku')
+        for change in changes if _change_type(change) != 'REMOVED'
+    }
+    removed_option_ids = [change.document.id for change in changes if _change_type(change) == 'REMOVED']
+    apply_sku_changes(business_id, option_skus, removed_option_ids)
+
+
+def apply_products_snapshot(business_id: str, docs: List[Any], changes: List[Any], initial: bool):
+    """Apply a products listener snapshot to the business product cache"""
+    import config
+
+    if initial:
+        # Swap in a complete new dict so readers never see a partial reload
+        config.business_product_cache[business_id] = {doc.id: doc.to_dict() for doc in docs}
+        return
+
+    product_cache = dict(config.get_business_cache(business_id, 'products'))
+    for change in changes:
+        if _change_type(change) == 'REMOVED':
+            product_cache.pop(change.document.id, None)
+        else:
+            product_cache[change.document.id] = change.document.to_dict()
+    config.business_product_cache[business_id] = product_cache
+
+
+def apply_business_settings_snapshot(business_id: str, docs: List[Any], changes: List[Any], initial: bool):
+    """Apply a business_settings document snapshot to cached business configs"""
+    from models.business import BusinessManager
+
+    from services.delivery_zones import apply_delivery_zone_settings
+    from services.settings_cache import apply_settings_cache_update
+
+    doc = docs[0] if docs else None
+    settings = doc.to_dict() if doc is not None and _doc_exists(doc) else None
+    BusinessManager.apply_settings_update(business_id, settings)
+    apply_delivery_zone_settings(business_id, settings)
+    apply_settings_cache_update(business_id, settings)
+
+
+def apply_whatsapp_configs_snapshot(business_id: str, docs: List[Any], changes: List[Any], initial: bool):
+    """Apply a whatsapp_configs listener snapshot to cached business configs"""
+    from models.business import BusinessManager
+
+    active_config = None
+    for doc in docs:
+        config_data = doc.to_dict() or {}
+        if config_data.get('active'):
+            active_config = config_data
+            break
+
+    BusinessManager.apply_whatsapp_config_update(business_id, active_config)
+
+
+class BusinessCacheListeners:
+    """Snapshot listeners keeping one business's caches current"""
+
+    def __init__(self, db, business_id: str):
+        self.db = db
+        self.business_id = business_id
+        self.watches = {}
+        self.initial_pending = {}
+        self.started_at = None
+        self.reconnects = 0
+        self.changes_applied = {name: 0 for name in LISTENED_COLLECTIONS}
+        self.last_change_at = None
+        self.errors = 0
+
+    def _listen_target(self, name: str):
+        if name == 'business_settings':
+            return self.db.collection('business_settings').document(self.business_id)
+        return self.db.collection(name).where(filter=firestore.FieldFilter('business_id', '==', self.business_id))
+
+    def _subscribe(self, name: str):
+        self.initial_pending[name] = True
+        self.watches[name] = self._listen_target(name).on_snapshot(
+            lambda docs, changes, read_time, name=name: self.on_snapshot(name, docs, changes, read_time)
+        )
+
+    def start(self):
+        """Subscribe to every listened collection"""
+        self.started_at = datetime.now()
+        for name in LISTENED_COLLECTIONS:
+            self._subscribe(name)
+        logger.info(f"Started cache listeners for business {self.business_id}")
+
+    def on_snapshot(self, name: str, docs, changes, read_time=None):
+        """Listener callback: apply a snapshot to the matching cache"""
+        initial = self.initial_pending.get(name, True)
+        self.initial_pending[name] = False
+
+        try:
+            if name == 'inventory':
+                from services.inventory import build_sku_index
+                sku_index = build_sku_index(self.db, self.business_id) if initial else None
+                apply_inventory_snapshot(self.business_id, docs, changes, initial, sku_index)
+            elif name == 'product_options':
+                apply_product_options_snapshot(self.business_id, docs, changes, initial)
+            elif name == 'products':
+                apply_products_snapshot(self.business_id, docs, changes, initial)
+            elif name == 'business_settings':
+                apply_business_settings_snapshot(self.business_id, docs, changes, initial)
+            elif name == 'whatsapp_configs':
+                apply_whatsapp_configs_snapshot(self.business_id, docs, changes, initial)
+
+            if initial and name == 'whatsapp_configs':
+                from models.business import live_config_businesses
+                live_config_businesses.add(self.business_id)
+
+            if initial and name == 'product_options' and not self.initial_pending.get('inventory', True):
+                # A reconnected SKU listener makes the inventory snapshot live again
+                from services.inventory import set_inventory_snapshot_live
+                set_inventory_snapshot_live(self.business_id, True)
+
+            self.changes_applied[name] += len(changes or [])
+            self.last_change_at = datetime.now()
+
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error applying {name} snapshot for business {self.business_id}: {str(e)}")
+
+    def check_health(self):
+        """Resubscribe any listener whose stream has closed; its first snapshot reloads the cache"""
+        for name, watch in list(self.watches.items()):
+            if getattr(watch, 'is_active', True):
+                continue
+
+            logger.warning(f"Cache listener for {name} of business {self.business_id} disconnected; reconnecting")
+            self.reconnects += 1
+            self._mark_not_live(name)
+            try:
+                self._subscribe(name)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error reconnecting {name} listener for business {self.business_id}: {str(e)}")
+
+    def _mark_not_live(self, name: str):
+        """Fall back to TTL caching for a cache whose listener is down"""
+        if name in ('inventory', 'product_options'):
+            from services.inventory import set_inventory_snapshot_live
+            set_inventory_snapshot_live(self.business_id, False)
+        elif name in ('business_settings', 'whatsapp_configs'):
+            from models.business import live_config_businesses
+            live_config_businesses.discard(self.business_id)
+        elif name == 'products':
+            import config
+            config.business_product_cache.pop(self.business_id, None)
+
+    def stop(self):
+        """Unsubscribe every listener"""
+        for name, watch in list(self.watches.items()):
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                logger.warning(f"Error unsubscribing {name} listener for business {self.business_id}: {str(e)}")
+            self._mark_not_live(name)
+        self.watches.clear()
+        logger.info(f"Stopped cache listeners for business {self.business_id}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "active": {name: bool(getattr(watch, 'is_active', True)) for name, watch in self.watches.items()},
+            "changes_applied": dict(self.changes_applied),
+            "last_change_at": self.last_change_at.isoformat() if self.last_change_at else None,
+            "reconnects": self.reconnects,
+            "errors": self.errors
+        }
+
+
+# Listeners per business
+_business_listeners: Dict[str, BusinessCacheListeners] = {}
+_listeners_lock = threading.Lock()
+
+_supervisor_thread = None
+_supervisor_stop = threading.Event()
+
+
+def ensure_cache_listeners(db, business_id: str) -> bool:
+    """Start listeners for a business the first time it becomes active (no-op when disabled)"""
+    if not CACHE_LISTENERS_ENABLED or not db or not business_id:
+        return False
+
+    if business_id in _business_listeners:
+        return True
+
+    with _listeners_lock:
+        if business_id in _business_listeners:
+            return True
+
+        if len(_business_listeners) >= CACHE_LISTENER_MAX_BUSINESSES:
+            logger.warning(f"Cache listener limit reached; business {business_id} uses TTL caching")
+            return False
+
+        listeners = BusinessCacheListeners(db, business_id)
+        try:
+            listeners.start()
+        except Exception as e:
+            logger.error(f"Error starting cache listeners for business {business_id}: {str(e)}")
+            listeners.stop()
+            return False
+
+        _business_listeners[business_id] = listeners
+
+    _start_supervisor()
+    return True
+
+
+def stop_cache_listeners(business_id: Optional[str] = None):
+    """Stop listeners for one business, or for all businesses"""
+    with _listeners_lock:
+        business_ids = [business_id] if business_id else list(_business_listeners)
+        for listened_business_id in business_ids:
+            listeners = _business_listeners.pop(listened_business_id, None)
+            if listeners:
+                listeners.stop()
+
+        if not _business_listeners:
+            _supervisor_stop.set()
+
+
+def get_listener_stats() -> Dict[str, Any]:
+    """Listener status and change counts per business"""
+    return {
+        "enabled": CACHE_LISTENERS_ENABLED,
+        "businesses": {business_id: listeners.get_stats() for business_id, listeners in list(_business_listeners.items())}
+    }
+
+
+def _start_supervisor():
+    """Periodically reconnect listeners whose streams have closed"""
+    global _supervisor_thread
+
+    if _supervisor_thread and _supervisor_thread.is_alive():
+        return
+
+    _supervisor_stop.clear()
+
+    def run():
+        while not _supervisor_stop.wait(CACHE_LISTENER_CHECK_SECONDS):
+            for listeners in list(_business_listeners.values()):
+                listeners.check_health()
+
+    _supervisor_thread = threading.Thread(target=run, name="cache-listener-supervisor", daemon=True)
+    _supervisor_thread.start()
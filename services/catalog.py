@@ -202,6 +202,12 @@ def get_product_by_retailer_id(business_context, retailer_id, catalog_id=None):
     db = business_context.get('db')
     business_id = business_context.get('business_id')
     
+    # Products kept current by a snapshot listener need no read
+    from config import business_product_cache
+    cached_product = business_product_cache.get(business_id, {}).get(retailer_id)
+    if cached_product:
+        return cached_product
+    
     # Check Firebase first
     if db and business_id:
         try:
@@ -0,0 +1,116 @@
+"""
+Checkout prefetch cache
+Starts the lookups checkout needs as soon as it begins and keeps the results per user
+
+handle_checkout submits the customer, payment account, address and
+inventory lookups to the background pool at once. Later checkout steps ask
+this cache first and only query Firestore again if the entry is missing,
+expired, failed or was invalidated by a write (cart change, new payment
+account or address).
+"""
+
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Tuple
+
+from config import CHECKOUT_CACHE_TTL_SECONDS, CHECKOUT_PREFETCH_WAIT_SECONDS
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# (business_id, user_id) -> {name: (future, expires at monotonic time)}
+_checkout_cache: Dict[Tuple[str, str], Dict[str, Tuple[Future, float]]] = {}
+_cache_lock = threading.Lock()
+
+# Entries that depend on the cart contents
+CART_ENTRIES = ('cart', 'inventory')
+
+
+def _cache_key(business_context, user_id) -> Tuple[str, str]:
+    return (business_context.get('business_id'), user_id)
+
+
+def _store(business_context, user_id, name: str, future: Future):
+    expires_at = time.monotonic() + CHECKOUT_CACHE_TTL_SECONDS
+    with _cache_lock:
+        _checkout_cache.setdefault(_cache_key(business_context, user_id), {})[name] = (future, expires_at)
+
+
+def _submit(business_context, user_id, name: str, func: Callable, *args):
+    from utils.background import run_in_background
+    _store(business_context, user_id, name, run_in_background(func, *args))
+
+
+def remember(business_context, user_id, name: str, value: Any):
+    """Cache a value that is already known, e.g. the cart handle_checkout just read"""
+    future = Future()
+    future.set_result(value)
+    _store(business_context, user_id, name, future)
+
+
+def start_checkout_prefetch(business_context, user_id, user_name=None):
+    """Start every lookup the checkout flow will need, concurrently"""
+    from models.customer import get_or_create_customer, get_customer_payment_accounts, get_customer_addresses
+
+    _prune_expired()
+    invalidate(business_context, user_id)
+
+    _submit(business_context, user_id, 'customer', get_or_create_customer, business_context, user_id, user_name)
+    _submit(business_context, user_id, 'payment_accounts', get_customer_payment_accounts, business_context, user_id)
+    _submit(business_context, user_id, 'addresses', get_customer_addresses, business_context, user_id)
+
+
+def prefetch_inventory(business_context, user_id, cart):
+    """Start the inventory check for a cart in the background"""
+    from services.inventory import check_inventory_availability
+    _submit(business_context, user_id, 'inventory', check_inventory_availability, business_context, cart)
+
+
+def get_prefetched(business_context, user_id, name: str, loader: Callable[[], Any]) -> Any:
+    """
+    A prefetched lookup result, waiting briefly if it is still running
+
+    Falls back to calling loader() when there is no fresh entry or the
+    lookup failed or didn't finish in time.
+    """
+    with _cache_lock:
+        entry = _checkout_cache.get(_cache_key(business_context, user_id), {}).get(name)
+
+    if entry and entry[1] >= time.monotonic():
+        try:
+            value = entry[0].result(timeout=CHECKOUT_PREFETCH_WAIT_SECONDS)
+            if value is not None:
+                return value
+        except FutureTimeoutError:
+            logger.warning(f"Prefetched {name} for user {user_id} not ready; querying directly")
+
+    value = loader()
+    if value is not None:
+        remember(business_context, user_id, name, value)
+    return value
+
+
+def invalidate(business_context, user_id, *names: str):
+    """Drop cached entries for a user (all of them if no names are given)"""
+    key = _cache_key(business_context, user_id)
+    with _cache_lock:
+        if not names:
+            _checkout_cache.pop(key, None)
+            return
+
+        entries = _checkout_cache.get(key)
+        if entries:
+            for name in names:
+                entries.pop(name, None)
+
+
+def _prune_expired():
+    now = time.monotonic()
+    with _cache_lock:
+        for key in list(_checkout_cache):
+            entries = _checkout_cache[key]
+            for name in [name for name, (_, expires_at) in entries.items() if expires_at < now]:
+                del entries[name]
+            if not entries:
+                del _checkout_cache[key]
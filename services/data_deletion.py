@@ -0,0 +1,306 @@
+"""
+Customer data deletion
+Bulk, resumable deletion of a customer's data or of all customer data of a business
+
+A deletion is planned as a list of steps, each a query (or fixed documents)
+in one collection plus an action: delete, or anonymize for orders (and the
+inventory holds of orders), which the business keeps for its records.
+Inventory holds give back their reserved stock first: all of them when a
+business's orders are deleted, only active ones when a customer's orders
+are kept, so committed holds still sell their stock when the order
+ships. Each step is paged through with
+projected queries (document names only), ordered by document ID. Each page
+is split into batches of 500 writes, and the batches are committed in
+parallel. Subcollections (order items) are deleted before their parents.
+
+Progress is checkpointed in deletion_jobs/{job_id} after every page, so a
+run that times out or crashes resumes from its last page when started
+again. Customer jobs are named by a hash of the business and WhatsApp
+number, so the job record doesn't keep the number it deleted. A dry run
+writes nothing and counts the documents per collection.
+
+Usage:
+    python -m services.data_deletion --business-id BUSINESS_ID --user-id 233XXXXXXXXX --dry-run
+    python -m services.data_deletion --business-id BUSINESS_ID --all-customers
+"""
+
+import argparse
+import hashlib
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from firebase_admin import firestore
+
+from config import DATA_DELETION_PAGE_SIZE
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+JOBS_COLLECTION = 'deletion_jobs'
+
+# Firestore batches accept at most 500 writes
+BATCH_WRITE_LIMIT = 500
+
+# Personal data removed from orders that are kept
+ORDER_ANONYMIZED_FIELDS = {
+    'customer.name': 'Deleted Customer',
+    'customer.phone': 'DELETED',
+    'customer.whatsapp_number': 'DELETED',
+    'shipping_address': 'DELETED'
+}
+
+# Inventory holds of kept orders only name the customer by user_id
+HOLD_ANONYMIZED_FIELDS = {'user_id': 'DELETED'}
+
+# Collections holding customer data, keyed by business_id
+BUSINESS_CUSTOMER_COLLECTIONS = (
+    'customer_addresses', 'payment_accounts', 'whatsapp_sessions', 'customer_feedback',
+    'customer_ratings', 'inventory_holds', 'order_idempotency', 'customers'
+)
+
+
+def _step(collection: str, query=None, refs=None, action: str = 'delete', subcollections=(), fields=None,
+          release_statuses=()) -> Dict[str, Any]:
+    """A step; anonymize sets fields, and holds in release_statuses give back their stock before the action"""
+    return {'collection': collection, 'query': query, 'refs': refs or [], 'action': action, 'subcollections': tuple(subcollections),
+            'fields': fields or {}, 'release_statuses': tuple(release_statuses)}
+
+
+def _business_query(db, collection: str, business_id: str):
+    return db.collection(collection).where(filter=firestore.FieldFilter('business_id', '==', business_id))
+
+
+def customer_key(business_id: str, user_id: str) -> str:
+    """Stable pseudonym of a customer, used in place of their WhatsApp number in job records"""
+    return hashlib.sha256(f"{business_id}:{user_id}".encode('utf-8')).hexdigest()
+
+
+def plan_customer_deletion(db, business_id: str, user_id: str) -> List[Dict[str, Any]]:
+    """Steps deleting one customer's data; their orders are anonymized rather than deleted"""
+    from models.customer import get_customer_by_whatsapp_internal
+
+    def user_query(collection):
+        return _business_query(db, collection, business_id).where(filter=firestore.FieldFilter('user_id', '==', user_id))
+
+    steps = [
+        _step('whatsapp_sessions', refs=[db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")]),
+        _step('customer_feedback', query=user_query('customer_feedback')),
+        _step('customer_ratings', query=user_query('customer_ratings')),
+        _step('inventory_holds', query=user_query('inventory_holds'), action='anonymize', fields=HOLD_ANONYMIZED_FIELDS,
+              release_statuses=('active',)),
+        _step('order_idempotency', query=user_query('order_idempotency'))
+    ]
+
+    customer = get_customer_by_whatsapp_internal(db, user_id, business_id)
+    if not customer:
+        return steps
+
+    customer_id = customer.get('id')
+    for collection in ('customer_addresses', 'payment_accounts'):
+        steps.append(_step(collection, query=db.collection(collection).where(
+            filter=firestore.FieldFilter('customer_id', '==', customer_id))))
+
+    steps.append(_step('orders', query=db.collection('orders').where(
+        filter=firestore.FieldFilter('customer.id', '==', customer_id)), action='anonymize', fields=ORDER_ANONYMIZED_FIELDS))
+    # The customer record goes last so a resumed run can still find everything above
+    steps.append(_step('customers', refs=[db.collection('customers').document(customer_id)]))
+    return steps
+
+
+def plan_business_deletion(db, business_id: str) -> List[Dict[str, Any]]:
+    """Steps deleting all customer data and orders of a business (its settings and catalog are kept)"""
+    from services.inventory_holds import RELEASABLE_HOLD_STATUSES
+
+    steps = [_step('orders', query=_business_query(db, 'orders', business_id), subcollections=('items',))]
+    for collection in BUSINESS_CUSTOMER_COLLECTIONS:
+        # The orders go too, so committed holds will never ship
+        release_statuses = RELEASABLE_HOLD_STATUSES if collection == 'inventory_holds' else ()
+        steps.append(_step(collection, query=_business_query(db, collection, business_id), release_statuses=release_statuses))
+    steps.append(_step('segmentation_runs', refs=[db.collection('segmentation_runs').document(business_id)]))
+    return steps
+
+
+def _pages(db, step: Dict[str, Any], page_size: int, cursor: Optional[str]):
+    """Pages of document references for a step, after the cursor document ID"""
+    if not step['query']:
+        if not cursor:
+            yield [ref for ref in step['refs'] if ref.get(field_paths=[]).exists]
+        return
+
+    query = step['query'].select([]).order_by('__name__').limit(page_size)
+    while True:
+        page_query = query
+        if cursor:
+            page_query = page_query.start_after({'__name__': db.collection(step['collection']).document(cursor)})
+
+        refs = [doc.reference for doc in page_query.stream()]
+        if not refs:
+            return
+        yield refs
+
+        if len(refs) < page_size:
+            return
+        cursor = refs[-1].id
+
+
+def _subcollection_refs(refs, subcollections) -> List[Any]:
+    """References of every document in the given subcollections of refs, read in parallel"""
+    if not subcollections:
+        return []
+
+    from utils.background import map_concurrently
+    nested = map_concurrently(
+        lambda ref: [doc.reference for name in subcollections for doc in ref.collection(name).select([]).stream()],
+        refs
+    )
+    return [child for children in nested for child in children]
+
+
+def _release_holds(db, business_id: str, refs, statuses):
+    """Give back the stock reserved by holds in statuses, in parallel; holds released before are skipped"""
+    from services.inventory_holds import release_holds
+    from utils.background import map_concurrently
+
+    business_context = {'db': db, 'business_id': business_id}
+    map_concurrently(lambda ref: release_holds(business_context, [ref], from_statuses=statuses), refs)
+
+
+def _commit_in_batches(db, refs, action: str, fields=None) -> int:
+    """Delete (or anonymize with fields) refs in parallel batches of BATCH_WRITE_LIMIT"""
+    from utils.background import map_concurrently
+
+    def commit_chunk(chunk):
+        batch = db.batch()
+        for ref in chunk:
+            if action == 'anonymize':
+                batch.update(ref, {**fields, 'updated_at': firestore.SERVER_TIMESTAMP})
+            else:
+                batch.delete(ref)
+        batch.commit()
+        return len(chunk)
+
+    chunks = [refs[i:i + BATCH_WRITE_LIMIT] for i in range(0, len(refs), BATCH_WRITE_LIMIT)]
+    return sum(map_concurrently(commit_chunk, chunks))
+
+
+def run_deletion(db, job_id: str, steps: List[Dict[str, Any]], job_info: Dict[str, Any],
+                 dry_run: bool = False, page_size: int = DATA_DELETION_PAGE_SIZE) -> Dict[str, Any]:
+    """
+    Run (or resume) a planned deletion
+
+    An unfinished job with the same ID is resumed from its checkpoint.
+    Returns per-collection counts of documents deleted or anonymized (or, in
+    a dry run, that would be).
+    """
+    started_at = time.perf_counter()
+    job_ref = db.collection(JOBS_COLLECTION).document(job_id)
+
+    step_index, cursor, counts = 0, None, {}
+    if not dry_run:
+        job_doc = job_ref.get()
+        checkpoint = job_doc.to_dict() if job_doc.exists else {}
+        resuming = checkpoint.get('status') == 'running'
+        if resuming:
+            step_index, cursor, counts = checkpoint.get('step', 0), checkpoint.get('cursor'), dict(checkpoint.get('counts', {}))
+            logger.info(f"Resuming deletion job {job_id} at step {step_index}")
+        job_ref.set({**job_info, 'status': 'running', 'step': step_index, 'cursor': cursor, 'counts': counts,
+                     'started_at': checkpoint.get('started_at') if resuming else datetime.now(),
+                     'updated_at': datetime.now()})
+
+    try:
+        for index in range(step_index, len(steps)):
+            step = steps[index]
+            for refs in _pages(db, step, page_size, cursor if index == step_index else None):
+                children = _subcollection_refs(refs, step['subcollections'])
+                if not dry_run:
+                    # Children first, so an interrupted page never orphans them
+                    _commit_in_batches(db, children, 'delete')
+                    if step['release_statuses']:
+                        _release_holds(db, job_info['business_id'], refs, step['release_statuses'])
+                    _commit_in_batches(db, refs, step['action'], step['fields'])
+
+                for name in step['subcollections']:
+                    key = f"{step['collection']}/{name}"
+                    counts[key] = counts.get(key, 0) + sum(1 for child in children if child.parent.id == name)
+                counts[step['collection']] = counts.get(step['collection'], 0) + len(refs)
+
+                if not dry_run and step['query']:
+                    job_ref.update({'step': index, 'cursor': refs[-1].id, 'counts': dict(counts), 'updated_at': datetime.now()})
+
+            if not dry_run:
+                job_ref.update({'step': index + 1, 'cursor': None, 'counts': dict(counts), 'updated_at': datetime.now()})
+
+    except Exception as e:
+        logger.error(f"Deletion job {job_id} stopped: {str(e)}")
+        if not dry_run:
+            job_ref.update({'error': str(e), 'updated_at': datetime.now()})
+        raise
+
+    if not dry_run:
+        job_ref.update({'status': 'completed', 'completed_at': datetime.now(), 'updated_at': datetime.now()})
+
+    stats = {
+        "job_id": job_id,
+        "dry_run": dry_run,
+        "status": "dry_run" if dry_run else "completed",
+        "counts": counts,
+        "documents": sum(counts.values()),
+        "seconds": round(time.perf_counter() - started_at, 2)
+    }
+    logger.info(f"Deletion job {job_id} {'counted' if dry_run else 'processed'} {stats['documents']} documents in {stats['seconds']}s")
+    return stats
+
+
+def delete_customer(db, business_id: str, user_id: str, dry_run: bool = False) -> Dict[str, Any]:
+    """Delete a customer's data in a business, anonymizing their orders"""
+    from models.customer import customer_profile_cache
+
+    key = customer_key(business_id, user_id)
+    job_info = {'kind': 'customer', 'business_id': business_id, 'customer_key': key}
+    steps = plan_customer_deletion(db, business_id, user_id)
+    try:
+        return run_deletion(db, f"customer_{business_id}_{key[:32]}", steps, job_info, dry_run)
+    finally:
+        if not dry_run:
+            customer_profile_cache.evict(business_id, user_id)
+
+
+def delete_business_customer_data(db, business_id: str, dry_run: bool = False) -> Dict[str, Any]:
+    """Delete all orders and customer data of a business, e.g. when it offboards"""
+    from models.customer import customer_profile_cache
+
+    job_info = {'kind': 'business', 'business_id': business_id}
+    steps = plan_business_deletion(db, business_id)
+    try:
+        return run_deletion(db, f"business_{business_id}", steps, job_info, dry_run)
+    finally:
+        if not dry_run:
+            customer_profile_cache.evict_business(business_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete customer data in bulk")
+    parser.add_argument("--business-id", required=True, help="Business whose data to delete")
+    parser.add_argument("--user-id", help="WhatsApp number of the customer to delete")
+    parser.add_argument("--all-customers", action="store_true", help="Delete all orders and customer data of the business")
+    parser.add_argument("--dry-run", action="store_true", help="Count documents per collection without deleting")
+    args = parser.parse_args()
+
+    if bool(args.user_id) == args.all_customers:
+        parser.error("pass exactly one of --user-id and --all-customers")
+
+    from config import db
+    if not db:
+        raise SystemExit("Firebase is not initialized")
+
+    if args.user_id:
+        stats = delete_customer(db, args.business_id, args.user_id, args.dry_run)
+    else:
+        stats = delete_business_customer_data(db, args.business_id, args.dry_run)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Delivery zones
+Per-business delivery zones with a grid index for fee and ETA lookups
+
+Zones are configured in business_settings under checkout.delivery_zones,
+each either a radius ring around a pickup point or a polygon:
+
+    {"id": "central", "name": "Central Accra", "type": "radius",
+     "center": {"lat": 5.55, "lng": -0.20}, "radius_km": 5,
+     "fee": 15, "eta": "Same day", "priority": 0, "cities": ["Accra"]}
+
+    {"id": "east", "name": "East Legon", "type": "polygon",
+     "polygon": [[5.63, -0.17], [5.66, -0.17], [5.66, -0.13], [5.63, -0.13]],
+     "fee": 25, "eta": "1-2 days"}
+
+Each zone is bucketed into grid cells of DELIVERY_ZONE_CELL_DEGREES covering
+its bounding box, so a lookup only tests the few zones registered in the
+point's cell. Where zones overlap, the lowest priority (then the lowest fee)
+wins. Optional city names serve addresses without coordinates.
+"""
+
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import DELIVERY_ZONE_CELL_DEGREES, DELIVERY_ZONE_MAX_CELLS, DELIVERY_ZONES_CACHE_MINUTES
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = math.radians(lat2 - lat1)
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def _point(value) -> Tuple[float, float]:
+    """(lat, lng) from a GeoPoint, a {'lat', 'lng'} dict or a [lat, lng] pair"""
+    if hasattr(value, 'latitude'):
+        return float(value.latitude), float(value.longitude)
+    if isinstance(value, dict):
+        return float(value.get('lat', value.get('latitude'))), float(value.get('lng', value.get('longitude')))
+    return float(value[0]), float(value[1])
+
+
+class DeliveryZone:
+    """One delivery zone: a radius ring or a polygon, with its fee and ETA"""
+
+    __slots__ = ('zone_id', 'name', 'kind', 'fee', 'eta', 'priority', 'cities',
+                 'center', 'radius_km', 'polygon', 'bounds')
+
+    def __init__(self, config: Dict[str, Any]):
+        self.zone_id = str(config.get('id') or config.get('name'))
+        self.name = config.get('name', self.zone_id)
+        self.kind = config.get('type', 'radius')
+        self.fee = float(config.get('fee', 0))
+        self.eta = config.get('eta', '')
+        self.priority = int(config.get('priority', 0))
+        self.cities = [city.strip().lower() for city in config.get('cities', []) if city]
+        self.center = None
+        self.radius_km = 0.0
+        self.polygon = []
+
+        if self.kind == 'polygon':
+            self.polygon = [_point(vertex) for vertex in config.get('polygon', [])]
+            if len(self.polygon) < 3:
+                raise ValueError(f"Polygon zone {self.zone_id} needs at least 3 points")
+            lats = [lat for lat, _ in self.polygon]
+            lngs = [lng for _, lng in self.polygon]
+            self.bounds = (min(lats), min(lngs), max(lats), max(lngs))
+        else:
+            self.center = _point(config['center'])
+            self.radius_km = float(config.get('radius_km', 0))
+            lat, lng = self.center
+            lat_delta = self.radius_km / 111.0
+            lng_delta = self.radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+            self.bounds = (lat - lat_delta, lng - lng_delta, lat + lat_delta, lng + lng_delta)
+
+    def contains(self, lat: float, lng: float) -> bool:
+        min_lat, min_lng, max_lat, max_lng = self.bounds
+        if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+            return False
+
+        if self.kind == 'polygon':
+            return _point_in_polygon(lat, lng, self.polygon)
+        return haversine_km(lat, lng, self.center[0], self.center[1]) <= self.radius_km
+
+    def quote(self) -> Dict[str, Any]:
+        return {'zone_id': self.zone_id, 'zone_name': self.name, 'fee': self.fee, 'eta': self.eta}
+
+
+def _point_in_polygon(lat: float, lng: float, polygon: List[Tuple[float, float]]) -> bool:
+    """Ray casting test; points on an edge may fall either way"""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lng_i = polygon[i]
+        lat_j, lng_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            crossing_lng = lng_i + (lat - lat_i) * (lng_j - lng_i) / (lat_j - lat_i)
+            if lng < crossing_lng:
+                inside = not inside
+        j = i
+    return inside
+
+
+class DeliveryZoneIndex:
+    """Grid index over a business's delivery zones"""
+
+    def __init__(self, business_id: str, zones: List[DeliveryZone], cell_degrees: float = DELIVERY_ZONE_CELL_DEGREES):
+        self.business_id = business_id
+        self.cell_degrees = cell_degrees
+        # Best zone first, so the first match in a cell wins
+        self.zones = sorted(zones, key=lambda zone: (zone.priority, zone.fee))
+        self.cells: Dict[Tuple[int, int], List[DeliveryZone]] = {}
+        # Zones too large to bucket are checked for every point
+        self.unbucketed: List[DeliveryZone] = []
+        self.city_zones: Dict[str, DeliveryZone] = {}
+        self.loaded_at = time.monotonic()
+
+        for zone in self.zones:
+            min_lat, min_lng, max_lat, max_lng = zone.bounds
+            lat_cells = range(self._cell(min_lat), self._cell(max_lat) + 1)
+            lng_cells = range(self._cell(min_lng), self._cell(max_lng) + 1)
+            if len(lat_cells) * len(lng_cells) > DELIVERY_ZONE_MAX_CELLS:
+                self.unbucketed.append(zone)
+            else:
+                for lat_cell in lat_cells:
+                    for lng_cell in lng_cells:
+                        self.cells.setdefault((lat_cell, lng_cell), []).append(zone)
+
+            for city in zone.cities:
+                self.city_zones.setdefault(city, zone)
+
+    def _cell(self, degrees: float) -> int:
+        return math.floor(degrees / self.cell_degrees)
+
+    @property
+    def has_zones(self) -> bool:
+        return bool(self.zones)
+
+    def find_zone(self, lat: float, lng: float) -> Optional[DeliveryZone]:
+        """Best zone containing a point, or None"""
+        best = None
+        for zone in self.cells.get((self._cell(lat), self._cell(lng)), ()):
+            if zone.contains(lat, lng):
+                best = zone
+                break
+
+        for zone in self.unbucketed:
+            if (best is None or (zone.priority, zone.fee) < (best.priority, best.fee)) and zone.contains(lat, lng):
+                best = zone
+
+        return best
+
+    def find_zone_by_city(self, city: str) -> Optional[DeliveryZone]:
+        return self.city_zones.get((city or '').strip().lower())
+
+    def quote(self, lat: Optional[float] = None, lng: Optional[float] = None, city: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Zone, fee and ETA for a point (or, without coordinates, a city); None if not deliverable"""
+        zone = None
+        if lat is not None and lng is not None:
+            zone = self.find_zone(lat, lng)
+        elif city:
+            zone = self.find_zone_by_city(city)
+        return zone.quote() if zone else None
+
+
+def build_delivery_zone_index(business_id: str, zone_configs: List[Dict[str, Any]]) -> DeliveryZoneIndex:
+    """Build an index from zone configs, skipping (and logging) invalid ones"""
+    zones = []
+    for zone_config in zone_configs or []:
+        try:
+            zones.append(DeliveryZone(zone_config))
+        except Exception as e:
+            logger.warning(f"Skipping invalid delivery zone {zone_config.get('id', zone_config.get('name'))} for business {business_id}: {str(e)}")
+    return DeliveryZoneIndex(business_id, zones)
+
+
+# Index per business
+delivery_zone_indexes: Dict[str, DeliveryZoneIndex] = {}
+_index_lock = threading.Lock()
+
+
+def _zone_configs_from_settings(settings: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return ((settings or {}).get('checkout') or {}).get('delivery_zones') or []
+
+
+def load_delivery_zone_index(db, business_id: str) -> DeliveryZoneIndex:
+    """Read a business's zones from business_settings and index them"""
+    settings_doc = db.collection('business_settings').document(business_id).get(field_paths=['checkout.delivery_zones'])
+    settings = settings_doc.to_dict() if settings_doc.exists else {}
+    return build_delivery_zone_index(business_id, _zone_configs_from_settings(settings))
+
+
+def get_delivery_zone_index(business_context) -> Optional[DeliveryZoneIndex]:
+    """A business's zone index, loaded on first use and reloaded after DELIVERY_ZONES_CACHE_MINUTES"""
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+
+    if not db or not business_id:
+        return None
+
+    index = delivery_zone_indexes.get(business_id)
+    if index and time.monotonic() - index.loaded_at < DELIVERY_ZONES_CACHE_MINUTES * 60:
+        return index
+
+    try:
+        with _index_lock:
+            index = load_delivery_zone_index(db, business_id)
+            delivery_zone_indexes[business_id] = index
+        logger.info(f"Loaded {len(index.zones)} delivery zones for business {business_id}")
+        return index
+
+    except Exception as e:
+        logger.error(f"Error loading delivery zones for business {business_id}: {str(e)}")
+        # Keep serving the previous zones rather than none
+        return delivery_zone_indexes.get(business_id)
+
+
+def apply_delivery_zone_settings(business_id: str, settings: Optional[Dict[str, Any]]):
+    """Rebuild a business's index from changed settings (None drops it)"""
+    if settings is None:
+        delivery_zone_indexes.pop(business_id, None)
+        return
+
+    delivery_zone_indexes[business_id] = build_delivery_zone_index(business_id, _zone_configs_from_settings(settings))
+
+
+def quote_delivery(business_context, latitude: Optional[float] = None, longitude: Optional[float] = None,
+                   city: Optional[str] = None) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    Delivery quote for a location
+
+    Returns (deliverable, quote). Businesses without zones deliver
+    everywhere with no quote; with zones, a location outside all of them
+    is not deliverable.
+    """
+    index = get_delivery_zone_index(business_context)
+    if not index or not index.has_zones:
+        return True, None
+
+    quote = index.quote(latitude, longitude, city)
+    if quote is None and latitude is None and longitude is None:
+        # Without coordinates an unknown city can't be ruled out
+        return True, None
+
+    return quote is not None, quote
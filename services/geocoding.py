@@ -0,0 +1,319 @@
+"""
+Geocoding service
+Reverse geocoding with a geohash-keyed cache, rate limiting and pluggable backends
+
+Coordinates are bucketed by geohash (GEOCODE_GEOHASH_PRECISION characters,
+about 150m at the default of 7), so nearby locations reuse the same
+result. Results are kept in an in-memory LRU and, optionally, in the
+geocode_cache collection so they survive restarts and are shared between
+instances. Only the parts of an address shared by the whole cell are
+cached; a cached result (marked cached) is returned with the caller's own
+coordinates, and its address names only the area, without house-level
+details such as the road and house number.
+
+Lookups against the public Nominatim service are limited to one request
+per GEOCODE_MIN_INTERVAL_SECONDS as its usage policy requires. Background
+lookups run on their own thread, so waiting for the limit never holds up
+the shared background pool.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from config import (
+    GEOCODER_BACKEND, GEOCODER_USER_AGENT, GEOCODE_TIMEOUT_SECONDS, GEOCODE_MIN_INTERVAL_SECONDS,
+    GEOCODE_GEOHASH_PRECISION, GEOCODE_CACHE_SIZE, GEOCODE_PERSISTENT_CACHE_ENABLED, GEOCODE_CACHE_DAYS
+)
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+GEOCODE_CACHE_COLLECTION = 'geocode_cache'
+
+_GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Address parts that identify a single building rather than the geohash cell
+HOUSE_LEVEL_FIELDS = ('house_number', 'house_name', 'building', 'road', 'amenity', 'shop')
+
+
+def encode_geohash(latitude: float, longitude: float, precision: int = GEOCODE_GEOHASH_PRECISION) -> str:
+    """Geohash of a coordinate; coordinates sharing a prefix are close together"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even_bit = True
+
+    while len(geohash) < precision:
+        if even_bit:
+            mid = (lng_range[0] + lng_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lng_range[0] = mid
+            else:
+                bits <<= 1
+                lng_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+
+        even_bit = not even_bit
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(_GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(geohash)
+
+
+class NominatimBackend:
+    """Reverse geocoding through the public Nominatim service"""
+
+    name = 'nominatim'
+
+    def __init__(self, user_agent: str = GEOCODER_USER_AGENT, timeout: int = GEOCODE_TIMEOUT_SECONDS):
+        # One geolocator for the process instead of one per message
+        from geopy.geocoders import Nominatim
+        self.geolocator = Nominatim(user_agent=user_agent)
+        self.timeout = timeout
+
+    def reverse(self, latitude: float, longitude: float) -> Optional[Dict[str, Any]]:
+        location = self.geolocator.reverse(f"{latitude}, {longitude}", timeout=self.timeout)
+        if not location or not location.address:
+            return None
+        return {'address': str(location.address), 'raw': location.raw}
+
+
+class OfflineBackend:
+    """
+    Backend that never leaves the process, for tests and local development
+
+    Known places can be registered by geohash; anything else resolves to a
+    plain coordinate description.
+    """
+
+    name = 'offline'
+
+    def __init__(self, places: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.places = dict(places or {})
+        self.calls = 0
+
+    def add_place(self, latitude: float, longitude: float, address: str, raw: Optional[Dict[str, Any]] = None):
+        self.places[encode_geohash(latitude, longitude)] = {'address': address, 'raw': raw or {}}
+
+    def reverse(self, latitude: float, longitude: float) -> Optional[Dict[str, Any]]:
+        self.calls += 1
+        place = self.places.get(encode_geohash(latitude, longitude))
+        if place:
+            return dict(place)
+        return {
+            'address': f"Coordinates: {latitude}, {longitude}",
+            'raw': {'lat': str(latitude), 'lon': str(longitude), 'address': {}}
+        }
+
+
+class _RateLimiter:
+    """Spaces calls at least min_interval seconds apart across threads"""
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._last_call = 0.0
+
+    def wait(self):
+        with self._lock:
+            delay = self._last_call + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._last_call = time.monotonic()
+
+
+# LRU of geohash -> result
+_geocode_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+_backend = None
+_backend_lock = threading.Lock()
+_rate_limiter = _RateLimiter(GEOCODE_MIN_INTERVAL_SECONDS)
+
+# Background lookups; one thread, as the rate limiter serializes backend calls anyway
+_geocode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="geocode")
+
+geocode_stats = {"memory_hits": 0, "persistent_hits": 0, "backend_calls": 0, "backend_errors": 0}
+
+
+def _create_backend():
+    if GEOCODER_BACKEND == 'offline':
+        return OfflineBackend()
+    return NominatimBackend()
+
+
+def get_geocoder_backend():
+    """The configured backend, created on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+    return _backend
+
+
+def set_geocoder_backend(backend):
+    """Replace the backend, e.g. with an OfflineBackend in tests; clears the memory cache"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    clear_geocode_cache()
+
+
+def clear_geocode_cache():
+    with _cache_lock:
+        _geocode_cache.clear()
+
+
+def _cell_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """The parts of a result shared by its whole geohash cell, as cached"""
+    components = {
+        field: value for field, value in ((result.get('raw') or {}).get('address') or {}).items()
+        if field not in HOUSE_LEVEL_FIELDS
+    }
+    address = ', '.join(str(value) for field, value in components.items() if field != 'country_code')
+    return {'address': address or None, 'raw': {'address': components}, 'geohash': result.get('geohash')}
+
+
+def _for_coordinates(cached: Dict[str, Any], latitude: float, longitude: float) -> Dict[str, Any]:
+    """A cached cell result as the answer for one coordinate inside the cell, marked as cached"""
+    return {
+        'address': cached.get('address'),
+        'raw': {**cached.get('raw', {}), 'lat': str(latitude), 'lon': str(longitude)},
+        'geohash': cached.get('geohash'),
+        'cached': True
+    }
+
+
+def _remember(geohash: str, result: Dict[str, Any]):
+    with _cache_lock:
+        _geocode_cache[geohash] = result
+        _geocode_cache.move_to_end(geohash)
+        while len(_geocode_cache) > GEOCODE_CACHE_SIZE:
+            _geocode_cache.popitem(last=False)
+
+
+def get_cached_reverse_geocode(latitude: float, longitude: float) -> Optional[Dict[str, Any]]:
+    """Result from the in-memory cache only, without any I/O"""
+    geohash = encode_geohash(latitude, longitude)
+    with _cache_lock:
+        result = _geocode_cache.get(geohash)
+        if result is not None:
+            _geocode_cache.move_to_end(geohash)
+            geocode_stats["memory_hits"] += 1
+    return _for_coordinates(result, latitude, longitude) if result else None
+
+
+def _read_persistent(db, geohash: str) -> Optional[Dict[str, Any]]:
+    cache_doc = db.collection(GEOCODE_CACHE_COLLECTION).document(geohash).get()
+    if not cache_doc.exists:
+        return None
+
+    cached = cache_doc.to_dict()
+    expires_at = cached.get('expires_at')
+    if expires_at and expires_at.replace(tzinfo=None) < datetime.now():
+        return None
+
+    # Entries written before only cell-level parts were kept are trimmed here
+    return _cell_result({'raw': cached.get('raw', {}), 'geohash': geohash})
+
+
+def _write_persistent(db, geohash: str, result: Dict[str, Any]):
+    now = datetime.now()
+    db.collection(GEOCODE_CACHE_COLLECTION).document(geohash).set({
+        'geohash': geohash,
+        'address': result.get('address'),
+        'raw': result.get('raw', {}),
+        'backend': getattr(get_geocoder_backend(), 'name', 'unknown'),
+        'created_at': now,
+        'expires_at': now + timedelta(days=GEOCODE_CACHE_DAYS)
+    })
+
+
+def reverse_geocode(latitude: float, longitude: float, db=None) -> Optional[Dict[str, Any]]:
+    """
+    Reverse geocode a coordinate to {'address', 'raw', 'geohash'}
+
+    Checks the memory cache, then the persistent cache (when enabled and db
+    is given), then the backend. Only a backend result carries house-level
+    details. Returns None if nothing could be resolved.
+    """
+    cached = get_cached_reverse_geocode(latitude, longitude)
+    if cached:
+        return cached
+
+    geohash = encode_geohash(latitude, longitude)
+
+    if db is not None and GEOCODE_PERSISTENT_CACHE_ENABLED:
+        try:
+            stored = _read_persistent(db, geohash)
+            if stored and stored.get('address'):
+                geocode_stats["persistent_hits"] += 1
+                _remember(geohash, stored)
+                return _for_coordinates(stored, latitude, longitude)
+        except Exception as e:
+            logger.warning(f"Error reading geocode cache for {geohash}: {str(e)}")
+
+    backend = get_geocoder_backend()
+    try:
+        if isinstance(backend, NominatimBackend):
+            _rate_limiter.wait()
+        geocode_stats["backend_calls"] += 1
+        result = backend.reverse(latitude, longitude)
+    except Exception as e:
+        geocode_stats["backend_errors"] += 1
+        logger.warning(f"Error geocoding location {latitude}, {longitude}: {str(e)}")
+        return None
+
+    if not result:
+        return None
+
+    result['geohash'] = geohash
+    cell_result = _cell_result(result)
+    _remember(geohash, cell_result)
+
+    if db is not None and GEOCODE_PERSISTENT_CACHE_ENABLED:
+        try:
+            _write_persistent(db, geohash, cell_result)
+        except Exception as e:
+            logger.warning(f"Error writing geocode cache for {geohash}: {str(e)}")
+
+    return dict(result)
+
+
+def reverse_geocode_async(latitude: float, longitude: float, callback: Callable[[Optional[Dict[str, Any]]], Any], db=None):
+    """Reverse geocode on the geocoding thread and pass the result (or None) to callback on the background pool"""
+    from utils.background import run_in_background
+
+    def resolve():
+        try:
+            result = reverse_geocode(latitude, longitude, db)
+        except Exception as e:
+            logger.error(f"Error geocoding location {latitude}, {longitude}: {str(e)}")
+            result = None
+        return run_in_background(callback, result)
+
+    return _geocode_executor.submit(resolve)
+
+
+def get_geocode_stats() -> Dict[str, Any]:
+    with _cache_lock:
+        size = len(_geocode_cache)
+    return {**geocode_stats, "cache_size": size, "backend": getattr(_backend, 'name', None)}
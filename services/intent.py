@@ -1,6 +1,11 @@
 import json
 import re
-from config import OPENAI_API_KEY, OPENAI_MODEL, logger
+import threading
+import time
+from config import (
+    OPENAI_API_KEY, OPENAI_MODEL, logger,
+    INTENT_HISTORY_LIMIT, INTENT_PROMPT_TOKEN_BUDGET, INTENT_HISTORY_MESSAGE_MAX_CHARS
+)
 from models.session import get_recent_history
 from utils.logger import get_logger
 
@@ -21,46 +26,65 @@ except Exception as e:
         logger.error("OpenAI library not available")
         client = None
 
-def process_intent(user_message, business_id, user_id):
+def set_llm_client(new_client):
+    """Replace the OpenAI client used for intent calls (e.g. with a local stub); returns the previous one"""
+    global client
+    previous_client = client
+    client = new_client
+    return previous_client
+
+# Business-aware prompt - could be customized per business in the future
+INTENT_SYSTEM_PROMPT = """You are an e-commerce assistant for a WhatsApp store.
+Determine the user's intent from the following categories:
+- greeting: User is saying hello or starting conversation
+- browse_catalog: User wants to see products or categories
+- browse_product: User is looking for a specific product or product type
+- product_info: User is asking about specific product details
+- add_to_cart: User wants to add item(s) to cart
+- view_cart: User wants to see what's in their cart
+- checkout: User wants to complete their purchase
+- order_status: User is asking about an existing order
+- support: User needs help or has questions
+- feedback: User is providing feedback
+- cancel: User wants to cancel or reset their current action
+
+Respond with ONLY the intent category and any relevant entities (like product names, quantities).
+Format: {"intent": "category", "entities": {"product": "name", "quantity": number}}"""
+
+# Session history entries that only echo an interactive reply carry no intent signal
+INTERACTION_ECHO_PREFIXES = ("Clicked:", "Selected:")
+
+# Approximate per-message token overhead of the chat format
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# Token usage accounting per business
+# Format: {business_id: {counter: value}}
+intent_token_usage = {}
+_token_usage_lock = threading.Lock()
+
+def process_intent(user_message, business_id, user_id, token_budget=None):
     """Analyze user message to determine intent using OpenAI API with business context"""
     # Get recent conversation history with business context
-    conversation_history = get_recent_history(business_id, user_id, limit=5)
+    conversation_history = get_recent_history(business_id, user_id, limit=INTENT_HISTORY_LIMIT)
     
     logger.info(f"Processing intent for business {business_id}, user {user_id}: {user_message}")
     
-    # Prepare conversation history for context
-    conversation = []
-    for message in conversation_history:
-        conversation.append({"role": message["role"], "content": message["content"]})
+    # Prepare compacted conversation history for context
+    conversation = compact_history(conversation_history, user_message, token_budget)
     
     # Add current message
     conversation.append({"role": "user", "content": user_message})
     
-    # Business-aware prompt - could be customized per business in the future
-    system_prompt = """You are an e-commerce assistant for a WhatsApp store. 
-    Determine the user's intent from the following categories:
-    - greeting: User is saying hello or starting conversation
-    - browse_catalog: User wants to see products or categories
-    - browse_product: User is looking for a specific product or product type
-    - product_info: User is asking about specific product details
-    - add_to_cart: User wants to add item(s) to cart
-    - view_cart: User wants to see what's in their cart
-    - checkout: User wants to complete their purchase
-    - order_status: User is asking about an existing order
-    - support: User needs help or has questions
-    - feedback: User is providing feedback
-    - cancel: User wants to cancel or reset their current action
-    
-    Respond with ONLY the intent category and any relevant entities (like product names, quantities).
-    Format: {"intent": "category", "entities": {"product": "name", "quantity": number}}"""
+    prompt = [
+        {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+        *conversation
+    ]
+    estimated_prompt_tokens = estimate_prompt_tokens(prompt)
     
     try:
+        started_at = time.perf_counter()
+        
         if client:  # Use new OpenAI client
-            prompt = [
-                {"role": "system", "content": system_prompt},
-                *conversation
-            ]
-            
             response = client.chat.completions.create(
                 model=OPENAI_MODEL,
                 messages=prompt,
@@ -72,11 +96,6 @@ def process_intent(user_message, business_id, user_id):
         else:  # Fallback to legacy openai module
             import openai
             
-            prompt = [
-                {"role": "system", "content": system_prompt},
-                *conversation
-            ]
-            
             response = openai.ChatCompletion.create(
                 model=OPENAI_MODEL,
                 messages=prompt,
@@ -86,6 +105,15 @@ def process_intent(user_message, business_id, user_id):
             
             intent_text = response.choices[0].message.content.strip()
         
+        usage = record_token_usage(
+            business_id,
+            response,
+            estimated_prompt_tokens=estimated_prompt_tokens,
+            history_messages=len(conversation) - 1,
+            history_dropped=max(0, len(conversation_history) - len(conversation)),
+            latency_ms=(time.perf_counter() - started_at) * 1000
+        )
+        
         logger.debug(f"Intent text from OpenAI for business {business_id}: {intent_text}")
         
         # Try to parse the intent as JSON
@@ -94,7 +122,7 @@ def process_intent(user_message, business_id, user_id):
             logger.info(f"Parsed intent for business {business_id}: {intent_data}")
             
             # Log analytics event for intent recognition
-            log_intent_analytics(business_id, user_id, intent_data, user_message)
+            log_intent_analytics(business_id, user_id, intent_data, user_message, usage=usage)
             
             return intent_data
         except json.JSONDecodeError:
@@ -109,7 +137,8 @@ def process_intent(user_message, business_id, user_id):
                 {
                     'intent': fallback_intent.get('intent', 'unknown'),
                     'fallback_reason': 'json_parse_error',
-                    'original_response': intent_text
+                    'original_response': intent_text,
+                    'token_usage': usage
                 }
             )
             
@@ -133,6 +162,133 @@ def process_intent(user_message, business_id, user_id):
         
         return fallback_intent
 
+def estimate_tokens(text):
+    """Roughly estimate the token count of a text (~4 characters per token)"""
+    if not text:
+        return 0
+    return len(text) // 4 + 1
+
+def estimate_prompt_tokens(messages):
+    """Roughly estimate the token count of a list of chat messages"""
+    return sum(estimate_tokens(message.get("content", "")) + MESSAGE_TOKEN_OVERHEAD for message in messages)
+
+def compact_history(history, user_message, token_budget=None, max_chars=INTENT_HISTORY_MESSAGE_MAX_CHARS):
+    """Compact session history so the full intent prompt stays under the token budget"""
+    budget = token_budget or INTENT_PROMPT_TOKEN_BUDGET
+    history = list(history or [])
+    
+    # The session already records the current message before intent processing
+    if history and history[-1].get("role") == "user" and history[-1].get("content") == user_message:
+        history = history[:-1]
+    
+    compacted = []
+    for message in history:
+        content = message.get("content") or ""
+        
+        # Drop button/list echoes like "Clicked: Browse Products"
+        if content.startswith(INTERACTION_ECHO_PREFIXES):
+            continue
+        
+        # Truncate long messages
+        if len(content) > max_chars:
+            content = content[:max_chars].rstrip() + "..."
+        
+        compacted.append({"role": message.get("role", "user"), "content": content})
+    
+    # Tokens that are always sent: system prompt and the current message
+    fixed_tokens = estimate_prompt_tokens([
+        {"content": INTENT_SYSTEM_PROMPT},
+        {"content": user_message}
+    ])
+    
+    # Drop the oldest messages until the prompt fits
+    while compacted and fixed_tokens + estimate_prompt_tokens(compacted) > budget:
+        compacted.pop(0)
+    
+    return compacted
+
+def _get_usage_value(usage, field):
+    """Read a counter from an OpenAI usage object or legacy usage dict"""
+    if usage is None:
+        return 0
+    if isinstance(usage, dict):
+        return usage.get(field, 0) or 0
+    return getattr(usage, field, 0) or 0
+
+def record_token_usage(business_id, response, estimated_prompt_tokens=0, history_messages=0, history_dropped=0, latency_ms=0.0):
+    """Record token usage of an intent call from the API usage field"""
+    usage = getattr(response, "usage", None)
+    if usage is None and isinstance(response, dict):
+        usage = response.get("usage")
+    
+    call_usage = {
+        'prompt_tokens': _get_usage_value(usage, 'prompt_tokens'),
+        'completion_tokens': _get_usage_value(usage, 'completion_tokens'),
+        'total_tokens': _get_usage_value(usage, 'total_tokens'),
+        'estimated_prompt_tokens': estimated_prompt_tokens,
+        'history_messages': history_messages,
+        'history_dropped': history_dropped,
+        'latency_ms': round(latency_ms, 1)
+    }
+    
+    with _token_usage_lock:
+        totals = intent_token_usage.setdefault(business_id, {
+            'calls': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'total_tokens': 0,
+            'estimated_prompt_tokens': 0,
+            'history_messages': 0,
+            'history_dropped': 0,
+            'latency_ms': 0.0
+        })
+        totals['calls'] += 1
+        for field, value in call_usage.items():
+            totals[field] += value
+    
+    logger.debug(f"Intent token usage for business {business_id}: {call_usage}")
+    return call_usage
+
+def get_token_usage_report(business_id=None):
+    """Get aggregate intent token usage with average prompt size per business"""
+    with _token_usage_lock:
+        snapshot = {bid: dict(totals) for bid, totals in intent_token_usage.items()}
+    
+    if business_id is not None:
+        snapshot = {business_id: snapshot[business_id]} if business_id in snapshot else {}
+    
+    report = {}
+    overall = {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'latency_ms': 0.0}
+    
+    for bid, totals in snapshot.items():
+        calls = totals['calls'] or 1
+        report[bid] = {
+            'calls': totals['calls'],
+            'prompt_tokens': totals['prompt_tokens'],
+            'completion_tokens': totals['completion_tokens'],
+            'total_tokens': totals['total_tokens'],
+            'avg_prompt_tokens': round(totals['prompt_tokens'] / calls, 1),
+            'avg_estimated_prompt_tokens': round(totals['estimated_prompt_tokens'] / calls, 1),
+            'avg_completion_tokens': round(totals['completion_tokens'] / calls, 1),
+            'avg_history_messages': round(totals['history_messages'] / calls, 2),
+            'history_messages_dropped': totals['history_dropped'],
+            'avg_latency_ms': round(totals['latency_ms'] / calls, 1)
+        }
+        for field in overall:
+            overall[field] += totals[field]
+    
+    calls = overall['calls'] or 1
+    return {
+        'businesses': report,
+        'overall': {
+            'calls': overall['calls'],
+            'total_tokens': overall['total_tokens'],
+            'avg_prompt_tokens': round(overall['prompt_tokens'] / calls, 1),
+            'avg_completion_tokens': round(overall['completion_tokens'] / calls, 1),
+            'avg_latency_ms': round(overall['latency_ms'] / calls, 1)
+        }
+    }
+
 def analyze_message_content_with_business(message, business_id=None):
     """Perform simple text analysis on a message with optional business context"""
     message = message.lower()
@@ -280,7 +436,7 @@ def get_intent_confidence_score(intent_data, message):
     
     return confidence_scores.get(intent, 0.5)
 
-def log_intent_analytics(business_id, user_id, intent_data, message, confidence_score=None):
+def log_intent_analytics(business_id, user_id, intent_data, message, confidence_score=None, usage=None):
     """Log intent recognition analytics"""
     try:
         metadata = {
@@ -292,6 +448,9 @@ def log_intent_analytics(business_id, user_id, intent_data, message, confidence_
             'entity_count': len(intent_data.get('entities', {}))
         }
         
+        if usage:
+            metadata['token_usage'] = usage
+        
         _log_database_event(business_id, user_id, 'intent_processed', metadata)
         
     except Exception as e:
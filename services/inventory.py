@@ -1,18 +1,272 @@
+import sys
+import threading
 import requests
+from types import MappingProxyType
 from utils.logger import get_logger
 from datetime import datetime, timedelta
 from firebase_admin import firestore
 
 logger = get_logger(__name__)
 
-# In-memory inventory cache per business
-inventory_cache = {}
-inventory_cache_updated = {}
 CACHE_DURATION_MINUTES = 30
 
-def get_cache_key(business_id, product_identifier):
-    """Generate cache key for business-specific inventory"""
-    return f"{business_id}_{product_identifier}"
+# Fields needed from inventory documents to build the cache
+INVENTORY_CACHE_FIELDS = ['product_id', 'product_option_id', 'stock_quantity', 'stock_status', 'last_updated', 'product_name']
+
+# Maximum number of values Firestore accepts in a single 'in' filter
+FIRESTORE_IN_QUERY_LIMIT = 30
+
+# Entries filled in by cache misses are merged into a new snapshot once the
+# overlay holds this many, or a quarter of the snapshot's keys if that's more
+OVERLAY_MERGE_MIN_SIZE = 64
+
+class InventorySnapshot:
+    """Inventory data for one business, replaced as a whole on refresh; only its miss overlay grows"""
+    
+    def __init__(self, business_id, items, sku_index, item_count, loaded_at=None, doc_keys=None, live=False):
+        self.business_id = business_id
+        # Stock info keyed by product ID, product option ID and SKU
+        self.items = MappingProxyType(items)
+        # Entries added after the snapshot was built (cache misses, stock updates), checked first
+        self.overlay = {}
+        # SKU -> product option ID
+        self.sku_index = MappingProxyType(sku_index)
+        # Inventory document ID -> keys it is cached under
+        self.doc_keys = MappingProxyType(doc_keys or {})
+        self.item_count = item_count
+        self.loaded_at = loaded_at or datetime.now()
+        # Kept current by inventory and product_options snapshot listeners, so it never goes stale
+        self.live = live
+    
+    def get(self, product_identifier):
+        """Get stock info by product ID, product option ID or SKU"""
+        stock_info = self.overlay.get(product_identifier)
+        if stock_info is not None:
+            return stock_info
+        return self.items.get(product_identifier)
+    
+    def key_count(self):
+        return len(self.items) + len(self.overlay)
+    
+    def overlay_full(self):
+        """Whether the overlay is big enough to be merged into a new snapshot"""
+        return len(self.overlay) >= max(OVERLAY_MERGE_MIN_SIZE, len(self.items) // 4)
+    
+    def is_fresh(self):
+        """Check if the snapshot is younger than the cache duration"""
+        if self.live:
+            return True
+        return datetime.now() - self.loaded_at < timedelta(minutes=CACHE_DURATION_MINUTES)
+    
+    def with_items(self, new_items, removed_doc_ids=(), doc_keys=None, live=None):
+        """Copy of this snapshot with the overlay merged, entries added or replaced and documents removed, keeping the original load time"""
+        items = dict(self.items)
+        items.update(self.overlay)
+        all_doc_keys = dict(self.doc_keys)
+        
+        for doc_id in list(removed_doc_ids) + list((doc_keys or {}).keys()):
+            for key in all_doc_keys.pop(doc_id, ()):
+                items.pop(key, None)
+        
+        items.update(new_items)
+        all_doc_keys.update(doc_keys or {})
+        
+        return InventorySnapshot(
+            self.business_id, items, dict(self.sku_index), len(all_doc_keys) if (self.doc_keys or doc_keys) else self.item_count,
+            self.loaded_at, all_doc_keys, self.live if live is None else live
+        )
+    
+    def estimate_memory_bytes(self):
+        """Rough memory footprint of the snapshot's keys and values"""
+        seen = set()
+        total = sys.getsizeof(self.items) + sys.getsizeof(self.overlay) + sys.getsizeof(self.sku_index)
+        
+        for mapping in (self.items, dict(self.overlay), self.sku_index):
+            for key, value in mapping.items():
+                total += sys.getsizeof(key)
+                if id(value) in seen:
+                    continue
+                seen.add(id(value))
+                total += sys.getsizeof(value)
+                if isinstance(value, dict):
+                    total += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+        
+        return total
+
+# Current snapshot per business; replaced by assignment under _snapshot_lock,
+# and only ever mutated by adding to its overlay under the same lock
+inventory_snapshots = {}
+
+# One refresh per business at a time
+_snapshot_lock = threading.Lock()
+_refresh_locks = {}
+_refreshing_businesses = set()
+
+def _get_refresh_lock(business_id):
+    with _snapshot_lock:
+        return _refresh_locks.setdefault(business_id, threading.Lock())
+
+def _stock_data_from_inventory(inventory_data):
+    """Build the cached stock info for an inventory document"""
+    return MappingProxyType({
+        "stock_quantity": inventory_data.get('stock_quantity', 0),
+        "stock_status": inventory_data.get('stock_status', 'out_of_stock'),
+        "last_updated": inventory_data.get('last_updated', datetime.now()).isoformat(),
+        "product_name": inventory_data.get('product_name', 'Unknown Product'),
+        "product_option_id": inventory_data.get('product_option_id')
+    })
+
+def index_inventory_documents(inventory_docs, option_skus):
+    """
+    Turn (doc_id, inventory_data) pairs into cache entries
+    
+    Returns:
+        Tuple of (items keyed by product ID, option ID and SKU; doc ID -> keys)
+    """
+    items = {}
+    doc_keys = {}
+    
+    for doc_id, inventory_data in inventory_docs:
+        stock_data = _stock_data_from_inventory(inventory_data)
+        # Cache by both product_id and product_option_id if they exist
+        product_id = inventory_data.get('product_id')
+        product_option_id = inventory_data.get('product_option_id')
+        keys = []
+        
+        if product_id:
+            keys.append(product_id)
+            
+        if product_option_id:
+            keys.append(product_option_id)
+            
+            # Also cache by SKU from the index
+            sku = option_skus.get(product_option_id)
+            if sku:
+                keys.append(sku)
+        
+        for key in keys:
+            items[key] = stock_data
+        doc_keys[doc_id] = tuple(keys)
+    
+    return items, doc_keys
+
+def build_inventory_snapshot(business_id, inventory_docs, sku_index, live=False):
+    """Build an inventory snapshot from (doc_id, inventory_data) pairs and a SKU index"""
+    option_skus = {option_id: sku for sku, option_id in sku_index.items()}
+    items, doc_keys = index_inventory_documents(inventory_docs, option_skus)
+    return InventorySnapshot(business_id, items, sku_index, len(doc_keys), doc_keys=doc_keys, live=live)
+
+def load_inventory_snapshot(db, business_id):
+    """Build a new inventory snapshot for a business from Firebase"""
+    # Build the SKU index with one streamed, projected query instead of a read per option
+    business_sku_index = build_sku_index(db, business_id)
+    
+    inventory_ref = db.collection('inventory').where(
+        filter=firestore.FieldFilter('business_id', '==', business_id)
+    ).select(INVENTORY_CACHE_FIELDS)
+    
+    inventory_docs = ((doc.id, doc.to_dict()) for doc in inventory_ref.stream())
+    return build_inventory_snapshot(business_id, inventory_docs, business_sku_index)
+
+def set_inventory_snapshot(business_id, snapshot):
+    """Publish a complete snapshot for a business (e.g. from a listener's initial load)"""
+    with _snapshot_lock:
+        inventory_snapshots[business_id] = snapshot
+
+def apply_inventory_changes(business_id, changed_docs, removed_doc_ids=()):
+    """
+    Apply changed and removed inventory documents to a business's snapshot copy-on-write
+    
+    Args:
+        business_id: Business whose snapshot to update
+        changed_docs: (doc_id, inventory_data) pairs that were added or modified
+        removed_doc_ids: IDs of inventory documents that were deleted
+        
+    Returns:
+        True if a snapshot existed and was updated
+    """
+    with _snapshot_lock:
+        snapshot = inventory_snapshots.get(business_id)
+        if not snapshot:
+            return False
+        
+        option_skus = {option_id: sku for sku, option_id in snapshot.sku_index.items()}
+        items, doc_keys = index_inventory_documents(changed_docs, option_skus)
+        inventory_snapshots[business_id] = snapshot.with_items(items, removed_doc_ids, doc_keys)
+        return True
+
+def apply_sku_changes(business_id, option_skus, removed_option_ids=(), replace=False):
+    """
+    Apply product option SKU changes to a business's snapshot, re-keying its SKU entries
+    
+    Args:
+        business_id: Business whose snapshot to update
+        option_skus: Product option ID -> SKU (None if it has none) of added or
+            modified options, or of every option of the business with replace
+        removed_option_ids: IDs of product options that were deleted
+        replace: option_skus is the complete set of options
+        
+    Returns:
+        True if a snapshot existed
+    """
+    with _snapshot_lock:
+        snapshot = inventory_snapshots.get(business_id)
+        if not snapshot:
+            return False
+        
+        current = {option_id: sku for sku, option_id in snapshot.sku_index.items()}
+        updated = {} if replace else dict(current)
+        for option_id in removed_option_ids:
+            updated.pop(option_id, None)
+        for option_id, sku in option_skus.items():
+            if sku:
+                updated[option_id] = sku
+            else:
+                updated.pop(option_id, None)
+        
+        changed = {option_id for option_id in set(current) | set(updated) if current.get(option_id) != updated.get(option_id)}
+        if not changed:
+            return True
+        
+        sku_index = {}
+        for option_id, sku in updated.items():
+            sku_index.setdefault(sku, option_id)
+        
+        items = dict(snapshot.items)
+        items.update(snapshot.overlay)
+        for option_id in changed:
+            if current.get(option_id):
+                items.pop(current[option_id], None)
+        
+        doc_keys = dict(snapshot.doc_keys)
+        for doc_id, keys in snapshot.doc_keys.items():
+            stock_data = items.get(keys[0]) if keys else None
+            option_id = stock_data.get('product_option_id') if stock_data else None
+            if option_id not in changed:
+                continue
+            
+            new_keys = [key for key in keys if key != current.get(option_id)]
+            new_sku = updated.get(option_id)
+            if new_sku and sku_index.get(new_sku) == option_id:
+                new_keys.append(new_sku)
+                items[new_sku] = stock_data
+            doc_keys[doc_id] = tuple(new_keys)
+        
+        inventory_snapshots[business_id] = InventorySnapshot(
+            business_id, items, sku_index, snapshot.item_count, snapshot.loaded_at, doc_keys, snapshot.live
+        )
+        return True
+
+def set_inventory_snapshot_live(business_id, live):
+    """Mark whether a listener is keeping a business's snapshot current"""
+    with _snapshot_lock:
+        snapshot = inventory_snapshots.get(business_id)
+        if snapshot and snapshot.live != live:
+            updated = snapshot.with_items({}, live=live)
+            if not live:
+                # Let the TTL take over from now on
+                updated.loaded_at = datetime.now()
+            inventory_snapshots[business_id] = updated
 
 def update_inventory_cache(business_context):
     """Refresh inventory data from Firebase for specific business"""
@@ -23,63 +277,115 @@ def update_inventory_cache(business_context):
         logger.error("Missing business_id or db in business context")
         return False
     
-    try:
-        inventory_ref = db.collection('inventory').where(
-            filter=firestore.FieldFilter('business_id', '==', business_id)
-        )
-        inventory_docs = inventory_ref.get()
-        
-        business_cache = {}
+    refresh_lock = _get_refresh_lock(business_id)
+    started_at = datetime.now()
+    
+    with refresh_lock:
+        # Another request finished a refresh while we waited; use it
+        current = inventory_snapshots.get(business_id)
+        if current and current.loaded_at >= started_at:
+            return True
         
-        for doc in inventory_docs:
-            inventory_data = doc.to_dict()
-            # Cache by both product_id and product_option_id if they exist
-            product_id = inventory_data.get('product_id')
-            product_option_id = inventory_data.get('product_option_id')
-            
-            stock_data = {
-                "stock_quantity": inventory_data.get('stock_quantity', 0),
-                "stock_status": inventory_data.get('stock_status', 'out_of_stock'),
-                "last_updated": inventory_data.get('last_updated', datetime.now()).isoformat(),
-                "product_name": inventory_data.get('product_name', 'Unknown Product'),
-                "product_option_id": product_option_id
-            }
+        try:
+            snapshot = load_inventory_snapshot(db, business_id)
+            with _snapshot_lock:
+                current = inventory_snapshots.get(business_id)
+                # A listener started meanwhile keeps the reloaded snapshot current
+                snapshot.live = bool(current and current.live)
+                inventory_snapshots[business_id] = snapshot
+            logger.info(
+                f"Updated inventory cache for business {business_id} with {snapshot.item_count} items "
+                f"({snapshot.key_count()} keys, ~{snapshot.estimate_memory_bytes() // 1024} KB)"
+            )
+            return True
             
-            if product_id:
-                cache_key = get_cache_key(business_id, product_id)
-                inventory_cache[cache_key] = stock_data
-                
-            if product_option_id:
-                cache_key = get_cache_key(business_id, product_option_id)
-                inventory_cache[cache_key] = stock_data
-                    
-                # Also cache by SKU if we can get it
-                try:
-                    option_ref = db.collection('product_options').document(product_option_id)
-                    option_doc = option_ref.get()
-                    if option_doc.exists:
-                        sku = option_doc.to_dict().get('sku')
-                        if sku:
-                            cache_key = get_cache_key(business_id, sku)
-                            inventory_cache[cache_key] = stock_data
-                except:
-                    pass
-        
-        inventory_cache_updated[business_id] = datetime.now()
-        logger.info(f"Updated inventory cache for business {business_id} with {len(business_cache)} items")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Error updating inventory cache for business {business_id}: {str(e)}")
-        return False
+        except Exception as e:
+            logger.error(f"Error updating inventory cache for business {business_id}: {str(e)}")
+            return False
+
+def refresh_inventory_cache_async(business_context):
+    """Refresh a business's inventory cache in the background unless a refresh is already running"""
+    business_id = business_context.get('business_id')
+    
+    with _snapshot_lock:
+        if business_id in _refreshing_businesses:
+            return False
+        _refreshing_businesses.add(business_id)
+    
+    def refresh():
+        try:
+            update_inventory_cache(business_context)
+        finally:
+            with _snapshot_lock:
+                _refreshing_businesses.discard(business_id)
+    
+    from utils.background import run_in_background
+    run_in_background(refresh)
+    return True
+
+def get_inventory_snapshot(business_context):
+    """
+    Get the inventory snapshot for a business
+    
+    A stale snapshot is returned immediately while a background refresh
+    replaces it; only the very first load blocks the caller.
+    """
+    business_id = business_context.get('business_id')
+    snapshot = inventory_snapshots.get(business_id)
+    
+    if snapshot is None:
+        update_inventory_cache(business_context)
+        return inventory_snapshots.get(business_id)
+    
+    if not snapshot.is_fresh():
+        refresh_inventory_cache_async(business_context)
+    
+    return snapshot
+
+def _add_snapshot_items(business_id, new_items):
+    """Add entries for lookups that missed the cache to the snapshot's overlay, merging it once it fills up"""
+    with _snapshot_lock:
+        snapshot = inventory_snapshots.get(business_id)
+        if snapshot:
+            snapshot.overlay.update(new_items)
+            if snapshot.overlay_full():
+                inventory_snapshots[business_id] = snapshot.with_items({})
+
+def get_inventory_cache_stats():
+    """Item counts, memory use and age of each business's inventory snapshot"""
+    stats = {}
+    
+    for business_id, snapshot in list(inventory_snapshots.items()):
+        stats[business_id] = {
+            "item_count": snapshot.item_count,
+            "key_count": snapshot.key_count(),
+            "sku_count": len(snapshot.sku_index),
+            "memory_bytes": snapshot.estimate_memory_bytes(),
+            "age_seconds": round((datetime.now() - snapshot.loaded_at).total_seconds(), 1),
+            "fresh": snapshot.is_fresh(),
+            "refreshing": business_id in _refreshing_businesses
+        }
+    
+    return stats
+
+def build_sku_index(db, business_id):
+    """Map every SKU of a business to its product option ID with a single streamed query"""
+    options_ref = db.collection('product_options').where(
+        filter=firestore.FieldFilter('business_id', '==', business_id)
+    ).select(['sku'])
+    
+    business_sku_index = {}
+    for option_doc in options_ref.stream():
+        sku = (option_doc.to_dict() or {}).get('sku')
+        if sku:
+            business_sku_index.setdefault(sku, option_doc.id)
+    
+    return business_sku_index
 
 def is_cache_valid(business_id):
     """Check if inventory cache is still valid for a business"""
-    if business_id not in inventory_cache_updated:
-        return False
-    
-    cache_age = datetime.now() - inventory_cache_updated[business_id]
-    return cache_age < timedelta(minutes=CACHE_DURATION_MINUTES)
+    snapshot = inventory_snapshots.get(business_id)
+    return bool(snapshot and snapshot.is_fresh())
 
 def get_stock_status(quantity):
     """Determine stock status based on quantity"""
@@ -98,6 +404,11 @@ def get_product_option_id_by_sku(business_context, sku):
     if not db or not business_id:
         return None
     
+    # A fresh index covers every option of the business, so a miss means no option
+    snapshot = inventory_snapshots.get(business_id)
+    if snapshot and snapshot.is_fresh():
+        return snapshot.sku_index.get(sku)
+    
     try:
         # Query product_options collection by SKU and business_id
         options_ref = db.collection('product_options').where(
@@ -117,19 +428,49 @@ def get_product_option_id_by_sku(business_context, sku):
         logger.error(f"Error getting product option ID by SKU {sku} for business {business_id}: {str(e)}")
         return None
 
+def get_product_options_by_skus(business_context, skus):
+    """Resolve many SKUs to product option documents with batched 'in' queries"""
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+    
+    options_by_sku = {}
+    
+    if not db or not business_id:
+        return options_by_sku
+    
+    unique_skus = [sku for sku in dict.fromkeys(skus) if sku]
+    
+    for start in range(0, len(unique_skus), FIRESTORE_IN_QUERY_LIMIT):
+        sku_chunk = unique_skus[start:start + FIRESTORE_IN_QUERY_LIMIT]
+        
+        try:
+            options_ref = db.collection('product_options').where(
+                filter=firestore.FieldFilter('business_id', '==', business_id)
+            ).where(
+                filter=firestore.FieldFilter('sku', 'in', sku_chunk)
+            )
+            
+            for option_doc in options_ref.stream():
+                option_data = option_doc.to_dict()
+                option_data['id'] = option_doc.id
+                options_by_sku.setdefault(option_data.get('sku'), option_data)
+                
+        except Exception as e:
+            logger.error(f"Error resolving {len(sku_chunk)} SKUs for business {business_id}: {str(e)}")
+    
+    return options_by_sku
+
 def get_product_stock(business_context, product_identifier):
     """Get current stock for a product using SKU, product option ID, or product ID"""
     business_id = business_context.get('business_id')
     db = business_context.get('db')
     
-    # Update cache if it's stale
-    if not is_cache_valid(business_id):
-        update_inventory_cache(business_context)
-    
-    # Check cache first
-    cache_key = get_cache_key(business_id, product_identifier)
-    if cache_key in inventory_cache:
-        return inventory_cache[cache_key]
+    # Check cache first; stale snapshots are served while they refresh in the background
+    snapshot = get_inventory_snapshot(business_context) if db and business_id else None
+    if snapshot:
+        stock_info = snapshot.get(product_identifier)
+        if stock_info is not None:
+            return dict(stock_info)
     
     # Try to resolve SKU to product option ID first
     product_option_id = get_product_option_id_by_sku(business_context, product_identifier)
@@ -189,11 +530,10 @@ def get_product_stock(business_context, product_identifier):
                 }
                 
                 # Cache by both original identifier and resolved ID
-                cache_key = get_cache_key(business_id, product_identifier)
-                inventory_cache[cache_key] = stock_info
+                cached_entries = {product_identifier: MappingProxyType(dict(stock_info))}
                 if product_option_id:
-                    option_cache_key = get_cache_key(business_id, product_option_id)
-                    inventory_cache[option_cache_key] = stock_info
+                    cached_entries[product_option_id] = cached_entries[product_identifier]
+                _add_snapshot_items(business_id, cached_entries)
                 
                 return stock_info
                 
@@ -210,6 +550,148 @@ def get_product_stock(business_context, product_identifier):
         "product_option_id": product_option_id
     }
 
+def _query_inventory_chunk(db, business_id, field, values):
+    """Fetch inventory documents where field is one of up to 30 values"""
+    inventory_ref = db.collection('inventory').where(
+        filter=firestore.FieldFilter('business_id', '==', business_id)
+    ).where(
+        filter=firestore.FieldFilter(field, 'in', values)
+    )
+    return [doc.to_dict() for doc in inventory_ref.stream()]
+
+def get_product_stock_batch(business_context, product_identifiers):
+    """
+    Get current stock for many products at once
+    
+    Cache hits are answered from the inventory snapshot. Misses are resolved
+    with chunked 'in' queries (SKU -> option, then inventory by option ID and
+    by product ID) run in parallel, plus one batched read for missing names.
+    
+    Returns:
+        Dict of product identifier -> stock info, in the format of get_product_stock
+    """
+    business_id = business_context.get('business_id')
+    db = business_context.get('db')
+    
+    identifiers = [identifier for identifier in dict.fromkeys(product_identifiers) if identifier]
+    results = {}
+    
+    snapshot = get_inventory_snapshot(business_context) if db and business_id else None
+    if snapshot:
+        for identifier in identifiers:
+            stock_info = snapshot.get(identifier)
+            if stock_info is not None:
+                results[identifier] = dict(stock_info)
+    
+    missing = [identifier for identifier in identifiers if identifier not in results]
+    if not missing or not db or not business_id:
+        return _fill_missing_stock(results, missing, {})
+    
+    from utils.background import map_concurrently
+    
+    option_ids = {}
+    options_by_sku = {}
+    
+    try:
+        # Resolve SKUs to product option IDs
+        if snapshot and snapshot.is_fresh():
+            option_ids = {identifier: snapshot.sku_index[identifier] for identifier in missing if identifier in snapshot.sku_index}
+        else:
+            options_by_sku = get_product_options_by_skus(business_context, missing)
+            option_ids = {sku: option['id'] for sku, option in options_by_sku.items()}
+        
+        by_option = list(dict.fromkeys(option_ids.values()))
+        by_product = [identifier for identifier in missing if identifier not in option_ids]
+        
+        chunks = [('product_option_id', by_option[i:i + FIRESTORE_IN_QUERY_LIMIT]) for i in range(0, len(by_option), FIRESTORE_IN_QUERY_LIMIT)]
+        chunks += [('product_id', by_product[i:i + FIRESTORE_IN_QUERY_LIMIT]) for i in range(0, len(by_product), FIRESTORE_IN_QUERY_LIMIT)]
+        
+        chunk_results = map_concurrently(lambda chunk: _query_inventory_chunk(db, business_id, chunk[0], chunk[1]), chunks)
+        
+        inventory_by_option = {}
+        inventory_by_product = {}
+        for inventory_docs in chunk_results:
+            for inventory_data in inventory_docs:
+                if inventory_data.get('product_option_id'):
+                    inventory_by_option.setdefault(inventory_data['product_option_id'], inventory_data)
+                if inventory_data.get('product_id'):
+                    inventory_by_product.setdefault(inventory_data['product_id'], inventory_data)
+        
+        found = {}
+        for identifier in missing:
+            product_option_id = option_ids.get(identifier)
+            inventory_data = inventory_by_option.get(product_option_id) if product_option_id else None
+            if inventory_data is None:
+                inventory_data = inventory_by_product.get(identifier)
+            if inventory_data is not None:
+                found[identifier] = (inventory_data, product_option_id)
+        
+        # Look up names the inventory rows don't carry with a single batched read
+        names = {}
+        unnamed = [identifier for identifier, (inventory_data, _) in found.items()
+                   if inventory_data.get('product_name', 'Unknown Product') in ('', 'Unknown Product')]
+        for identifier in unnamed:
+            if identifier in options_by_sku:
+                names[identifier] = options_by_sku[identifier].get('name', 'Unknown Product')
+        
+        name_refs = {}
+        for identifier in unnamed:
+            if identifier in names:
+                continue
+            product_option_id = found[identifier][1]
+            if product_option_id:
+                name_refs[identifier] = db.collection('product_options').document(product_option_id)
+            else:
+                name_refs[identifier] = db.collection('products').document(identifier)
+        
+        if name_refs:
+            docs_by_path = {doc.reference.path: doc for doc in db.get_all(list(name_refs.values())) if doc.exists}
+            for identifier, ref in name_refs.items():
+                doc = docs_by_path.get(ref.path)
+                if doc:
+                    doc_data = doc.to_dict()
+                    # Verify product belongs to this business
+                    if doc_data.get('business_id') == business_id:
+                        names[identifier] = doc_data.get('name', 'Unknown Product')
+        
+        cached_entries = {}
+        for identifier, (inventory_data, product_option_id) in found.items():
+            stock_info = {
+                "stock_quantity": inventory_data.get('stock_quantity', 0),
+                "stock_status": inventory_data.get('stock_status', 'out_of_stock'),
+                "last_updated": inventory_data.get('last_updated', datetime.now()).isoformat(),
+                "product_name": names.get(identifier, inventory_data.get('product_name', 'Unknown Product')),
+                "product_option_id": product_option_id
+            }
+            results[identifier] = stock_info
+            
+            # Cache by both original identifier and resolved ID
+            cached_entries[identifier] = MappingProxyType(dict(stock_info))
+            if product_option_id:
+                cached_entries[product_option_id] = cached_entries[identifier]
+        
+        if cached_entries:
+            _add_snapshot_items(business_id, cached_entries)
+        
+    except Exception as e:
+        logger.error(f"Error fetching stock in batch for {len(missing)} products in business {business_id}: {str(e)}")
+    
+    return _fill_missing_stock(results, missing, option_ids)
+
+def _fill_missing_stock(results, identifiers, option_ids):
+    """Mark identifiers without inventory data as out of stock"""
+    for identifier in identifiers:
+        if identifier not in results:
+            logger.warning(f"No inventory data found for product {identifier}, marking as out of stock")
+            results[identifier] = {
+                "stock_quantity": 0,
+                "stock_status": "out_of_stock",
+                "last_updated": datetime.now().isoformat(),
+                "product_name": "Unknown Product",
+                "product_option_id": option_ids.get(identifier)
+            }
+    return results
+
 def check_inventory_availability(business_context, cart_items):
     """Main verification function to check cart items against inventory"""
     business_id = business_context.get('business_id')
@@ -224,13 +706,16 @@ def check_inventory_availability(business_context, cart_items):
     }
     
     try:
+        # Look up stock for the whole cart at once
+        stock_by_product = get_product_stock_batch(business_context, [item.get("product_id") for item in cart_items])
+        
         for item in cart_items:
             product_id = item.get("product_id")
             requested_qty = item.get("quantity", 1)
             item_price = item.get("price", 0)
             
             # Get stock info
-            stock_info = get_product_stock(business_context, product_id)
+            stock_info = stock_by_product.get(product_id) or get_product_stock(business_context, product_id)
             available_qty = stock_info.get("stock_quantity", 0)
             
             # Calculate totals
@@ -344,91 +829,19 @@ def update_cart_with_available_stock(business_context, user_id, modified_cart):
         logger.error("Missing db or business_id in business context")
         return False
     
-    try:
-        session_ref = db.collection('whatsapp_sessions').document(f"{business_id}_{user_id}")
-        session_ref.update({
-            'cart': modified_cart,
-            'last_active': datetime.now()
-        })
-        
-        logger.info(f"Updated cart for user {user_id} in business {business_id} with available stock quantities")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Error updating cart with available stock for business {business_id}: {str(e)}")
-        return False
+    # Delegate to the cart model so stored cart totals stay in sync
+    from models.cart import update_cart_with_available_stock as update_cart
+    return update_cart(business_context, user_id, modified_cart)
 
 def reserve_inventory(business_context, product_id, quantity):
     """Reserve inventory for a product during checkout"""
-    db = business_context.get('db')
-    business_id = business_context.get('business_id')
-    
-    if not db or not business_id:
-        return False
-    
-    try:
-        inventory_ref = db.collection('inventory').where(
-            filter=firestore.FieldFilter('product_id', '==', product_id)
-        ).where(
-            filter=firestore.FieldFilter('business_id', '==', business_id)
-        ).limit(1)
-        inventory_docs = inventory_ref.get()
-        
-        for doc in inventory_docs:
-            current_data = doc.to_dict()
-            current_reserved = current_data.get('reserved_quantity', 0)
-            
-            # Update reserved quantity
-            doc.reference.update({
-                'reserved_quantity': current_reserved + quantity,
-                'last_updated': datetime.now()
-            })
-            
-            logger.info(f"Reserved {quantity} units of product {product_id} for business {business_id}")
-            return True
-        
-        return False
-        
-    except Exception as e:
-        logger.error(f"Error reserving inventory for business {business_id}: {str(e)}")
-        return False
+    from services.reservations import reserve_stock
+    return reserve_stock(business_context, product_id, quantity)["success"]
 
 def release_inventory(business_context, product_id, quantity):
     """Release reserved inventory for a product"""
-    db = business_context.get('db')
-    business_id = business_context.get('business_id')
-    
-    if not db or not business_id:
-        return False
-    
-    try:
-        inventory_ref = db.collection('inventory').where(
-            filter=firestore.FieldFilter('product_id', '==', product_id)
-        ).where(
-            filter=firestore.FieldFilter('business_id', '==', business_id)
-        ).limit(1)
-        inventory_docs = inventory_ref.get()
-        
-        for doc in inventory_docs:
-            current_data = doc.to_dict()
-            current_reserved = current_data.get('reserved_quantity', 0)
-            
-            # Update reserved quantity (ensure it doesn't go below 0)
-            new_reserved = max(0, current_reserved - quantity)
-            
-            doc.reference.update({
-                'reserved_quantity': new_reserved,
-                'last_updated': datetime.now()
-            })
-            
-            logger.info(f"Released {quantity} units of product {product_id} for business {business_id}")
-            return True
-        
-        return False
-        
-    except Exception as e:
-        logger.error(f"Error releasing inventory for business {business_id}: {str(e)}")
-        return False
+    from services.reservations import release_stock
+    return release_stock(business_context, product_id, quantity)
 
 def update_stock_quantity(business_context, product_id, new_quantity, reason="manual_update"):
     """Update the actual stock quantity for a product"""
@@ -459,32 +872,43 @@ def update_stock_quantity(business_context, product_id, new_quantity, reason="ma
                 'last_updated': datetime.now()
             }
             
-            # Add to update history
-            update_history = current_data.get('update_history', [])
-            update_history.append({
-                'previous_quantity': previous_quantity,
-                'new_quantity': new_quantity,
-                'reason': reason,
-                'updated_by': 'system',
-                'updated_at': datetime.now()
-            })
+            from services.inventory_ledger import add_stock_movement
+            batch = db.batch()
             
-            # Keep only last 10 updates
-            if len(update_history) > 10:
-                update_history = update_history[-10:]
+            # History lives in the ledger subcollection; move any legacy inline copy there
+            if 'update_history' in current_data:
+                for entry in current_data['update_history']:
+                    add_stock_movement(
+                        batch, doc.reference, business_id, product_id,
+                        entry.get('previous_quantity', 0), entry.get('new_quantity', 0),
+                        entry.get('reason', 'unknown'), entry.get('updated_by', 'system'), entry.get('updated_at')
+                    )
+                update_data['update_history'] = firestore.DELETE_FIELD
             
-            update_data['update_history'] = update_history
+            batch.update(doc.reference, update_data)
+            add_stock_movement(batch, doc.reference, business_id, product_id, previous_quantity, new_quantity, reason)
+            batch.commit()
             
-            doc.reference.update(update_data)
+            # Sharded reservation quotas are sized from stock, so resize them too
+            if current_data.get('reservation_shards'):
+                from services.reservations import rebalance_reservation_shards
+                rebalance_reservation_shards(business_context, product_id)
             
-            # Update cache
-            cache_key = get_cache_key(business_id, product_id)
-            inventory_cache[cache_key] = {
+            # Update cache under every key that pointed at the old entry (product, option, SKU)
+            stock_data = MappingProxyType({
                 "stock_quantity": new_quantity,
                 "stock_status": new_status,
                 "last_updated": datetime.now().isoformat(),
-                "product_name": current_data.get('product_name', 'Unknown Product')
-            }
+                "product_name": current_data.get('product_name', 'Unknown Product'),
+                "product_option_id": current_data.get('product_option_id')
+            })
+            snapshot = inventory_snapshots.get(business_id)
+            previous_entry = snapshot.get(product_id) if snapshot else None
+            cached_keys = [
+                key for mapping in (snapshot.items, dict(snapshot.overlay))
+                for key, value in mapping.items() if value is previous_entry
+            ] if previous_entry else []
+            _add_snapshot_items(business_id, {key: stock_data for key in cached_keys or [product_id]})
             
             logger.info(f"Updated stock quantity for product {product_id} in business {business_id} from {previous_quantity} to {new_quantity}")
             return True
@@ -0,0 +1,414 @@
+"""
+Time-bounded inventory holds
+Stock reserved at checkout is held for an order until it is paid, cancelled or expires
+
+Each hold is an inventory_holds document with the order ID, the reserved
+quantity and an expires_at time. A background reaper releases expired holds
+in batches using the composite index (status ASC, expires_at ASC), defined
+in deployment/firestore.indexes.json.
+
+Confirming an order commits its holds. A committed hold keeps its stock
+reserved until the order ships (fulfill_order_holds takes the units off
+stock and the reservation together) or is cancelled (release_order_holds).
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from firebase_admin import firestore
+
+from config import INVENTORY_HOLD_MINUTES, HOLD_REAPER_INTERVAL_SECONDS, HOLD_REAPER_BATCH_SIZE
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+HOLDS_COLLECTION = 'inventory_holds'
+
+# Holds whose stock is still reserved
+RELEASABLE_HOLD_STATUSES = ('active', 'committed')
+
+# Order statuses that consume committed holds
+FULFILLED_ORDER_STATUSES = ('shipped', 'delivered')
+
+# Reaper metrics, reported by get_hold_metrics
+hold_metrics = {
+    "holds_created": 0,
+    "holds_committed": 0,
+    "holds_released": 0,
+    "holds_fulfilled": 0,
+    "reaper_runs": 0,
+    "last_run_at": None,
+    "last_run_reaped": 0,
+    "last_run_duration_ms": 0.0,
+    "total_reaped": 0,
+    "reaper_errors": 0
+}
+_metrics_lock = threading.Lock()
+
+_reaper_thread = None
+_reaper_stop = threading.Event()
+
+
+class HoldsExpiredError(Exception):
+    """An order's holds were released (e.g. reaped) and its stock could not be held again"""
+    pass
+
+
+def _increment_metric(name: str, amount=1):
+    with _metrics_lock:
+        hold_metrics[name] += amount
+
+
+def place_order_holds(business_context, order_id: str, user_id: str, items: List[Dict[str, Any]],
+                      hold_minutes: Optional[int] = None) -> bool:
+    """
+    Reserve stock for every item of an order and record a hold for each reservation
+
+    All-or-nothing: if any item can't be reserved, the reservations already
+    made are released and False is returned.
+    """
+    from services.reservations import reserve_stock, release_stock
+
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+
+    if not db or not business_id:
+        return False
+
+    expires_at = datetime.now() + timedelta(minutes=hold_minutes or INVENTORY_HOLD_MINUTES)
+    reservations = []
+
+    try:
+        for item in items:
+            product_id = item.get("product_id")
+            quantity = item.get("quantity", 0)
+            if not product_id or quantity <= 0:
+                continue
+
+            result = reserve_stock(business_context, product_id, quantity)
+            if not result["success"]:
+                logger.warning(f"Could not hold {quantity} units of {product_id} for order {order_id}: {result['reason']}")
+                for held_product_id, held in reservations:
+                    release_stock(business_context, held_product_id, held["quantity"], shard=held["shard"])
+                return False
+
+            reservations.append((product_id, result))
+
+        batch = db.batch()
+        for product_id, result in reservations:
+            batch.set(db.collection(HOLDS_COLLECTION).document(), {
+                'business_id': business_id,
+                'order_id': order_id,
+                'user_id': user_id,
+                'product_id': product_id,
+                'inventory_id': result["inventory_id"],
+                'quantity': result["quantity"],
+                'shard': result["shard"],
+                'status': 'active',
+                'created_at': datetime.now(),
+                'expires_at': expires_at
+            })
+
+        batch.update(db.collection('orders').document(order_id), {
+            'inventory_reserved': True,
+            'inventory_hold_status': 'active',
+            'inventory_hold_expires_at': expires_at,
+            'updated_at': datetime.now()
+        })
+        batch.commit()
+
+        _increment_metric("holds_created", len(reservations))
+        logger.info(f"Placed {len(reservations)} inventory holds for order {order_id} until {expires_at.isoformat()}")
+        return True
+
+    except Exception as e:
+        logger.error(f"Error placing inventory holds for order {order_id}: {str(e)}")
+        for held_product_id, held in reservations:
+            release_stock(business_context, held_product_id, held["quantity"], shard=held["shard"])
+        return False
+
+
+def _claim_hold(db, hold_ref, new_status: str, from_statuses=('active',)) -> Optional[Dict[str, Any]]:
+    """Move a hold out of one of from_statuses exactly once; returns its data if this caller won"""
+
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = hold_ref.get(transaction=transaction)
+        if not snapshot.exists or snapshot.get('status') not in from_statuses:
+            return None
+        transaction.update(hold_ref, {'status': new_status, 'resolved_at': datetime.now()})
+        return snapshot.to_dict()
+
+    return claim(db.transaction())
+
+
+def _active_order_holds_query(db, order_id: str):
+    return db.collection(HOLDS_COLLECTION).where(
+        filter=firestore.FieldFilter('order_id', '==', order_id)
+    ).where(
+        filter=firestore.FieldFilter('status', '==', 'active')
+    )
+
+
+def _active_order_holds(db, order_id: str):
+    return _active_order_holds_query(db, order_id).stream()
+
+
+def _order_holds(db, order_id: str, statuses):
+    return db.collection(HOLDS_COLLECTION).where(
+        filter=firestore.FieldFilter('order_id', '==', order_id)
+    ).where(
+        filter=firestore.FieldFilter('status', 'in', list(statuses))
+    ).stream()
+
+
+def read_active_order_holds(transaction, db, order_id: str) -> List[Any]:
+    """Read an order's active holds inside a transaction, so they can be committed with it"""
+    return list(transaction.get(_active_order_holds_query(db, order_id)))
+
+
+def commit_holds_in_transaction(transaction, hold_docs: List[Any]) -> int:
+    """
+    Mark holds read with read_active_order_holds as committed in the same transaction
+
+    The transaction fails and retries if the reaper expires a hold first.
+    Call record_committed_holds after the transaction succeeds.
+    """
+    for hold_doc in hold_docs:
+        transaction.update(hold_doc.reference, {'status': 'committed', 'resolved_at': datetime.now()})
+    return len(hold_docs)
+
+
+def record_committed_holds(count: int):
+    """Count holds committed through a caller's transaction"""
+    if count:
+        _increment_metric("holds_committed", count)
+
+
+def release_holds(business_context, hold_refs, status: str = 'released', from_statuses=RELEASABLE_HOLD_STATUSES) -> int:
+    """Release the stock of every hold among hold_refs in one of from_statuses, returning the number released"""
+    from services.reservations import release_stock
+
+    db = business_context.get('db')
+    released = 0
+    for hold_ref in hold_refs:
+        hold = _claim_hold(db, hold_ref, status, from_statuses)
+        if hold:
+            release_stock(business_context, hold['product_id'], hold['quantity'], shard=hold.get('shard'))
+            released += 1
+    return released
+
+
+def release_order_holds(business_context, order_id: str, status: str = 'released') -> int:
+    """Release every active or committed hold of an order, returning the number of holds released"""
+    db = business_context.get('db')
+    if not db:
+        return 0
+
+    released = 0
+    try:
+        hold_refs = [hold_doc.reference for hold_doc in _order_holds(db, order_id, RELEASABLE_HOLD_STATUSES)]
+        released = release_holds(business_context, hold_refs, status)
+
+        if released:
+            db.collection('orders').document(order_id).update({
+                'inventory_reserved': False,
+                'inventory_hold_status': status,
+                'updated_at': datetime.now()
+            })
+            _increment_metric("holds_released", released)
+            logger.info(f"Released {released} inventory holds for order {order_id}")
+
+        return released
+
+    except Exception as e:
+        logger.error(f"Error releasing inventory holds for order {order_id}: {str(e)}")
+        return released
+
+
+def commit_order_holds(business_context, order_id: str) -> int:
+    """Keep an order's reserved stock once the order is confirmed, so the reaper leaves it alone"""
+    db = business_context.get('db')
+    if not db:
+        return 0
+
+    committed = 0
+    try:
+        for hold_doc in _active_order_holds(db, order_id):
+            if _claim_hold(db, hold_doc.reference, 'committed'):
+                committed += 1
+
+        if committed:
+            db.collection('orders').document(order_id).update({
+                'inventory_hold_status': 'committed',
+                'updated_at': datetime.now()
+            })
+            _increment_metric("holds_committed", committed)
+
+        return committed
+
+    except Exception as e:
+        logger.error(f"Error committing inventory holds for order {order_id}: {str(e)}")
+        return committed
+
+
+def fulfill_order_holds(db, order_id: str) -> int:
+    """
+    Consume the committed holds of an order that has shipped
+
+    The held units come off stock_quantity and reserved_quantity together,
+    so the reservation doesn't outlive the sale. Returns the number of holds
+    fulfilled; calling it again for the same order does nothing.
+    """
+    from services.reservations import consume_stock
+
+    if not db:
+        return 0
+
+    fulfilled = 0
+    try:
+        for hold_doc in _order_holds(db, order_id, ('committed',)):
+            hold = _claim_hold(db, hold_doc.reference, 'fulfilled', ('committed',))
+            if hold:
+                business_context = {'db': db, 'business_id': hold.get('business_id')}
+                consume_stock(business_context, hold['product_id'], hold['quantity'], shard=hold.get('shard'))
+                fulfilled += 1
+
+        if fulfilled:
+            db.collection('orders').document(order_id).update({
+                'inventory_reserved': False,
+                'inventory_hold_status': 'fulfilled',
+                'updated_at': datetime.now()
+            })
+            _increment_metric("holds_fulfilled", fulfilled)
+            logger.info(f"Fulfilled {fulfilled} inventory holds for order {order_id}")
+
+        return fulfilled
+
+    except Exception as e:
+        logger.error(f"Error fulfilling inventory holds for order {order_id}: {str(e)}")
+        return fulfilled
+
+
+def reap_expired_holds(db, now: Optional[datetime] = None, batch_size: int = HOLD_REAPER_BATCH_SIZE, max_batches: int = 10) -> int:
+    """Release holds whose expiry has passed, oldest first, in batches; returns the number reaped"""
+    from services.reservations import release_stock
+
+    now = now or datetime.now()
+    started_at = time.perf_counter()
+    reaped = 0
+
+    try:
+        for _ in range(max_batches):
+            expired_query = db.collection(HOLDS_COLLECTION).where(
+                filter=firestore.FieldFilter('status', '==', 'active')
+            ).where(
+                filter=firestore.FieldFilter('expires_at', '<=', now)
+            ).order_by('expires_at').limit(batch_size)
+
+            hold_docs = list(expired_query.stream())
+            if not hold_docs:
+                break
+
+            expired_orders = {}
+            for hold_doc in hold_docs:
+                hold = _claim_hold(db, hold_doc.reference, 'expired')
+                if not hold:
+                    # Committed or released since the query ran
+                    continue
+
+                business_context = {'db': db, 'business_id': hold.get('business_id')}
+                release_stock(business_context, hold['product_id'], hold['quantity'], shard=hold.get('shard'))
+                expired_orders[hold['order_id']] = hold.get('business_id')
+                reaped += 1
+
+            # Mark each affected order once per batch
+            order_batch = db.batch()
+            for order_id in expired_orders:
+                order_batch.update(db.collection('orders').document(order_id), {
+                    'inventory_reserved': False,
+                    'inventory_hold_status': 'expired',
+                    'updated_at': datetime.now()
+                })
+                order_batch.set(db.collection('order_history').document(), {
+                    "order_id": order_id,
+                    "status": "Inventory hold expired - stock released",
+                    "notes": "Inventory hold expired - stock released",
+                    "notification_sent": False,
+                    "created_by": "system",
+                    "created_at": datetime.now()
+                })
+            if expired_orders:
+                order_batch.commit()
+
+            if len(hold_docs) < batch_size:
+                break
+
+    except Exception as e:
+        _increment_metric("reaper_errors")
+        logger.error(f"Error reaping expired inventory holds: {str(e)}")
+
+    with _metrics_lock:
+        hold_metrics["reaper_runs"] += 1
+        hold_metrics["last_run_at"] = now.isoformat()
+        hold_metrics["last_run_reaped"] = reaped
+        hold_metrics["last_run_duration_ms"] = round((time.perf_counter() - started_at) * 1000, 1)
+        hold_metrics["total_reaped"] += reaped
+
+    if reaped:
+        logger.info(f"Reaped {reaped} expired inventory holds")
+
+    return reaped
+
+
+def count_active_holds(db, business_id: Optional[str] = None) -> int:
+    """Count active holds, optionally for one business"""
+    try:
+        query = db.collection(HOLDS_COLLECTION).where(filter=firestore.FieldFilter('status', '==', 'active'))
+        if business_id:
+            query = query.where(filter=firestore.FieldFilter('business_id', '==', business_id))
+
+        result = query.count().get()
+        return int(result[0][0].value)
+
+    except Exception as e:
+        logger.error(f"Error counting active inventory holds: {str(e)}")
+        return 0
+
+
+def get_hold_metrics(db=None, business_id: Optional[str] = None) -> Dict[str, Any]:
+    """Reaper and hold counters, plus the current number of active holds if db is given"""
+    with _metrics_lock:
+        metrics = dict(hold_metrics)
+
+    metrics["reaper_running"] = bool(_reaper_thread and _reaper_thread.is_alive())
+    if db is not None:
+        metrics["active_holds"] = count_active_holds(db, business_id)
+
+    return metrics
+
+
+def start_hold_reaper(db, interval_seconds: int = HOLD_REAPER_INTERVAL_SECONDS) -> bool:
+    """Start the background thread that reaps expired holds"""
+    global _reaper_thread
+
+    if _reaper_thread and _reaper_thread.is_alive():
+        return False
+
+    _reaper_stop.clear()
+
+    def run():
+        while not _reaper_stop.wait(interval_seconds):
+            reap_expired_holds(db)
+
+    _reaper_thread = threading.Thread(target=run, name="inventory-hold-reaper", daemon=True)
+    _reaper_thread.start()
+    logger.info(f"Started inventory hold reaper (every {interval_seconds}s)")
+    return True
+
+
+def stop_hold_reaper():
+    """Stop the background reaper thread"""
+    _reaper_stop.set()
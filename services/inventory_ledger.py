@@ -0,0 +1,214 @@
+"""
+Inventory ledger
+Append-only record of stock movements, kept in inventory/{id}/ledger
+
+Inventory documents only hold current quantities, so they stay small no
+matter how often stock changes. A periodic compaction job writes a snapshot
+of each product's quantity to inventory/{id}/ledger_snapshots and drops
+ledger entries older than the retention window.
+"""
+
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from firebase_admin import firestore
+
+from config import LEDGER_RETENTION_DAYS, LEDGER_COMPACTION_INTERVAL_HOURS
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+LEDGER_COLLECTION = 'ledger'
+SNAPSHOTS_COLLECTION = 'ledger_snapshots'
+
+# Firestore batches accept at most 500 writes
+BATCH_WRITE_LIMIT = 500
+
+_compaction_thread = None
+_compaction_stop = threading.Event()
+
+
+def add_stock_movement(batch, inventory_ref, business_id: str, product_id: str, previous_quantity, new_quantity,
+                       reason: str, updated_by: str = 'system', created_at: Optional[datetime] = None):
+    """Add a ledger entry for a stock change to a write batch or transaction"""
+    batch.set(inventory_ref.collection(LEDGER_COLLECTION).document(), {
+        'business_id': business_id,
+        'product_id': product_id,
+        'previous_quantity': previous_quantity,
+        'new_quantity': new_quantity,
+        'change': new_quantity - previous_quantity,
+        'reason': reason,
+        'updated_by': updated_by,
+        'created_at': created_at or datetime.now()
+    })
+
+
+def get_stock_movements(business_context, product_id: str, start: Optional[datetime] = None,
+                        end: Optional[datetime] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Get a product's stock movements in [start, end), oldest first"""
+    from services.reservations import find_inventory_ref
+
+    if not business_context.get('db'):
+        return []
+
+    try:
+        inventory_ref = find_inventory_ref(business_context, product_id)
+        if not inventory_ref:
+            return []
+
+        query = inventory_ref.collection(LEDGER_COLLECTION)
+        if start:
+            query = query.where(filter=firestore.FieldFilter('created_at', '>=', start))
+        if end:
+            query = query.where(filter=firestore.FieldFilter('created_at', '<', end))
+        query = query.order_by('created_at')
+        if limit:
+            query = query.limit(limit)
+
+        movements = []
+        for doc in query.stream():
+            movement = doc.to_dict()
+            movement['id'] = doc.id
+            movements.append(movement)
+
+        return movements
+
+    except Exception as e:
+        logger.error(f"Error getting stock movements for product {product_id} in business {business_context.get('business_id')}: {str(e)}")
+        return []
+
+
+def get_latest_ledger_snapshot(business_context, product_id: str, before: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """Get the most recent compaction snapshot of a product, optionally taken before a time"""
+    from services.reservations import find_inventory_ref
+
+    try:
+        inventory_ref = find_inventory_ref(business_context, product_id)
+        if not inventory_ref:
+            return None
+
+        query = inventory_ref.collection(SNAPSHOTS_COLLECTION)
+        if before:
+            query = query.where(filter=firestore.FieldFilter('as_of', '<', before))
+
+        for doc in query.order_by('as_of', direction=firestore.Query.DESCENDING).limit(1).stream():
+            return doc.to_dict()
+
+        return None
+
+    except Exception as e:
+        logger.error(f"Error getting ledger snapshot for product {product_id}: {str(e)}")
+        return None
+
+
+def compact_inventory_ledger(db, inventory_doc, retain_days: int = LEDGER_RETENTION_DAYS) -> int:
+    """
+    Compact one inventory document's ledger
+
+    Moves any legacy update_history array into the ledger, writes a snapshot
+    of the current quantity and deletes ledger entries older than the
+    retention window. Returns the number of ledger entries deleted.
+    """
+    inventory_ref = inventory_doc.reference
+    inventory_data = inventory_doc.to_dict() or {}
+    now = datetime.now()
+    cutoff = now - timedelta(days=retain_days)
+
+    batch = db.batch()
+    pending_writes = 0
+
+    # Documents written before the ledger existed carry their history inline
+    legacy_history = inventory_data.get('update_history')
+    if legacy_history is not None:
+        for entry in legacy_history:
+            add_stock_movement(
+                batch, inventory_ref, inventory_data.get('business_id'), inventory_data.get('product_id'),
+                entry.get('previous_quantity', 0), entry.get('new_quantity', 0),
+                entry.get('reason', 'unknown'), entry.get('updated_by', 'system'), entry.get('updated_at')
+            )
+            pending_writes += 1
+            if pending_writes >= BATCH_WRITE_LIMIT - 2:
+                batch.commit()
+                batch = db.batch()
+                pending_writes = 0
+        batch.update(inventory_ref, {'update_history': firestore.DELETE_FIELD})
+        pending_writes += 1
+
+    batch.set(inventory_ref.collection(SNAPSHOTS_COLLECTION).document(), {
+        'business_id': inventory_data.get('business_id'),
+        'product_id': inventory_data.get('product_id'),
+        'stock_quantity': inventory_data.get('stock_quantity', 0),
+        'reserved_quantity': inventory_data.get('reserved_quantity', 0),
+        'as_of': now
+    })
+    batch.commit()
+
+    # The snapshot now stands in for movements before the cutoff
+    deleted = 0
+    old_entries = inventory_ref.collection(LEDGER_COLLECTION).where(
+        filter=firestore.FieldFilter('created_at', '<', cutoff)
+    ).select([]).limit(BATCH_WRITE_LIMIT)
+
+    while True:
+        old_docs = list(old_entries.stream())
+        if not old_docs:
+            break
+
+        delete_batch = db.batch()
+        for doc in old_docs:
+            delete_batch.delete(doc.reference)
+        delete_batch.commit()
+        deleted += len(old_docs)
+
+        if len(old_docs) < BATCH_WRITE_LIMIT:
+            break
+
+    return deleted
+
+
+def compact_all_ledgers(db, business_id: Optional[str] = None, retain_days: int = LEDGER_RETENTION_DAYS) -> Dict[str, int]:
+    """Compact the ledger of every inventory document, optionally for one business"""
+    stats = {"compacted": 0, "deleted_entries": 0, "errors": 0}
+
+    query = db.collection('inventory')
+    if business_id:
+        query = query.where(filter=firestore.FieldFilter('business_id', '==', business_id))
+
+    for inventory_doc in query.stream():
+        try:
+            stats["deleted_entries"] += compact_inventory_ledger(db, inventory_doc, retain_days)
+            stats["compacted"] += 1
+        except Exception as e:
+            stats["errors"] += 1
+            logger.error(f"Error compacting ledger for inventory {inventory_doc.id}: {str(e)}")
+
+    logger.info(f"Compacted {stats['compacted']} inventory ledgers, deleted {stats['deleted_entries']} old entries")
+    return stats
+
+
+def start_ledger_compaction(db, interval_hours: int = LEDGER_COMPACTION_INTERVAL_HOURS) -> bool:
+    """Start the background thread that compacts inventory ledgers periodically"""
+    global _compaction_thread
+
+    if _compaction_thread and _compaction_thread.is_alive():
+        return False
+
+    _compaction_stop.clear()
+
+    def run():
+        while not _compaction_stop.wait(interval_hours * 3600):
+            try:
+                compact_all_ledgers(db)
+            except Exception as e:
+                logger.error(f"Inventory ledger compaction failed: {str(e)}")
+
+    _compaction_thread = threading.Thread(target=run, name="inventory-ledger-compaction", daemon=True)
+    _compaction_thread.start()
+    logger.info(f"Started inventory ledger compaction (every {interval_hours}h)")
+    return True
+
+
+def stop_ledger_compaction():
+    """Stop the background compaction thread"""
+    _compaction_stop.set()
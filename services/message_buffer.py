@@ -0,0 +1,195 @@
+"""
+Inbound message buffer for coalescing bursts of text messages
+Merges consecutive texts from the same user into a single intent-processing pass
+
+Only businesses that set a debounce window buffer at all. Texts answering a
+prompt (the user's current action is awaiting_*, e.g. a mobile money number
+or an address) are never merged; each one is processed on its own.
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+from config import MESSAGE_DEBOUNCE_MS, MESSAGE_DEBOUNCE_MAX_MESSAGES
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class PendingTextBurst:
+    """Text messages from one user waiting for the debounce window to close"""
+
+    def __init__(self, business_context, user_id: str, message: Dict[str, Any], handler: Callable):
+        self.business_context = business_context
+        self.user_id = user_id
+        self.handler = handler
+        self.messages = [message]
+        self.timer = None
+
+
+# Pending bursts keyed by (business_id, user_id)
+_pending_bursts: Dict[Tuple[str, str], PendingTextBurst] = {}
+_pending_lock = threading.Lock()
+
+# Serialize processing per user so a late burst never overtakes an earlier one.
+# Each entry is [lock, bursts using it] and is dropped when the count reaches 0
+_processing_locks: Dict[Tuple[str, str], list] = {}
+
+# Current actions whose replies are structured input
+STRUCTURED_INPUT_ACTION_PREFIX = 'awaiting_'
+
+
+def get_debounce_window_ms(business_context) -> int:
+    """Get the debounce window configured for a business"""
+    window_ms = getattr(business_context, 'message_debounce_ms', None)
+    if window_ms is None:
+        return MESSAGE_DEBOUNCE_MS
+    return window_ms
+
+
+def is_awaiting_structured_input(business_id: str, user_id: str) -> bool:
+    """Whether the user is answering a prompt, so their texts must not be merged"""
+    from models.session import get_current_action
+
+    try:
+        current_action = get_current_action(business_id, user_id)
+    except Exception as e:
+        logger.warning(f"Could not read current action for {user_id}: {str(e)}")
+        return False
+
+    return bool(current_action) and current_action.startswith(STRUCTURED_INPUT_ACTION_PREFIX)
+
+
+def merge_text_messages(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge several WhatsApp text messages into one message payload"""
+    if len(messages) == 1:
+        return messages[0]
+
+    bodies = []
+    for message in messages:
+        body = message.get("text", {}).get("body", "").strip()
+        if body:
+            bodies.append(body)
+
+    merged = dict(messages[-1])
+    merged["text"] = {"body": " ".join(bodies)}
+    merged["coalesced_message_ids"] = [message.get("id") for message in messages]
+    return merged
+
+
+def submit_text_message(business_context, user_id: str, message: Dict[str, Any], handler: Callable) -> bool:
+    """
+    Buffer a text message until the user's debounce window closes
+
+    Args:
+        business_context: Business context of the webhook
+        user_id: WhatsApp number of the sender
+        message: Raw WhatsApp text message
+        handler: Called as handler(user_id, message, business_context) with the merged message
+
+    Returns:
+        True if the message was buffered, False if it was processed immediately
+    """
+    window_ms = get_debounce_window_ms(business_context)
+
+    if window_ms <= 0:
+        _dispatch(PendingTextBurst(business_context, user_id, message, handler))
+        return False
+
+    key = (business_context.business_id, user_id)
+
+    if is_awaiting_structured_input(business_context.business_id, user_id):
+        # Earlier buffered texts go first, then this reply on its own
+        flush_pending_text(business_context.business_id, user_id)
+        _dispatch(PendingTextBurst(business_context, user_id, message, handler))
+        return False
+    ready_burst = None
+
+    with _pending_lock:
+        burst = _pending_bursts.get(key)
+
+        if burst:
+            burst.timer.cancel()
+            burst.messages.append(message)
+            burst.business_context = business_context
+        else:
+            burst = PendingTextBurst(business_context, user_id, message, handler)
+            _pending_bursts[key] = burst
+
+        if len(burst.messages) >= MESSAGE_DEBOUNCE_MAX_MESSAGES:
+            # Don't let a chatty user hold the burst open forever
+            _pending_bursts.pop(key, None)
+            ready_burst = burst
+        else:
+            burst.timer = threading.Timer(window_ms / 1000.0, _flush_burst, args=(key, burst))
+            burst.timer.daemon = True
+            burst.timer.start()
+
+    if ready_burst:
+        _dispatch(ready_burst)
+    else:
+        logger.debug(f"Buffered text message from {user_id} for business {key[0]} ({len(burst.messages)} pending)")
+
+    return True
+
+
+def flush_pending_text(business_id: str, user_id: str) -> bool:
+    """Process any buffered texts for a user right away (e.g. before a button reply)"""
+    key = (business_id, user_id)
+
+    with _pending_lock:
+        burst = _pending_bursts.pop(key, None)
+        if burst and burst.timer:
+            burst.timer.cancel()
+
+    if not burst:
+        return False
+
+    _dispatch(burst)
+    return True
+
+
+def get_pending_count(business_id: str = None) -> int:
+    """Get the number of users with buffered texts"""
+    with _pending_lock:
+        if business_id is None:
+            return len(_pending_bursts)
+        return sum(1 for key in _pending_bursts if key[0] == business_id)
+
+
+def _flush_burst(key: Tuple[str, str], burst: PendingTextBurst):
+    """Timer callback: process the burst if it is still the current one for the user"""
+    with _pending_lock:
+        if _pending_bursts.get(key) is not burst:
+            # Already flushed by a button reply or the message cap
+            return
+        _pending_bursts.pop(key, None)
+
+    _dispatch(burst)
+
+
+def _dispatch(burst: PendingTextBurst):
+    """Run the handler for a burst with the merged message"""
+    business_id = getattr(burst.business_context, 'business_id', None)
+    key = (business_id, burst.user_id)
+
+    with _pending_lock:
+        lock_entry = _processing_locks.setdefault(key, [threading.Lock(), 0])
+        lock_entry[1] += 1
+
+    merged_message = merge_text_messages(burst.messages)
+
+    if len(burst.messages) > 1:
+        logger.info(f"Coalesced {len(burst.messages)} text messages from {burst.user_id} for business {business_id}")
+
+    try:
+        with lock_entry[0]:
+            try:
+                burst.handler(burst.user_id, merged_message, burst.business_context)
+            except Exception as e:
+                logger.error(f"Error processing buffered messages from {burst.user_id} for business {business_id}: {str(e)}")
+    finally:
+        with _pending_lock:
+            lock_entry[1] -= 1
+            if lock_entry[1] == 0 and _processing_locks.get(key) is lock_entry:
+                del _processing_locks[key]
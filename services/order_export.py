@@ -0,0 +1,285 @@
+"""
+Order export
+Streams a business's orders and their items to CSV or JSONL files
+
+Orders are read a page at a time with cursor queries (business_id,
+created_at ASC), their items are taken from line_items (or, for orders
+without one, read from the items subcollections of the page in parallel),
+and each page is formatted and written before the next is fetched, so
+memory use depends on the page size rather than the number of orders.
+
+Each page is written as one chunk (one gzip member for .gz files) and
+synced to disk. Only then are the ID of its last order and the file size
+saved next to the output file (<output>.cursor). --resume cuts the file
+back to that size, dropping anything a crash left half written, and
+appends from the cursor, so an interrupted export picks up where it
+stopped without duplicate rows or a broken gzip stream.
+
+Usage:
+    python -m services.order_export --business-id BUSINESS_ID --output orders.csv
+    python -m services.order_export --business-id BUSINESS_ID --output orders.jsonl.gz --format jsonl \\
+        --since 2024-01-01 --until 2024-06-30
+    python -m services.order_export --business-id BUSINESS_ID --output orders.csv --resume
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+from config import ORDER_EXPORT_PAGE_SIZE
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# One CSV row per line item; order columns repeat on each of its rows
+CSV_ORDER_COLUMNS = [
+    'order_id', 'created_at', 'status', 'payment_status', 'payment_method', 'customer_name',
+    'customer_whatsapp_number', 'shipping_method', 'city', 'subtotal', 'shipping_fee', 'total', 'currency'
+]
+CSV_ITEM_COLUMNS = ['item_product_id', 'item_name', 'item_variant', 'item_quantity', 'item_price', 'item_total']
+CSV_COLUMNS = CSV_ORDER_COLUMNS + CSV_ITEM_COLUMNS
+
+
+def _serialize(value):
+    """JSON fallback for Firestore values"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, 'latitude') and hasattr(value, 'longitude'):
+        return {'lat': value.latitude, 'lng': value.longitude}
+    return str(value)
+
+
+def iter_order_pages(db, business_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     page_size: int = ORDER_EXPORT_PAGE_SIZE, start_after_order_id: Optional[str] = None) -> Iterator[List[Dict[str, Any]]]:
+    """Pages of a business's orders created in [since, until), oldest first"""
+    orders_collection = db.collection('orders')
+    orders_ref = orders_collection.where(filter=firestore.FieldFilter('business_id', '==', business_id))
+    if since:
+        orders_ref = orders_ref.where(filter=firestore.FieldFilter('created_at', '>=', since))
+    if until:
+        orders_ref = orders_ref.where(filter=firestore.FieldFilter('created_at', '<', until))
+    orders_ref = orders_ref.order_by('created_at').limit(page_size)
+
+    cursor = None
+    if start_after_order_id:
+        cursor = orders_collection.document(start_after_order_id).get()
+        if not cursor.exists:
+            raise ValueError(f"Cursor order {start_after_order_id} not found")
+
+    while True:
+        page_ref = orders_ref.start_after(cursor) if cursor else orders_ref
+        order_docs = page_ref.get()
+        if not order_docs:
+            return
+
+        page = []
+        for order_doc in order_docs:
+            order = order_doc.to_dict()
+            order['order_id'] = order_doc.id
+            page.append(order)
+        yield page
+
+        if len(order_docs) < page_size:
+            return
+        cursor = order_docs[-1]
+
+
+def with_line_items(db, page: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+    """Pair each order of a page with its items, reading missing line_items in parallel"""
+    from models.order import get_order_line_items
+    from utils.background import map_concurrently
+
+    missing = [order for order in page if order.get('line_items') is None]
+    fetched = map_concurrently(lambda order: get_order_line_items(db, order['order_id']), missing) if missing else []
+    items_by_order = {order['order_id']: items for order, items in zip(missing, fetched)}
+
+    return [(order, items_by_order.get(order['order_id'], order.get('line_items') or [])) for order in page]
+
+
+def csv_lines(order: Dict[str, Any], items: List[Dict[str, Any]]) -> Iterator[str]:
+    """CSV rows for an order, one per line item (one with blank item columns if it has none)"""
+    customer = order.get('customer') or {}
+    created_at = order.get('created_at')
+    order_row = [
+        order['order_id'],
+        created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+        order.get('status'),
+        order.get('payment_status'),
+        order.get('payment_method'),
+        customer.get('name'),
+        customer.get('whatsapp_number'),
+        order.get('shipping_method'),
+        order.get('city'),
+        order.get('subtotal'),
+        order.get('shipping_fee'),
+        order.get('total'),
+        order.get('currency')
+    ]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for item in items or [{}]:
+        writer.writerow(order_row + [
+            item.get('product_id'),
+            item.get('name'),
+            item.get('variant_details'),
+            item.get('quantity'),
+            item.get('price'),
+            item.get('total')
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def jsonl_lines(order: Dict[str, Any], items: List[Dict[str, Any]]) -> Iterator[str]:
+    """One JSON object per order with its items"""
+    record = {key: value for key, value in order.items() if key != 'line_items'}
+    record['items'] = items
+    yield json.dumps(record, default=_serialize, ensure_ascii=False) + '\n'
+
+
+def csv_header() -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(CSV_COLUMNS)
+    return buffer.getvalue()
+
+
+def _open_output(path: str, resuming: bool, resume_offset: Optional[int]):
+    """The output file in binary mode, cut back to resume_offset when resuming from a saved cursor"""
+    if not resuming:
+        return open(path, 'wb')
+    if resume_offset is None:
+        return open(path, 'ab')
+
+    if os.path.getsize(path) < resume_offset:
+        raise ValueError(f"{path} is shorter than its saved cursor")
+    output = open(path, 'r+b')
+    output.truncate(resume_offset)
+    output.seek(resume_offset)
+    return output
+
+
+def _write_chunk(output, text: str, compress: bool) -> int:
+    """Write text as one chunk (a complete gzip member if compressing) and sync it; returns the file size"""
+    data = text.encode('utf-8')
+    output.write(gzip.compress(data) if compress else data)
+    output.flush()
+    os.fsync(output.fileno())
+    return output.tell()
+
+
+def cursor_path(output_path: str) -> str:
+    return f"{output_path}.cursor"
+
+
+def read_cursor(output_path: str) -> Tuple[Optional[str], Optional[int]]:
+    """Last exported order ID and the file size after its page, saved for an output file"""
+    try:
+        with open(cursor_path(output_path), encoding='utf-8') as cursor_file:
+            cursor = json.load(cursor_file)
+    except FileNotFoundError:
+        return None, None
+    return cursor.get('order_id'), cursor.get('offset')
+
+
+def _save_cursor(output_path: str, order_id: str, offset: int):
+    temp_path = f"{cursor_path(output_path)}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as cursor_file:
+        json.dump({'order_id': order_id, 'offset': offset}, cursor_file)
+    os.replace(temp_path, cursor_path(output_path))
+
+
+def export_orders(db, business_id: str, output_path: str, export_format: str = 'csv',
+                  since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  start_after_order_id: Optional[str] = None, page_size: int = ORDER_EXPORT_PAGE_SIZE,
+                  progress: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                  resume_offset: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Export a business's orders to output_path (gzip-compressed if it ends in .gz)
+
+    With start_after_order_id the export continues after that order,
+    appending to the file; with the resume_offset saved in the same cursor
+    the file is first cut back to the end of that order's page. progress is
+    called with the running stats after every page. Returns orders and
+    lines written and the last order ID.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format}")
+
+    format_lines = csv_lines if export_format == 'csv' else jsonl_lines
+    compress = output_path.endswith('.gz')
+    resuming = bool(start_after_order_id)
+    stats = {"orders": 0, "lines": 0, "pages": 0, "last_order_id": start_after_order_id}
+
+    with _open_output(output_path, resuming, resume_offset) as output:
+        if export_format == 'csv' and not resuming:
+            _write_chunk(output, csv_header(), compress)
+
+        for page in iter_order_pages(db, business_id, since, until, page_size, start_after_order_id):
+            lines = []
+            for order, items in with_line_items(db, page):
+                lines.extend(format_lines(order, items))
+                stats["orders"] += 1
+            stats["lines"] += len(lines)
+
+            # The cursor only moves once the whole page is on disk
+            offset = _write_chunk(output, ''.join(lines), compress)
+            stats["pages"] += 1
+            stats["last_order_id"] = page[-1]['order_id']
+            _save_cursor(output_path, stats["last_order_id"], offset)
+
+            logger.info(f"Exported {stats['orders']} orders of business {business_id} up to {stats['last_order_id']}")
+            if progress:
+                progress(dict(stats))
+
+    return stats
+
+
+def _parse_date(value: str) -> datetime:
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a business's orders to CSV or JSONL")
+    parser.add_argument("--business-id", required=True, help="Business to export")
+    parser.add_argument("--output", required=True, help="Output file; a .gz suffix compresses it")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default='csv', help="Output format")
+    parser.add_argument("--since", type=_parse_date, help="First day to include (YYYY-MM-DD)")
+    parser.add_argument("--until", type=_parse_date, help="Last day to include (YYYY-MM-DD)")
+    parser.add_argument("--page-size", type=int, default=ORDER_EXPORT_PAGE_SIZE, help="Orders per query")
+    parser.add_argument("--after", help="Continue after this order ID, appending to the output")
+    parser.add_argument("--resume", action="store_true", help="Continue from the cursor saved for the output")
+    args = parser.parse_args()
+
+    start_after_order_id, resume_offset = args.after, None
+    if args.resume and not start_after_order_id:
+        start_after_order_id, resume_offset = read_cursor(args.output)
+        if not start_after_order_id:
+            raise SystemExit(f"No saved cursor for {args.output}")
+
+    from config import db
+    if not db:
+        raise SystemExit("Firebase is not initialized")
+
+    until = args.until + timedelta(days=1) if args.until else None
+    stats = export_orders(
+        db, args.business_id, args.output, args.format, args.since, until,
+        start_after_order_id, args.page_size,
+        progress=lambda page_stats: print(f"{page_stats['orders']} orders exported (last {page_stats['last_order_id']})", flush=True),
+        resume_offset=resume_offset
+    )
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Order creation idempotency
+Turns double taps and webhook retries of checkout into a single order
+
+A key is derived from the business, the user, a fingerprint of the cart and a
+time window. Keys are remembered in a local cache and in order_idempotency
+marker documents. The marker is created in the same batch as the order, so of
+two concurrent attempts only one can commit.
+
+Markers carry an expires_at time; a Firestore TTL policy on that field
+(deployment/firestore.indexes.json) deletes them once they have expired.
+"""
+
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import ORDER_IDEMPOTENCY_WINDOW_SECONDS
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+MARKERS_COLLECTION = 'order_idempotency'
+
+# key -> (order_id, expires at monotonic time)
+_recent_keys: Dict[str, Tuple[str, float]] = {}
+_recent_keys_lock = threading.Lock()
+
+
+def cart_fingerprint(cart: List[Dict[str, Any]]) -> str:
+    """Stable hash of a cart's contents, independent of item order"""
+    lines = sorted(
+        f"{item.get('product_id')}|{item.get('product_option_id', '')}|{item.get('quantity')}|{item.get('price')}"
+        for item in cart
+    )
+    return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
+
+
+def _window_bucket(now: Optional[float] = None) -> int:
+    return int((now or time.time()) // ORDER_IDEMPOTENCY_WINDOW_SECONDS)
+
+
+def order_idempotency_key(business_id: str, user_id: str, fingerprint: str, bucket: int) -> str:
+    """Idempotency key for one cart of one user within one time window"""
+    raw = f"{business_id}:{user_id}:{fingerprint}:{bucket}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def candidate_keys(business_id: str, user_id: str, cart: List[Dict[str, Any]], now: Optional[float] = None) -> List[str]:
+    """
+    Keys for the current and previous window
+
+    A retry just after a window boundary still matches the original attempt;
+    the first key is the one a new order claims.
+    """
+    fingerprint = cart_fingerprint(cart)
+    bucket = _window_bucket(now)
+    return [order_idempotency_key(business_id, user_id, fingerprint, b) for b in (bucket, bucket - 1)]
+
+
+def latest_order_marker_id(business_id: str, user_id: str) -> str:
+    """Marker document ID recording a user's most recent order"""
+    raw = f"latest:{business_id}:{user_id}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def remember_order(keys: List[str], order_id: str):
+    """Remember keys locally for twice the window"""
+    expires_at = time.monotonic() + 2 * ORDER_IDEMPOTENCY_WINDOW_SECONDS
+    with _recent_keys_lock:
+        for key in keys:
+            _recent_keys[key] = (order_id, expires_at)
+
+        # Drop expired entries as we go so the cache stays small
+        now = time.monotonic()
+        for key in [key for key, (_, expiry) in _recent_keys.items() if expiry < now]:
+            _recent_keys.pop(key, None)
+
+
+def find_local_order(keys: List[str]) -> Optional[str]:
+    """Order ID remembered locally for any of the keys"""
+    now = time.monotonic()
+    with _recent_keys_lock:
+        for key in keys:
+            entry = _recent_keys.get(key)
+            if entry and entry[1] >= now:
+                return entry[0]
+    return None
+
+
+def find_marked_order(db, keys: List[str]) -> Optional[str]:
+    """Order ID recorded in a Firestore marker for any of the keys (one batched read)"""
+    marker_refs = [db.collection(MARKERS_COLLECTION).document(key) for key in keys]
+    now = datetime.now()
+
+    for marker_doc in db.get_all(marker_refs):
+        if not marker_doc.exists:
+            continue
+        marker = marker_doc.to_dict()
+        expires_at = marker.get('expires_at')
+        if expires_at and expires_at.replace(tzinfo=None) < now:
+            continue
+        return marker.get('order_id')
+
+    return None
+
+
+def find_recent_order_id(db, business_id: str, user_id: str) -> Optional[str]:
+    """The user's order from the current window, e.g. for a retry that finds the cart already cleared; None if it was cancelled"""
+    order_id = find_local_order([latest_order_marker_id(business_id, user_id)])
+
+    if not order_id:
+        marker_doc = db.collection(MARKERS_COLLECTION).document(latest_order_marker_id(business_id, user_id)).get()
+        if not marker_doc.exists:
+            return None
+
+        marker = marker_doc.to_dict()
+        expires_at = marker.get('expires_at')
+        if expires_at and expires_at.replace(tzinfo=None) < datetime.now():
+            return None
+        order_id = marker.get('order_id')
+
+    if not order_id:
+        return None
+
+    order_doc = db.collection('orders').document(order_id).get(field_paths=['status'])
+    if not order_doc.exists or (order_doc.to_dict() or {}).get('status') == 'cancelled':
+        return None
+
+    return order_id
+
+
+def add_markers_to_batch(batch, db, business_id: str, user_id: str, keys: List[str], order_id: str):
+    """
+    Add the order's idempotency markers to the batch creating the order
+
+    The key marker uses create(), so the batch fails with AlreadyExists if
+    another attempt has already claimed this cart in this window.
+    """
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=2 * ORDER_IDEMPOTENCY_WINDOW_SECONDS)
+    marker = {
+        'business_id': business_id,
+        'user_id': user_id,
+        'order_id': order_id,
+        'created_at': now,
+        'expires_at': expires_at
+    }
+
+    batch.create(db.collection(MARKERS_COLLECTION).document(keys[0]), marker)
+    batch.set(db.collection(MARKERS_COLLECTION).document(latest_order_marker_id(business_id, user_id)), marker)
+
+
+def clear_markers(db, keys: List[str]):
+    """Forget keys whose order was cancelled so the same cart can be ordered again"""
+    with _recent_keys_lock:
+        for key in keys:
+            _recent_keys.pop(key, None)
+
+    batch = db.batch()
+    for key in keys:
+        batch.delete(db.collection(MARKERS_COLLECTION).document(key))
+    batch.commit()
@@ -0,0 +1,408 @@
+"""
+Inventory reservation engine
+Reserves and releases stock atomically so concurrent checkouts can't oversell
+
+Each inventory document tracks stock_quantity and reserved_quantity. By default
+a reservation is a transaction on that document. Hot products can switch to
+sharded counters: the free stock is split into quotas across
+inventory/{id}/reservation_shards/{n}, and each reservation only transacts on
+one shard, so write throughput grows with the number of shards.
+"""
+
+import random
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from firebase_admin import firestore
+
+from config import RESERVATION_MAX_ATTEMPTS
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+RESERVATION_SHARDS_COLLECTION = 'reservation_shards'
+
+
+def find_inventory_ref(business_context, product_identifier):
+    """Find the inventory document for a product ID or product option ID"""
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+
+    for field in ('product_id', 'product_option_id'):
+        inventory_ref = db.collection('inventory').where(
+            filter=firestore.FieldFilter(field, '==', product_identifier)
+        ).where(
+            filter=firestore.FieldFilter('business_id', '==', business_id)
+        ).limit(1)
+
+        for doc in inventory_ref.stream():
+            return doc.reference
+
+    return None
+
+
+def _reservation_result(success: bool, inventory_id: Optional[str], quantity: int,
+                        shard: Optional[int] = None, reason: str = "") -> Dict[str, Any]:
+    return {
+        "success": success,
+        "inventory_id": inventory_id,
+        "quantity": quantity,
+        "shard": shard,
+        "reason": reason
+    }
+
+
+def reserve_stock(business_context, product_identifier, quantity) -> Dict[str, Any]:
+    """
+    Reserve stock for a product if enough is available
+
+    Returns:
+        Dict with success, inventory_id, quantity, shard (for sharded counters)
+        and reason when the reservation failed
+    """
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+
+    if not db or not business_id:
+        return _reservation_result(False, None, quantity, reason="missing_context")
+
+    if quantity <= 0:
+        return _reservation_result(False, None, quantity, reason="invalid_quantity")
+
+    try:
+        inventory_ref = find_inventory_ref(business_context, product_identifier)
+        if not inventory_ref:
+            return _reservation_result(False, None, quantity, reason="not_found")
+
+        inventory_doc = inventory_ref.get(field_paths=['reservation_shards'])
+        shard_count = (inventory_doc.to_dict() or {}).get('reservation_shards', 0) if inventory_doc.exists else 0
+
+        if shard_count:
+            result = _reserve_from_shards(db, inventory_ref, shard_count, quantity)
+        else:
+            result = _reserve_from_document(db, inventory_ref, quantity)
+
+        if result["success"]:
+            logger.info(f"Reserved {quantity} units of product {product_identifier} for business {business_id}")
+        else:
+            logger.warning(f"Could not reserve {quantity} units of product {product_identifier} for business {business_id}: {result['reason']}")
+
+        return result
+
+    except Exception as e:
+        logger.error(f"Error reserving inventory for business {business_id}: {str(e)}")
+        return _reservation_result(False, None, quantity, reason="error")
+
+
+def _reserve_from_document(db, inventory_ref, quantity) -> Dict[str, Any]:
+    """Reserve against the inventory document itself in a transaction"""
+
+    @firestore.transactional
+    def reserve(transaction):
+        snapshot = inventory_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return _reservation_result(False, inventory_ref.id, quantity, reason="not_found")
+
+        data = snapshot.to_dict()
+        reserved = data.get('reserved_quantity', 0)
+        available = data.get('stock_quantity', 0) - reserved
+
+        if available < quantity:
+            return _reservation_result(False, inventory_ref.id, quantity, reason="insufficient_stock")
+
+        transaction.update(inventory_ref, {
+            'reserved_quantity': reserved + quantity,
+            'last_updated': datetime.now()
+        })
+        return _reservation_result(True, inventory_ref.id, quantity)
+
+    return reserve(db.transaction(max_attempts=RESERVATION_MAX_ATTEMPTS))
+
+
+def _reserve_from_shards(db, inventory_ref, shard_count, quantity) -> Dict[str, Any]:
+    """Reserve against one shard's quota, trying the shards in random order"""
+    shard_ids = list(range(shard_count))
+    random.shuffle(shard_ids)
+
+    for shard_id in shard_ids:
+        shard_ref = inventory_ref.collection(RESERVATION_SHARDS_COLLECTION).document(str(shard_id))
+
+        @firestore.transactional
+        def reserve(transaction):
+            snapshot = shard_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return False
+
+            data = snapshot.to_dict()
+            reserved = data.get('reserved_quantity', 0)
+            if data.get('capacity', 0) - reserved < quantity:
+                return False
+
+            transaction.update(shard_ref, {
+                'reserved_quantity': reserved + quantity,
+                'last_updated': datetime.now()
+            })
+            return True
+
+        if reserve(db.transaction(max_attempts=RESERVATION_MAX_ATTEMPTS)):
+            return _reservation_result(True, inventory_ref.id, quantity, shard=shard_id)
+
+    # Free stock may be split too thinly across shards for this quantity
+    return _reservation_result(False, inventory_ref.id, quantity, reason="insufficient_stock")
+
+
+def release_stock(business_context, product_identifier, quantity, shard=None) -> bool:
+    """Release reserved stock for a product, never going below zero"""
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+
+    if not db or not business_id:
+        return False
+
+    try:
+        inventory_ref = find_inventory_ref(business_context, product_identifier)
+        if not inventory_ref:
+            return False
+
+        inventory_doc = inventory_ref.get(field_paths=['reservation_shards'])
+        shard_count = (inventory_doc.to_dict() or {}).get('reservation_shards', 0) if inventory_doc.exists else 0
+
+        if shard_count:
+            _release_from_shards(db, inventory_ref, shard_count, quantity, shard)
+        else:
+            _release_from_document(db, inventory_ref, quantity)
+
+        logger.info(f"Released {quantity} units of product {product_identifier} for business {business_id}")
+        return True
+
+    except Exception as e:
+        logger.error(f"Error releasing inventory for business {business_id}: {str(e)}")
+        return False
+
+
+def _release_from_document(db, inventory_ref, quantity):
+    @firestore.transactional
+    def release(transaction):
+        snapshot = inventory_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return
+        reserved = snapshot.to_dict().get('reserved_quantity', 0)
+        transaction.update(inventory_ref, {
+            'reserved_quantity': max(0, reserved - quantity),
+            'last_updated': datetime.now()
+        })
+
+    release(db.transaction(max_attempts=RESERVATION_MAX_ATTEMPTS))
+
+
+def _release_from_shards(db, inventory_ref, shard_count, quantity, shard=None):
+    shards_ref = inventory_ref.collection(RESERVATION_SHARDS_COLLECTION)
+
+    if shard is not None:
+        # The caller knows which shard holds the reservation: a blind decrement is enough
+        shards_ref.document(str(shard)).update({
+            'reserved_quantity': firestore.Increment(-quantity),
+            'last_updated': datetime.now()
+        })
+        return
+
+    shard_refs = [shards_ref.document(str(shard_id)) for shard_id in range(shard_count)]
+
+    @firestore.transactional
+    def release(transaction):
+        remaining = quantity
+        for snapshot in list(transaction.get_all(shard_refs)):
+            if remaining <= 0:
+                break
+            if not snapshot.exists:
+                continue
+            reserved = snapshot.to_dict().get('reserved_quantity', 0)
+            released = min(reserved, remaining)
+            if released:
+                transaction.update(snapshot.reference, {
+                    'reserved_quantity': reserved - released,
+                    'last_updated': datetime.now()
+                })
+                remaining -= released
+
+    release(db.transaction(max_attempts=RESERVATION_MAX_ATTEMPTS))
+
+
+def consume_stock(business_context, product_identifier, quantity, shard=None) -> bool:
+    """
+    Turn a reservation into a sale: take quantity off both stock_quantity and the reservation
+
+    Free stock stays the same, so shard quotas need no rebalancing; a
+    sharded reservation's shard gives up the same amount of capacity.
+    """
+    from services.inventory import get_stock_status
+
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+
+    if not db or not business_id:
+        return False
+
+    try:
+        inventory_ref = find_inventory_ref(business_context, product_identifier)
+        if not inventory_ref:
+            return False
+
+        inventory_doc = inventory_ref.get(field_paths=['reservation_shards'])
+        shard_count = (inventory_doc.to_dict() or {}).get('reservation_shards', 0) if inventory_doc.exists else 0
+        shard_refs = [] if not shard_count else [
+            inventory_ref.collection(RESERVATION_SHARDS_COLLECTION).document(str(shard_id))
+            for shard_id in ([shard] if shard is not None else range(shard_count))
+        ]
+
+        @firestore.transactional
+        def consume(transaction):
+            snapshot = inventory_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return
+            shard_snapshots = [shard_snapshot for shard_snapshot in transaction.get_all(shard_refs) if shard_snapshot.exists] if shard_refs else []
+
+            data = snapshot.to_dict()
+            stock = max(0, data.get('stock_quantity', 0) - quantity)
+            inventory_update = {
+                'stock_quantity': stock,
+                'stock_status': get_stock_status(stock),
+                'last_updated': datetime.now()
+            }
+
+            remaining = quantity
+            for shard_snapshot in shard_snapshots:
+                shard_data = shard_snapshot.to_dict() or {}
+                consumed = min(shard_data.get('reserved_quantity', 0), remaining)
+                if consumed:
+                    transaction.update(shard_snapshot.reference, {
+                        'reserved_quantity': shard_data.get('reserved_quantity', 0) - consumed,
+                        'capacity': max(0, shard_data.get('capacity', 0) - consumed),
+                        'last_updated': datetime.now()
+                    })
+                    remaining -= consumed
+
+            # Unsharded reservations (and those made before sharding) sit on the document
+            if remaining:
+                inventory_update['reserved_quantity'] = max(0, data.get('reserved_quantity', 0) - remaining)
+            transaction.update(inventory_ref, inventory_update)
+
+        consume(db.transaction(max_attempts=RESERVATION_MAX_ATTEMPTS))
+        logger.info(f"Consumed {quantity} reserved units of product {product_identifier} for business {business_id}")
+        return True
+
+    except Exception as e:
+        logger.error(f"Error consuming reserved inventory for business {business_id}: {str(e)}")
+        return False
+
+
+def get_reserved_quantity(business_context, product_identifier) -> int:
+    """Get the total reserved quantity of a product, summing shards if sharded"""
+    try:
+        inventory_ref = find_inventory_ref(business_context, product_identifier)
+        if not inventory_ref:
+            return 0
+
+        data = inventory_ref.get().to_dict() or {}
+        if not data.get('reservation_shards'):
+            return data.get('reserved_quantity', 0)
+
+        shards = inventory_ref.collection(RESERVATION_SHARDS_COLLECTION).stream()
+        return data.get('reserved_quantity', 0) + sum((shard.to_dict() or {}).get('reserved_quantity', 0) for shard in shards)
+
+    except Exception as e:
+        logger.error(f"Error getting reserved quantity for product {product_identifier} in business {business_context.get('business_id')}: {str(e)}")
+        return 0
+
+
+def enable_sharded_reservations(business_context, product_identifier, shard_count) -> bool:
+    """
+    Split a hot product's reservations across shard_count counter documents
+
+    Reservations already held on the inventory document stay there; the
+    remaining free stock is divided between the shards as quotas.
+    """
+    db = business_context.get('db')
+
+    if shard_count < 1:
+        return False
+
+    try:
+        inventory_ref = find_inventory_ref(business_context, product_identifier)
+        if not inventory_ref:
+            return False
+
+        shards_ref = inventory_ref.collection(RESERVATION_SHARDS_COLLECTION)
+        shard_refs = [shards_ref.document(str(shard_id)) for shard_id in range(shard_count)]
+
+        @firestore.transactional
+        def enable(transaction):
+            snapshot = inventory_ref.get(transaction=transaction)
+            data = snapshot.to_dict() or {}
+            if data.get('reservation_shards'):
+                return False
+
+            free = max(0, data.get('stock_quantity', 0) - data.get('reserved_quantity', 0))
+            for shard_id, shard_ref in enumerate(shard_refs):
+                transaction.set(shard_ref, {
+                    'capacity': _shard_quota(free, shard_count, shard_id),
+                    'reserved_quantity': 0,
+                    'last_updated': datetime.now()
+                })
+            transaction.update(inventory_ref, {'reservation_shards': shard_count})
+            return True
+
+        enabled = enable(db.transaction(max_attempts=RESERVATION_MAX_ATTEMPTS))
+        if enabled:
+            logger.info(f"Enabled {shard_count} reservation shards for product {product_identifier} in business {business_context.get('business_id')}")
+        return enabled
+
+    except Exception as e:
+        logger.error(f"Error enabling sharded reservations for product {product_identifier}: {str(e)}")
+        return False
+
+
+def rebalance_reservation_shards(business_context, product_identifier) -> bool:
+    """Redistribute free stock across shards, e.g. after a stock change or when quotas are uneven"""
+    db = business_context.get('db')
+
+    try:
+        inventory_ref = find_inventory_ref(business_context, product_identifier)
+        if not inventory_ref:
+            return False
+
+        shard_count = (inventory_ref.get().to_dict() or {}).get('reservation_shards', 0)
+        if not shard_count:
+            return False
+
+        shards_ref = inventory_ref.collection(RESERVATION_SHARDS_COLLECTION)
+        shard_refs = [shards_ref.document(str(shard_id)) for shard_id in range(shard_count)]
+
+        @firestore.transactional
+        def rebalance(transaction):
+            data = inventory_ref.get(transaction=transaction).to_dict() or {}
+            reserved_by_shard = {
+                snapshot.id: (snapshot.to_dict() or {}).get('reserved_quantity', 0)
+                for snapshot in transaction.get_all(shard_refs) if snapshot.exists
+            }
+            shard_reserved = [reserved_by_shard.get(str(shard_id), 0) for shard_id in range(shard_count)]
+
+            free = max(0, data.get('stock_quantity', 0) - data.get('reserved_quantity', 0) - sum(shard_reserved))
+            for shard_id, shard_ref in enumerate(shard_refs):
+                transaction.set(shard_ref, {
+                    'capacity': shard_reserved[shard_id] + _shard_quota(free, shard_count, shard_id),
+                    'reserved_quantity': shard_reserved[shard_id],
+                    'last_updated': datetime.now()
+                })
+
+        rebalance(db.transaction(max_attempts=RESERVATION_MAX_ATTEMPTS))
+        return True
+
+    except Exception as e:
+        logger.error(f"Error rebalancing reservation shards for product {product_identifier}: {str(e)}")
+        return False
+
+
+def _shard_quota(free, shard_count, shard_id):
+    """Split free stock evenly, giving the remainder to the first shards"""
+    return free // shard_count + (1 if shard_id < free % shard_count else 0)
@@ -0,0 +1,355 @@
+"""
+Customer segmentation
+Recency, frequency and monetary (RFM) scoring of customers as a batch job
+
+Orders of a business are streamed (only the fields the job needs) into
+compact column arrays and aggregated per customer with NumPy. Each
+customer gets 1-5 scores for recency, frequency and monetary value from
+quantiles over the business's customers, and a segment label. Results are
+written to customers/{id}.rfm in batches; customers left without active
+orders have their rfm and segment removed.
+
+Incremental runs only stream orders created since the previous run and
+merge them into the aggregates stored on each customer. Each customer's
+rfm records the order watermark its aggregates cover (through_order_at),
+and orders up to it are skipped, so rerunning after a run that failed
+part way through never counts an order twice. Incremental runs don't see
+orders cancelled after they were counted, so run a full recomputation
+periodically (e.g. weekly).
+
+Usage:
+    python -m services.segmentation --business-id BUSINESS_ID
+    python -m services.segmentation --business-id BUSINESS_ID --incremental
+"""
+
+import argparse
+import json
+import time
+from array import array
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from firebase_admin import firestore
+
+from config import SEGMENTATION_QUANTILES
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+RUNS_COLLECTION = 'segmentation_runs'
+
+# Firestore batches accept at most 500 writes
+BATCH_WRITE_LIMIT = 500
+
+ORDER_FIELDS = ['customer.id', 'customer.whatsapp_number', 'total', 'created_at', 'status']
+EXCLUDED_STATUSES = ('cancelled',)
+
+SEGMENT_LABELS = ('champions', 'loyal', 'new', 'at_risk', 'hibernating', 'potential')
+
+
+def _timestamp(value) -> Optional[float]:
+    if hasattr(value, 'timestamp'):
+        return value.timestamp()
+    return None
+
+
+class OrderColumns:
+    """Order data as typed columns, far smaller than a list of dicts for a million orders"""
+
+    def __init__(self):
+        self.customer_codes = array('q')
+        self.amounts = array('d')
+        self.timestamps = array('d')
+
+    def append(self, customer_code: int, amount: float, timestamp: float):
+        self.customer_codes.append(customer_code)
+        self.amounts.append(amount)
+        self.timestamps.append(timestamp)
+
+    def __len__(self):
+        return len(self.customer_codes)
+
+    def as_arrays(self):
+        return (
+            np.frombuffer(self.customer_codes, dtype=np.int64),
+            np.frombuffer(self.amounts, dtype=np.float64),
+            np.frombuffer(self.timestamps, dtype=np.float64)
+        )
+
+
+def aggregate_orders(customer_codes, amounts, timestamps, customer_count: int, prior: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Per-customer order count, total spend and last order time
+
+    prior holds aggregates from a previous run (same customer codes) to
+    merge new orders into.
+    """
+    frequency = np.bincount(customer_codes, minlength=customer_count).astype(np.int64)
+    monetary = np.bincount(customer_codes, weights=amounts, minlength=customer_count)
+    last_order = np.full(customer_count, -np.inf)
+    np.maximum.at(last_order, customer_codes, timestamps)
+
+    if prior is not None:
+        frequency += prior['frequency']
+        monetary += prior['monetary']
+        last_order = np.maximum(last_order, prior['last_order'])
+
+    return {'frequency': frequency, 'monetary': monetary, 'last_order': last_order}
+
+
+def _quantile_scores(values, quantiles: int, higher_is_better: bool = True):
+    """1..quantiles score of each value by its position among the quantile edges; ties take the lower score"""
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int8)
+
+    edges = np.quantile(values, np.linspace(0, 1, quantiles + 1)[1:-1])
+    scores = np.searchsorted(edges, values, side='left') + 1
+    if not higher_is_better:
+        scores = quantiles + 1 - scores
+    return scores.astype(np.int8)
+
+
+def score_customers(aggregates: Dict[str, Any], now: float, quantiles: int = SEGMENTATION_QUANTILES) -> Dict[str, Any]:
+    """Recency, frequency and monetary scores and segment labels for customers with orders"""
+    active = aggregates['frequency'] > 0
+    recency_days = np.where(active, np.maximum(now - aggregates['last_order'], 0) / 86400.0, np.inf)
+
+    r_score = np.zeros(len(active), dtype=np.int8)
+    f_score = np.zeros(len(active), dtype=np.int8)
+    m_score = np.zeros(len(active), dtype=np.int8)
+    r_score[active] = _quantile_scores(recency_days[active], quantiles, higher_is_better=False)
+    f_score[active] = _quantile_scores(aggregates['frequency'][active], quantiles)
+    m_score[active] = _quantile_scores(aggregates['monetary'][active], quantiles)
+
+    high = quantiles - 1
+    low = 2
+    segment_codes = np.select(
+        [
+            (r_score >= high) & (f_score >= high),
+            f_score >= high,
+            (r_score >= high) & (aggregates['frequency'] == 1),
+            (r_score <= low) & (f_score >= 3),
+            (r_score <= low) & (f_score <= low)
+        ],
+        [0, 1, 2, 3, 4],
+        default=5
+    )
+
+    return {
+        'active': active,
+        'recency_days': recency_days,
+        'r_score': r_score,
+        'f_score': f_score,
+        'm_score': m_score,
+        'segment_codes': segment_codes
+    }
+
+
+def _load_customers(db, business_id: str):
+    """Customer IDs, a WhatsApp number index and any stored aggregates, in code order"""
+    customer_ids: List[str] = []
+    codes_by_id: Dict[str, int] = {}
+    codes_by_number: Dict[str, int] = {}
+    stored_rfm: List[Dict[str, Any]] = []
+
+    customers = db.collection('customers').where(
+        filter=firestore.FieldFilter('business_id', '==', business_id)
+    ).select(['whatsapp_number', 'rfm']).stream()
+
+    for customer_doc in customers:
+        data = customer_doc.to_dict() or {}
+        code = len(customer_ids)
+        customer_ids.append(customer_doc.id)
+        codes_by_id[customer_doc.id] = code
+        if data.get('whatsapp_number'):
+            codes_by_number[data['whatsapp_number']] = code
+        stored_rfm.append(data.get('rfm') or {})
+
+    return customer_ids, codes_by_id, codes_by_number, stored_rfm
+
+
+def stream_order_columns(db, business_id: str, codes_by_id: Dict[str, int], codes_by_number: Dict[str, int],
+                         since: Optional[datetime] = None, watermarks: Optional[List[Any]] = None):
+    """
+    Stream a business's orders into columns; returns (columns, latest created_at, skipped orders)
+
+    watermarks holds, per customer code, the created_at up to which the
+    customer's stored aggregates already count orders; those are left out.
+    """
+    columns = OrderColumns()
+    latest = since
+    skipped = 0
+
+    query = db.collection('orders').where(filter=firestore.FieldFilter('business_id', '==', business_id))
+    if since:
+        query = query.where(filter=firestore.FieldFilter('created_at', '>', since))
+
+    for order_doc in query.select(ORDER_FIELDS).stream():
+        order = order_doc.to_dict() or {}
+        created_at = order.get('created_at')
+        timestamp = _timestamp(created_at)
+        if timestamp is None:
+            skipped += 1
+            continue
+
+        if latest is None or created_at > latest:
+            latest = created_at
+
+        if order.get('status') in EXCLUDED_STATUSES:
+            continue
+
+        customer = order.get('customer') or {}
+        code = codes_by_id.get(customer.get('id'))
+        if code is None:
+            code = codes_by_number.get(customer.get('whatsapp_number'))
+        if code is None:
+            skipped += 1
+            continue
+
+        if watermarks and watermarks[code] is not None and created_at <= watermarks[code]:
+            continue
+
+        columns.append(code, float(order.get('total') or 0), timestamp)
+
+    return columns, latest, skipped
+
+
+def _prior_aggregates(stored_rfm: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        'frequency': np.array([rfm.get('frequency', 0) for rfm in stored_rfm], dtype=np.int64),
+        'monetary': np.array([rfm.get('monetary', 0.0) for rfm in stored_rfm], dtype=np.float64),
+        'last_order': np.array([_timestamp(rfm.get('last_order_at')) or -np.inf for rfm in stored_rfm], dtype=np.float64)
+    }
+
+
+def _write_segments(db, customer_ids: List[str], aggregates: Dict[str, Any], scores: Dict[str, Any],
+                    stored_rfm: List[Dict[str, Any]], computed_at: datetime, through_order_at) -> int:
+    """Write rfm fields to customers whose values changed and clear them where stale, in batches; returns customers written"""
+    written = 0
+    batch = db.batch()
+    pending = 0
+
+    def add(code, fields):
+        nonlocal batch, pending, written
+        batch.update(db.collection('customers').document(customer_ids[code]), fields)
+        pending += 1
+        written += 1
+
+        if pending >= BATCH_WRITE_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    # Customers segmented before whose orders are all gone or cancelled
+    for code in np.flatnonzero(~scores['active']):
+        if stored_rfm[code]:
+            add(code, {'rfm': firestore.DELETE_FIELD, 'segment': firestore.DELETE_FIELD})
+
+    for code in np.flatnonzero(scores['active']):
+        rfm = {
+            'recency_days': round(float(scores['recency_days'][code]), 1),
+            'frequency': int(aggregates['frequency'][code]),
+            'monetary': round(float(aggregates['monetary'][code]), 2),
+            'last_order_at': datetime.fromtimestamp(float(aggregates['last_order'][code])),
+            'r_score': int(scores['r_score'][code]),
+            'f_score': int(scores['f_score'][code]),
+            'm_score': int(scores['m_score'][code]),
+            'segment': SEGMENT_LABELS[int(scores['segment_codes'][code])]
+        }
+
+        previous = stored_rfm[code]
+        unchanged = all(previous.get(field) == rfm[field] for field in ('frequency', 'monetary', 'r_score', 'f_score', 'm_score', 'segment'))
+        if unchanged:
+            continue
+
+        rfm['computed_at'] = computed_at
+        rfm['through_order_at'] = through_order_at
+        add(code, {'rfm': rfm, 'segment': rfm['segment']})
+
+    if pending:
+        batch.commit()
+
+    return written
+
+
+def run_segmentation(db, business_id: str, incremental: bool = False, dry_run: bool = False) -> Dict[str, Any]:
+    """Compute RFM segments for a business and write them to its customers"""
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError("numpy is required for customer segmentation")
+
+    started_at = time.perf_counter()
+    computed_at = datetime.now()
+    run_ref = db.collection(RUNS_COLLECTION).document(business_id)
+
+    since = None
+    if incremental:
+        run_doc = run_ref.get()
+        since = run_doc.to_dict().get('last_order_created_at') if run_doc.exists else None
+
+    customer_ids, codes_by_id, codes_by_number, stored_rfm = _load_customers(db, business_id)
+    watermarks = [rfm.get('through_order_at') for rfm in stored_rfm] if since else None
+    columns, latest_order_at, skipped = stream_order_columns(db, business_id, codes_by_id, codes_by_number, since, watermarks)
+    streamed_at = time.perf_counter()
+
+    customer_codes, amounts, timestamps = columns.as_arrays()
+    prior = _prior_aggregates(stored_rfm) if since else None
+    aggregates = aggregate_orders(customer_codes, amounts, timestamps, len(customer_ids), prior)
+    scores = score_customers(aggregates, computed_at.timestamp())
+    computed = time.perf_counter()
+
+    written = 0
+    if not dry_run:
+        from models.customer import customer_profile_cache
+
+        written = _write_segments(db, customer_ids, aggregates, scores, stored_rfm, computed_at, latest_order_at)
+        # Cached profiles would keep serving the old segments
+        customer_profile_cache.evict_business(business_id)
+        run_ref.set({
+            'business_id': business_id,
+            'last_order_created_at': latest_order_at,
+            'last_run_at': computed_at,
+            'incremental': bool(since)
+        }, merge=True)
+
+    segment_counts = np.bincount(scores['segment_codes'][scores['active']], minlength=len(SEGMENT_LABELS))
+    stats = {
+        "business_id": business_id,
+        "incremental": bool(since),
+        "orders": len(columns),
+        "skipped_orders": skipped,
+        "customers": len(customer_ids),
+        "customers_with_orders": int(scores['active'].sum()),
+        "customers_written": written,
+        "segments": {label: int(count) for label, count in zip(SEGMENT_LABELS, segment_counts)},
+        "stream_seconds": round(streamed_at - started_at, 2),
+        "compute_seconds": round(computed - streamed_at, 3),
+        "total_seconds": round(time.perf_counter() - started_at, 2)
+    }
+    logger.info(f"Segmented {stats['customers_with_orders']} customers of business {business_id} from {stats['orders']} orders "
+                f"in {stats['total_seconds']}s ({written} updated)")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute RFM customer segments for a business")
+    parser.add_argument("--business-id", required=True, help="Business to segment")
+    parser.add_argument("--incremental", action="store_true", help="Only merge orders created since the last run")
+    parser.add_argument("--dry-run", action="store_true", help="Compute segments without writing them")
+    args = parser.parse_args()
+
+    from config import db
+    if not db:
+        raise SystemExit("Firebase is not initialized")
+
+    print(json.dumps(run_segmentation(db, args.business_id, args.incremental, args.dry_run), indent=2))
+
+
+if __name__ == "__main__":
+    main()
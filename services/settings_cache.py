@@ -0,0 +1,265 @@
+"""
+Business settings cache
+Per-business settings, business and contact details with the support texts rendered ahead of time
+
+Entries are primed when a business config is loaded (from the settings and
+business documents that load already read, with business_contacts fetched
+in the background). They are rebuilt when a business_settings snapshot
+arrives. The FAQ, shipping and contact message bodies and the mobile money
+networks are rendered once per entry, so support taps send them without
+any Firestore reads.
+
+Entries older than BUSINESS_CONFIG_CACHE_DURATION_MINUTES keep being served
+while a background refresh reloads them.
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from config import BUSINESS_CONFIG_CACHE_DURATION_MINUTES
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_FAQ_TEXT = (
+    "*Frequently Asked Questions*\n\n"
+    "*How long does shipping take?*\n"
+    "Standard shipping takes 3-5 business days. Express shipping takes 1-2 business days.\n\n"
+
+    "*Do you ship internationally?*\n"
+    "Yes, we ship to most countries worldwide. International shipping typically takes 7-14 business days.\n\n"
+
+    "*How can I track my order?*\n"
+    "You'll receive a tracking number via WhatsApp once your order ships. You can also check your order status by sending 'order status'.\n\n"
+
+    "*What payment methods do you accept?*\n"
+    "We accept mobile money (MTN, Vodafone, AirtelTigo) and cash on delivery.\n\n"
+
+    "*How do I return an item?*\n"
+    "Contact our support team within 30 days of receiving your order. We'll guide you through the return process."
+)
+
+DEFAULT_SHIPPING_TEXT = (
+    "*Shipping Information*\n\n"
+    "*Standard Delivery (Free)*\n"
+    "• Delivery in 3-5 business days\n"
+    "• Available for all domestic orders\n"
+    "• Free for orders over GHS50\n\n"
+
+    "*Express Delivery (GHS9.99)*\n"
+    "• Delivery in 1-2 business days\n"
+    "• Available for orders placed before 2PM\n"
+    "• Includes weekend delivery\n\n"
+
+    "*International Shipping*\n"
+    "• Delivery in 7-14 business days\n"
+    "• Shipping costs vary by destination\n"
+    "• Customs fees may apply\n\n"
+
+    "*Store Pickup (Free)*\n"
+    "• Available for collection same day if ordered before 3PM\n"
+    "• Please bring ID and order number"
+)
+
+DEFAULT_CONTACT_TEXT = (
+    "*Contact Our Support Team*\n\n"
+    "Our customer service team is here to help!\n\n"
+
+    "*Support Hours:*\n"
+    "Monday-Friday: 9AM-6PM\n"
+    "Saturday: 10AM-4PM\n"
+    "Sunday: Closed\n\n"
+
+    "*Contact Options:*\n"
+    "• Email: support@example.com\n"
+    "• Phone: 1-800-123-4567\n"
+    "• Live Chat: www.example.com/support\n\n"
+
+    "You can also continue this conversation for support. How can we help you today?"
+)
+
+DEFAULT_MOBILE_MONEY_NETWORKS = ["MTN", "Vodafone", "AirtelTigo"]
+
+
+def render_faq_text(settings: Dict[str, Any]) -> str:
+    return (settings.get('support') or {}).get('faq_content') or DEFAULT_FAQ_TEXT
+
+
+def render_shipping_text(settings: Dict[str, Any]) -> str:
+    """Shipping text from configured shipping methods (dicts with name, cost and delivery_time)"""
+    shipping_methods = (settings.get('checkout') or {}).get('shipping_methods') or []
+    # Default settings list method names only; those keep the default text
+    shipping_methods = [method for method in shipping_methods if isinstance(method, dict)]
+    if not shipping_methods:
+        return DEFAULT_SHIPPING_TEXT
+
+    shipping_text = "*Shipping Information*\n\n"
+    for method in shipping_methods:
+        method_name = method.get('name', 'Standard')
+        method_cost = method.get('cost', 'Free')
+        method_time = method.get('delivery_time', '3-5 business days')
+        shipping_text += f"*{method_name}* ({method_cost})\n"
+        shipping_text += f"• Delivery in {method_time}\n\n"
+    return shipping_text
+
+
+def render_contact_text(business_data: Optional[Dict[str, Any]], contacts: Optional[Dict[str, Any]]) -> str:
+    """Contact text from the business and business_contacts documents"""
+    if not business_data or not contacts:
+        return DEFAULT_CONTACT_TEXT
+
+    business_name = business_data.get('name', 'Our Team')
+    email = contacts.get('email', 'support@example.com')
+    phone = contacts.get('phone', '1-800-123-4567')
+    whatsapp = contacts.get('whatsapp', '')
+
+    contact_text = (
+        f"*Contact {business_name} Support*\n\n"
+        "Our customer service team is here to help!\n\n"
+
+        "*Contact Options:*\n"
+        f"• Email: {email}\n"
+        f"• Phone: {phone}\n"
+    )
+
+    if whatsapp:
+        contact_text += f"• WhatsApp: {whatsapp}\n"
+
+    contact_text += "\nYou can also continue this conversation for support. How can we help you today?"
+    return contact_text
+
+
+def mobile_money_networks(settings: Dict[str, Any]) -> List[str]:
+    payment_methods = (settings.get('checkout') or {}).get('payment_methods')
+    if isinstance(payment_methods, dict) and payment_methods.get('mobile_money_networks'):
+        return list(payment_methods['mobile_money_networks'])
+    return list(DEFAULT_MOBILE_MONEY_NETWORKS)
+
+
+def build_settings_entry(business_id: str, settings: Optional[Dict[str, Any]], business_data: Optional[Dict[str, Any]],
+                         contacts: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Cache entry with the source documents and the texts rendered from them"""
+    settings = settings or {}
+    return {
+        'business_id': business_id,
+        'settings': settings,
+        'business': business_data,
+        'contacts': contacts,
+        'faq_text': render_faq_text(settings),
+        'shipping_text': render_shipping_text(settings),
+        'contact_text': render_contact_text(business_data, contacts),
+        'mobile_money_networks': mobile_money_networks(settings),
+        'loaded_at': time.monotonic()
+    }
+
+
+# Entry per business
+business_settings_cache: Dict[str, Dict[str, Any]] = {}
+_refreshing = set()
+_cache_lock = threading.Lock()
+
+DEFAULT_ENTRY = build_settings_entry(None, {}, None, None)
+
+
+def _read_document(db, collection: str, business_id: str) -> Optional[Dict[str, Any]]:
+    doc = db.collection(collection).document(business_id).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def load_settings_entry(db, business_id: str) -> Dict[str, Any]:
+    """Read the settings, business and contacts documents in parallel and build an entry"""
+    from utils.background import map_concurrently
+
+    settings, business_data, contacts = map_concurrently(
+        lambda collection: _read_document(db, collection, business_id),
+        ['business_settings', 'businesses', 'business_contacts']
+    )
+    entry = build_settings_entry(business_id, settings, business_data, contacts)
+    business_settings_cache[business_id] = entry
+    return entry
+
+
+def _load_contacts(db, business_id: str):
+    """Fill in the contacts of an entry primed without them"""
+    contacts = _read_document(db, 'business_contacts', business_id)
+    entry = business_settings_cache.get(business_id)
+    if entry:
+        business_settings_cache[business_id] = dict(
+            entry, contacts=contacts, contact_text=render_contact_text(entry['business'], contacts)
+        )
+
+
+def _refresh_in_background(db, business_id: str, loader=load_settings_entry):
+    from utils.background import run_in_background
+
+    with _cache_lock:
+        if business_id in _refreshing:
+            return
+        _refreshing.add(business_id)
+
+    def refresh():
+        try:
+            loader(db, business_id)
+        finally:
+            with _cache_lock:
+                _refreshing.discard(business_id)
+
+    run_in_background(refresh)
+
+
+def prime_settings_cache(db, business_id: str, business_data: Optional[Dict[str, Any]], settings: Optional[Dict[str, Any]]):
+    """Cache the settings and business a config load just read; contacts follow in the background"""
+    previous = business_settings_cache.get(business_id) or {}
+    business_settings_cache[business_id] = build_settings_entry(business_id, settings, business_data, previous.get('contacts'))
+    if db and not previous.get('contacts'):
+        _refresh_in_background(db, business_id, _load_contacts)
+
+
+def get_settings_entry(business_context) -> Dict[str, Any]:
+    """
+    A business's cached settings entry
+
+    Stale entries are returned as they are while a refresh runs in the
+    background; only a business with no entry at all is loaded inline.
+    Without a db or business, or if loading fails, the defaults are used.
+    """
+    db = business_context.get('db')
+    business_id = business_context.get('business_id')
+
+    if not business_id:
+        return DEFAULT_ENTRY
+
+    entry = business_settings_cache.get(business_id)
+    if entry:
+        if db and time.monotonic() - entry['loaded_at'] > BUSINESS_CONFIG_CACHE_DURATION_MINUTES * 60:
+            _refresh_in_background(db, business_id)
+        return entry
+
+    if not db:
+        return DEFAULT_ENTRY
+
+    try:
+        return load_settings_entry(db, business_id)
+    except Exception as e:
+        logger.warning(f"Could not load business settings for {business_id}: {str(e)}")
+        return DEFAULT_ENTRY
+
+
+def apply_settings_cache_update(business_id: str, settings: Optional[Dict[str, Any]]):
+    """Rebuild a business's entry from changed settings (None drops it)"""
+    if settings is None:
+        business_settings_cache.pop(business_id, None)
+        return
+
+    entry = business_settings_cache.get(business_id)
+    if entry:
+        business_settings_cache[business_id] = build_settings_entry(business_id, settings, entry['business'], entry['contacts'])
+
+
+def invalidate_settings_cache(business_id: Optional[str] = None):
+    """Drop one business's entry, or all of them"""
+    if business_id:
+        business_settings_cache.pop(business_id, None)
+    else:
+        business_settings_cache.clear()
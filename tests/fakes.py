@@ -0,0 +1,214 @@
+"""
+In-memory stand-ins for Firestore used by the tests
+Only the parts of the client API the code under test touches are implemented
+"""
+
+import itertools
+from types import SimpleNamespace
+from unittest import mock
+
+_auto_ids = itertools.count(1)
+
+
+class FakeDocument:
+    """Document snapshot"""
+
+    def __init__(self, doc_id, data=None, reference=None):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+        self.reference = reference
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+def change(change_type, doc_id, data=None):
+    """Listener DocumentChange"""
+    return SimpleNamespace(type=SimpleNamespace(name=change_type), document=FakeDocument(doc_id, data))
+
+
+class FakeDocumentReference:
+    def __init__(self, store, collection, doc_id):
+        self.store = store
+        self.collection_name = collection
+        self.id = doc_id
+
+    def get(self, field_paths=None, transaction=None):
+        data = self.store.get(self.collection_name, {}).get(self.id)
+        return FakeDocument(self.id, data, self)
+
+    def set(self, data, merge=False):
+        documents = self.store.setdefault(self.collection_name, {})
+        documents[self.id] = {**documents.get(self.id, {}), **data} if merge else dict(data)
+
+    def update(self, data):
+        from google.api_core.exceptions import NotFound
+
+        document = self.store.get(self.collection_name, {}).get(self.id)
+        if document is None:
+            raise NotFound(f"No document to update: {self.collection_name}/{self.id}")
+        document.update(data)
+
+    def delete(self):
+        self.store.get(self.collection_name, {}).pop(self.id, None)
+
+    def collection(self, name):
+        return FakeCollection(self.store, f"{self.collection_name}/{self.id}/{name}")
+
+
+def _matches(data, doc_id, field_filter):
+    field, op, value = field_filter.field_path, field_filter.op_string, field_filter.value
+    actual = doc_id if field == '__name__' else data.get(field)
+    if field == '__name__':
+        value = value.id
+    if op == '==':
+        return actual == value
+    if op == 'in':
+        return actual in value
+    if actual is None:
+        return False
+    return {'<': actual < value, '<=': actual <= value, '>': actual > value, '>=': actual >= value}[op]
+
+
+class FakeQuery:
+    def __init__(self, store, collection, filters=(), order=None, limit_count=None, cursor=None):
+        self.store = store
+        self.collection_name = collection
+        self.filters = tuple(filters)
+        self.order = order
+        self.limit_count = limit_count
+        self.cursor = cursor
+
+    def _copy(self, **changes):
+        fields = dict(filters=self.filters, order=self.order, limit_count=self.limit_count, cursor=self.cursor)
+        fields.update(changes)
+        return FakeQuery(self.store, self.collection_name, **fields)
+
+    def where(self, filter):
+        return self._copy(filters=self.filters + (filter,))
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(order=(field, direction))
+
+    def limit(self, count):
+        return self._copy(limit_count=count)
+
+    def select(self, field_paths):
+        return self._copy()
+
+    def start_after(self, document):
+        return self._copy(cursor=document)
+
+    def _sort_key(self, item):
+        field = self.order[0]
+        return item[0] if field == '__name__' else item[1].get(field)
+
+    def get(self):
+        items = [
+            (doc_id, data) for doc_id, data in self.store.get(self.collection_name, {}).items()
+            if all(_matches(data, doc_id, field_filter) for field_filter in self.filters)
+        ]
+        if self.order:
+            items.sort(key=self._sort_key, reverse=self.order[1] == 'DESCENDING')
+        if self.cursor is not None:
+            ids = [doc_id for doc_id, _ in items]
+            items = items[ids.index(self.cursor.id) + 1:]
+        if self.limit_count is not None:
+            items = items[:self.limit_count]
+        return [
+            FakeDocument(doc_id, data, FakeDocumentReference(self.store, self.collection_name, doc_id))
+            for doc_id, data in items
+        ]
+
+    def stream(self):
+        return iter(self.get())
+
+
+class FakeCollection(FakeQuery):
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self.store, self.collection_name, doc_id or f"auto_{next(_auto_ids)}")
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+
+class FakeWriteBatch:
+    """Write batch; writes apply on commit"""
+
+    def __init__(self):
+        self.writes = []
+        self.creates = []
+
+    def create(self, ref, data):
+        self.creates.append(ref)
+        self.set(ref, data)
+
+    def set(self, ref, data, merge=False):
+        self.writes.append(lambda: ref.set(data, merge))
+
+    def update(self, ref, data):
+        self.writes.append(lambda: ref.update(data))
+
+    def delete(self, ref):
+        self.writes.append(ref.delete)
+
+    def commit(self):
+        from google.api_core.exceptions import Conflict
+
+        # Nothing is written if any created document already exists
+        if any(ref.get().exists for ref in self.creates):
+            raise Conflict("Document already exists")
+        for write in self.writes:
+            write()
+
+
+class FakeTransaction:
+    """Transaction whose writes apply at once; use with inline_transactions()"""
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, FakeDocumentReference):
+            return iter([ref_or_query.get()])
+        return ref_or_query.stream()
+
+    def get_all(self, refs):
+        return [ref.get() for ref in refs]
+
+    def set(self, ref, data, merge=False):
+        ref.set(data, merge)
+
+    def update(self, ref, data):
+        ref.update(data)
+
+    def delete(self, ref):
+        ref.delete()
+
+
+def inline_transactions():
+    """Patch firestore.transactional so transactional functions run once, with a FakeTransaction"""
+    from firebase_admin import firestore
+    return mock.patch.object(firestore, 'transactional', lambda func: func)
+
+
+class FakeFirestore:
+    """Client holding documents as {collection: {doc_id: data}}"""
+
+    def __init__(self, documents=None):
+        self.store = {collection: dict(docs) for collection, docs in (documents or {}).items()}
+
+    def collection(self, name):
+        return FakeCollection(self.store, name)
+
+    def batch(self):
+        return FakeWriteBatch()
+
+    def get_all(self, refs):
+        return [ref.get() for ref in refs]
+
+    def transaction(self, **kwargs):
+        return FakeTransaction()
@@ -0,0 +1,55 @@
+import unittest
+from unittest import mock
+
+from handlers import checkout
+
+
+class CheckoutPrefetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.business_context = {'db': object(), 'business_id': 'test_business'}
+
+    @mock.patch.object(checkout, 'send_button_message')
+    @mock.patch.object(checkout, 'send_text_message')
+    @mock.patch.object(checkout, 'get_cart', return_value=[])
+    @mock.patch('models.session.get_user_name', autospec=True, return_value='Ama')
+    @mock.patch.object(checkout.checkout_cache, 'start_checkout_prefetch')
+    def test_checkout_starts_the_prefetch(self, start_checkout_prefetch, get_user_name, *_):
+        checkout.handle_checkout(self.business_context, '233200000000')
+
+        get_user_name.assert_called_once_with('test_business', '233200000000')
+        start_checkout_prefetch.assert_called_once_with(self.business_context, '233200000000', 'Ama')
+
+
+@mock.patch.object(checkout, 'complete_order', return_value=True)
+@mock.patch.object(checkout, 'save_customer_address')
+@mock.patch.object(checkout, 'set_shipping_address')
+@mock.patch.object(checkout, 'send_text_message')
+@mock.patch.object(checkout, 'apply_delivery_zone', return_value=True)
+@mock.patch.object(checkout, 'get_last_context', return_value={'order_id': 'ORD-1', 'payment_status': 'cash_on_delivery'})
+@mock.patch.object(checkout, 'get_current_action', return_value='awaiting_shipping_location')
+@mock.patch.object(checkout, 'update_session_history')
+class ResolvedLocationTest(unittest.TestCase):
+    location = {'latitude': 5.60372, 'longitude': -0.18701, 'name': 'Ama Stores', 'address': '14 Oxford Street'}
+
+    def setUp(self):
+        self.business_context = {'db': object(), 'business_id': 'test_business'}
+
+    def resolve(self, geocoded):
+        checkout.handle_resolved_location(self.business_context, '233200000000', self.location, geocoded)
+        return checkout.set_shipping_address.call_args[0][1]
+
+    def test_cached_area_is_added_below_the_customers_lines(self, *_):
+        shipping_address = self.resolve({'address': 'Osu, Accra, Ghana', 'raw': {}, 'cached': True})
+
+        self.assertEqual(shipping_address, 'Ama Stores\n14 Oxford Street\nOsu, Accra, Ghana\nCoordinates: 5.60372, -0.18701')
+        checkout.complete_order.assert_called_once_with(self.business_context, '233200000000', 'ORD-1', 'cash_on_delivery')
+
+    def test_fresh_lookup_replaces_the_location_text(self, *_):
+        shipping_address = self.resolve({'address': '12, Oxford Street, Osu, Accra, Ghana', 'raw': {}})
+
+        self.assertEqual(shipping_address, '12, Oxford Street, Osu, Accra, Ghana')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from models import customer
+from models.order import confirm_order, get_business_orders
+from services.inventory_holds import HoldsExpiredError, place_order_holds, reap_expired_holds
+from tests.fakes import FakeFirestore, inline_transactions
+from utils.ids import business_shard, is_time_sortable_order_id, new_order_id, order_id_created_at
+
+HEX_DIGITS = '0123456789ABCDEF'
+
+
+def _business_with_hex_shard():
+    """A business whose ID range can contain legacy hex IDs"""
+    return next(f"business_{i}" for i in range(1000) if business_shard(f"business_{i}") in HEX_DIGITS)
+
+
+def _legacy_id_between(low, high):
+    """A legacy ORD-xxxxxxxx ID sorting strictly between two IDs"""
+    shard = low[4]
+    for digits in (f"{a}{b}" for a in HEX_DIGITS for b in HEX_DIGITS):
+        legacy_id = f"ORD-{shard}{digits}00000"
+        if low < legacy_id < high:
+            return legacy_id
+    raise AssertionError(f"No legacy ID between {low} and {high}")
+
+
+class OrderIdTest(unittest.TestCase):
+
+    def test_ids_sort_by_creation_time_within_a_business(self):
+        started = datetime(2025, 1, 1)
+        ids = [new_order_id('business_a', started + timedelta(seconds=i)) for i in range(5)]
+
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(is_time_sortable_order_id(order_id) for order_id in ids))
+        self.assertEqual(order_id_created_at(ids[2]), started + timedelta(seconds=2))
+
+    def test_business_character_spreads_ids(self):
+        shards = {new_order_id(f"business_{i}")[4] for i in range(100)}
+
+        self.assertGreater(len(shards), 16)
+
+
+class BusinessOrderListingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.business_id = _business_with_hex_shard()
+        now = datetime.now()
+
+        self.new_ids = [new_order_id(self.business_id, now - timedelta(days=365 * 31)),
+                        new_order_id(self.business_id, now - timedelta(days=1))]
+        self.new_ids += [new_order_id(self.business_id, now - timedelta(minutes=m)) for m in (50, 40, 30, 20, 10)]
+        self.new_ids.sort()
+
+        # One legacy ID sorting above every new one, one among them and a few more, all older
+        shard = business_shard(self.business_id)
+        self.legacy_ids = ['ORD-FFFFFFFF', 'ORD-EEEEEEEE', f"ORD-{shard}0000000", _legacy_id_between(self.new_ids[0], self.new_ids[1])]
+
+        orders = {}
+        for i, order_id in enumerate(self.legacy_ids):
+            orders[order_id] = {'business_id': self.business_id, 'created_at': now - timedelta(days=365 * 40 + i)}
+        for order_id in self.new_ids:
+            orders[order_id] = {'business_id': self.business_id, 'created_at': order_id_created_at(order_id)}
+        orders[new_order_id('other_business')] = {'business_id': 'other_business', 'created_at': now}
+
+        self.business_context = {'db': FakeFirestore({'orders': orders}), 'business_id': self.business_id}
+
+    def list_all(self, page_size):
+        listed, before_order_id = [], None
+        while True:
+            page = get_business_orders(self.business_context, limit=page_size, before_order_id=before_order_id)
+            if not page:
+                return listed
+            listed += [order['order_id'] for order in page]
+            before_order_id = page[-1]['order_id']
+
+    def test_first_page_has_the_newest_orders(self):
+        page = get_business_orders(self.business_context, limit=3)
+
+        self.assertEqual([order['order_id'] for order in page], list(reversed(self.new_ids))[:3])
+
+    def test_pages_list_new_orders_then_legacy_ones(self):
+        for page_size in (1, 2, 3, 50):
+            listed = self.list_all(page_size)
+
+            self.assertEqual(listed[:len(self.new_ids)], list(reversed(self.new_ids)), page_size)
+            self.assertCountEqual(listed[len(self.new_ids):], self.legacy_ids)
+
+
+class ConfirmExpiredOrderTest(unittest.TestCase):
+    business_id = 'test_business'
+    user_id = '233200000000'
+
+    def setUp(self):
+        patcher = inline_transactions()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        items = [{'product_id': 'prod_1', 'quantity': 2}]
+        self.db = FakeFirestore({
+            'inventory': {'inv_1': {'business_id': self.business_id, 'product_id': 'prod_1', 'stock_quantity': 3, 'reserved_quantity': 0}},
+            'orders': {'ORD-1': {'business_id': self.business_id, 'status': 'pending', 'line_items': items}}
+        })
+        self.business_context = {'db': self.db, 'business_id': self.business_id}
+
+        self.assertTrue(place_order_holds(self.business_context, 'ORD-1', self.user_id, items))
+        self.assertEqual(reap_expired_holds(self.db, now=datetime.now() + timedelta(days=1)), 1)
+
+    def inventory(self):
+        return self.db.store['inventory']['inv_1']
+
+    def order(self):
+        return self.db.store['orders']['ORD-1']
+
+    def test_expired_holds_are_placed_again_on_confirmation(self):
+        self.assertEqual(self.inventory()['reserved_quantity'], 0)
+
+        order = confirm_order(self.business_context, self.user_id, 'ORD-1')
+
+        self.assertEqual(order['status'], 'confirmed')
+        self.assertEqual(self.order()['inventory_hold_status'], 'committed')
+        self.assertEqual(self.inventory()['reserved_quantity'], 2)
+        statuses = sorted(hold['status'] for hold in self.db.store['inventory_holds'].values())
+        self.assertEqual(statuses, ['committed', 'expired'])
+
+    def test_order_is_not_confirmed_when_the_stock_has_sold(self):
+        self.inventory()['reserved_quantity'] = 2
+
+        with self.assertRaises(HoldsExpiredError):
+            confirm_order(self.business_context, self.user_id, 'ORD-1')
+
+        self.assertEqual(self.order()['status'], 'pending')
+        self.assertEqual(self.inventory()['reserved_quantity'], 2)
+
+
+class CachedCustomerTest(unittest.TestCase):
+    business_id = 'test_business'
+    user_id = '233200000000'
+
+    def setUp(self):
+        self.db = FakeFirestore({'customers': {'cust_1': {
+            'business_id': self.business_id, 'whatsapp_number': self.user_id, 'name': 'Ama'
+        }}})
+        self.business_context = {'db': self.db, 'business_id': self.business_id}
+        for name, value in (('FIREBASE_AVAILABLE', True), ('db', self.db)):
+            patcher = mock.patch.object(customer, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(customer.customer_profile_cache.evict, self.business_id, self.user_id)
+
+    def test_customer_deleted_elsewhere_is_created_again(self):
+        self.assertEqual(customer.get_or_create_customer(self.business_context, self.user_id)['id'], 'cust_1')
+        del self.db.store['customers']['cust_1']
+
+        recreated = customer.get_or_create_customer(self.business_context, self.user_id, 'Ama')
+
+        self.assertIsNotNone(recreated)
+        self.assertNotEqual(recreated['id'], 'cust_1')
+        self.assertIn(recreated['id'], self.db.store['customers'])
+        self.assertEqual(customer.customer_profile_cache.get(self.business_id, self.user_id)['customer']['id'], recreated['id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
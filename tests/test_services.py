@@ -0,0 +1,356 @@
+import gzip
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from services import cache_listeners, data_deletion, geocoding, inventory, inventory_holds, order_export, order_idempotency, reservations
+from tests.fakes import FakeDocument, FakeFirestore, change, inline_transactions
+
+
+class LiveInventorySnapshotTest(unittest.TestCase):
+    business_id = 'test_business'
+
+    def setUp(self):
+        inventory.inventory_snapshots.pop(self.business_id, None)
+        cache_listeners.apply_inventory_snapshot(
+            self.business_id,
+            [
+                FakeDocument('inv_1', {'product_id': 'prod_1', 'product_option_id': 'opt_1', 'stock_quantity': 4}),
+                FakeDocument('inv_2', {'product_id': 'prod_2', 'product_option_id': 'opt_2', 'stock_quantity': 9})
+            ],
+            [],
+            initial=True,
+            sku_index={'SKU-1': 'opt_1'}
+        )
+        self.business_context = {'db': object(), 'business_id': self.business_id}
+
+    def tearDown(self):
+        inventory.inventory_snapshots.pop(self.business_id, None)
+
+    def snapshot(self):
+        return inventory.inventory_snapshots[self.business_id]
+
+    def test_initial_snapshot_is_live_and_keyed_by_sku(self):
+        self.assertTrue(self.snapshot().is_fresh())
+        self.assertEqual(self.snapshot().get('SKU-1')['stock_quantity'], 4)
+        self.assertEqual(inventory.get_product_option_id_by_sku(self.business_context, 'SKU-1'), 'opt_1')
+
+    def test_added_option_sku_is_indexed(self):
+        cache_listeners.apply_product_options_snapshot(
+            self.business_id, [], [change('ADDED', 'opt_2', {'sku': 'SKU-2'})], initial=False
+        )
+
+        self.assertEqual(inventory.get_product_option_id_by_sku(self.business_context, 'SKU-2'), 'opt_2')
+        self.assertEqual(self.snapshot().get('SKU-2')['stock_quantity'], 9)
+
+    def test_renamed_sku_replaces_the_old_one(self):
+        cache_listeners.apply_product_options_snapshot(
+            self.business_id, [], [change('MODIFIED', 'opt_1', {'sku': 'SKU-1B'})], initial=False
+        )
+
+        self.assertIsNone(self.snapshot().get('SKU-1'))
+        self.assertEqual(self.snapshot().get('SKU-1B')['stock_quantity'], 4)
+        self.assertEqual(self.snapshot().doc_keys['inv_1'], ('prod_1', 'opt_1', 'SKU-1B'))
+
+    def test_removed_option_drops_its_sku(self):
+        cache_listeners.apply_product_options_snapshot(self.business_id, [], [change('REMOVED', 'opt_1')], initial=False)
+
+        self.assertIsNone(self.snapshot().get('SKU-1'))
+        self.assertNotIn('SKU-1', self.snapshot().sku_index)
+        self.assertEqual(self.snapshot().get('opt_1')['stock_quantity'], 4)
+
+    def test_inventory_change_after_sku_change_uses_new_sku(self):
+        cache_listeners.apply_product_options_snapshot(
+            self.business_id, [], [change('MODIFIED', 'opt_1', {'sku': 'SKU-1B'})], initial=False
+        )
+        cache_listeners.apply_inventory_snapshot(
+            self.business_id, [],
+            [change('MODIFIED', 'inv_1', {'product_id': 'prod_1', 'product_option_id': 'opt_1', 'stock_quantity': 1})],
+            initial=False
+        )
+
+        self.assertEqual(self.snapshot().get('SKU-1B')['stock_quantity'], 1)
+        self.assertIsNone(self.snapshot().get('SKU-1'))
+
+    def test_initial_options_snapshot_replaces_the_index(self):
+        cache_listeners.apply_product_options_snapshot(
+            self.business_id,
+            [FakeDocument('opt_1', {'sku': 'SKU-1'}), FakeDocument('opt_2', {'sku': 'SKU-2'})],
+            [],
+            initial=True
+        )
+
+        self.assertEqual(dict(self.snapshot().sku_index), {'SKU-1': 'opt_1', 'SKU-2': 'opt_2'})
+        self.assertEqual(self.snapshot().get('SKU-2')['stock_quantity'], 9)
+
+
+class GeocodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = geocoding.OfflineBackend()
+        self.backend.add_place(5.60371, -0.18700, '12, Oxford Street, Osu, Accra, Ghana', {
+            'lat': '5.60371', 'lon': '-0.18700',
+            'address': {'house_number': '12', 'road': 'Oxford Street', 'suburb': 'Osu', 'city': 'Accra', 'country': 'Ghana'}
+        })
+        geocoding.set_geocoder_backend(self.backend)
+
+    def tearDown(self):
+        geocoding.set_geocoder_backend(None)
+
+    def test_first_lookup_keeps_house_level_details(self):
+        result = geocoding.reverse_geocode(5.60371, -0.18700)
+
+        self.assertEqual(result['raw']['address']['house_number'], '12')
+
+    def test_cached_result_uses_own_coordinates_without_house_details(self):
+        geocoding.reverse_geocode(5.60371, -0.18700)
+        result = geocoding.reverse_geocode(5.60372, -0.18701)
+
+        self.assertEqual(self.backend.calls, 1)
+        self.assertEqual((result['raw']['lat'], result['raw']['lon']), ('5.60372', '-0.18701'))
+        self.assertNotIn('road', result['raw']['address'])
+        self.assertNotIn('house_number', result['raw']['address'])
+        self.assertEqual(result['address'], 'Osu, Accra, Ghana')
+        self.assertTrue(result['cached'])
+
+
+class OrderExportResumeTest(unittest.TestCase):
+    business_id = 'test_business'
+
+    def setUp(self):
+        started = datetime(2025, 1, 1)
+        orders = {
+            f"ORD-{i}": {
+                'business_id': self.business_id, 'created_at': started + timedelta(minutes=i), 'total': i,
+                'line_items': [{'product_id': f"prod_{i}", 'quantity': 1}]
+            }
+            for i in range(5)
+        }
+        self.db = FakeFirestore({'orders': orders})
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def export(self, name, **kwargs):
+        path = os.path.join(self.directory.name, name)
+        order_export.export_orders(self.db, self.business_id, path, 'jsonl', page_size=2, **kwargs)
+        return path
+
+    def interrupted_export(self, name, torn_bytes):
+        """An export stopped after its first page, with torn_bytes of a page that never got its cursor"""
+        path = self.export(name)
+        first_page = order_export.read_cursor(path)
+        with open(path, 'r+b') as output:
+            output.truncate(first_page[1])
+            output.seek(first_page[1])
+            output.write(torn_bytes)
+        order_export._save_cursor(path, *first_page)
+        return path
+
+    def resume(self, path):
+        start_after_order_id, resume_offset = order_export.read_cursor(path)
+        order_export.export_orders(self.db, self.business_id, path, 'jsonl', page_size=2,
+                                   start_after_order_id=start_after_order_id, resume_offset=resume_offset)
+
+    def test_resume_drops_a_partly_written_page(self):
+        complete = self.export('complete.jsonl')
+        path = self.interrupted_export('orders.jsonl', b'{"order_id": "ORD-2"}\n{"order_id"')
+
+        self.resume(path)
+
+        with open(complete, 'rb') as expected, open(path, 'rb') as resumed:
+            self.assertEqual(resumed.read(), expected.read())
+
+    def test_resume_drops_a_truncated_gzip_member(self):
+        complete = self.export('complete.jsonl.gz')
+        path = self.interrupted_export('orders.jsonl.gz', gzip.compress(b'{"order_id": "ORD-2"}\n')[:-8])
+
+        self.resume(path)
+
+        with gzip.open(complete, 'rt') as expected, gzip.open(path, 'rt') as resumed:
+            self.assertEqual(resumed.read(), expected.read())
+
+
+class CustomerDeletionHoldsTest(unittest.TestCase):
+    business_id = 'test_business'
+    user_id = '233200000000'
+
+    def setUp(self):
+        patcher = inline_transactions()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def hold(order_id, status, quantity):
+            return {'business_id': self.business_id, 'user_id': self.user_id, 'order_id': order_id,
+                    'product_id': 'prod_1', 'quantity': quantity, 'status': status}
+
+        self.db = FakeFirestore({
+            'inventory': {'inv_1': {'business_id': self.business_id, 'product_id': 'prod_1', 'stock_quantity': 5, 'reserved_quantity': 3}},
+            'inventory_holds': {'hold_1': hold('ORD-1', 'active', 1), 'hold_2': hold('ORD-2', 'committed', 2)}
+        })
+
+    def test_committed_holds_keep_their_stock(self):
+        data_deletion.delete_customer(self.db, self.business_id, self.user_id)
+
+        holds = self.db.store['inventory_holds']
+        self.assertEqual(self.db.store['inventory']['inv_1']['reserved_quantity'], 2)
+        self.assertEqual((holds['hold_1']['status'], holds['hold_2']['status']), ('released', 'committed'))
+        self.assertEqual({hold['user_id'] for hold in holds.values()}, {'DELETED'})
+
+    def test_business_deletion_releases_every_hold(self):
+        data_deletion.delete_business_customer_data(self.db, self.business_id)
+
+        self.assertEqual(self.db.store['inventory']['inv_1']['reserved_quantity'], 0)
+        self.assertEqual(self.db.store['inventory_holds'], {})
+
+
+class InventoryHoldLifecycleTest(unittest.TestCase):
+    business_id = 'test_business'
+    user_id = '233200000000'
+
+    def setUp(self):
+        patcher = inline_transactions()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def inventory_doc(product_id, stock_quantity):
+            return {'business_id': self.business_id, 'product_id': product_id, 'stock_quantity': stock_quantity, 'reserved_quantity': 0}
+
+        self.db = FakeFirestore({
+            'inventory': {'inv_1': inventory_doc('prod_1', 5), 'inv_2': inventory_doc('prod_2', 1)},
+            'orders': {'ORD-1': {'business_id': self.business_id, 'status': 'pending'}}
+        })
+        self.business_context = {'db': self.db, 'business_id': self.business_id}
+
+    def reserved(self, inventory_id='inv_1'):
+        return self.db.store['inventory'][inventory_id]['reserved_quantity']
+
+    def holds(self):
+        return list(self.db.store.get('inventory_holds', {}).values())
+
+    def place(self, items):
+        return inventory_holds.place_order_holds(self.business_context, 'ORD-1', self.user_id, items)
+
+    def test_failed_reservation_releases_the_earlier_ones(self):
+        placed = self.place([{'product_id': 'prod_1', 'quantity': 2}, {'product_id': 'prod_2', 'quantity': 3}])
+
+        self.assertFalse(placed)
+        self.assertEqual((self.reserved('inv_1'), self.reserved('inv_2')), (0, 0))
+        self.assertEqual(self.holds(), [])
+
+    def test_expired_hold_is_reaped_exactly_once(self):
+        self.assertTrue(self.place([{'product_id': 'prod_1', 'quantity': 2}]))
+        self.assertEqual(self.reserved(), 2)
+        later = datetime.now() + timedelta(days=1)
+
+        self.assertEqual(inventory_holds.reap_expired_holds(self.db, now=later), 1)
+        self.assertEqual(inventory_holds.reap_expired_holds(self.db, now=later), 0)
+
+        self.assertEqual(self.reserved(), 0)
+        self.assertEqual([hold['status'] for hold in self.holds()], ['expired'])
+        self.assertEqual(self.db.store['orders']['ORD-1']['inventory_hold_status'], 'expired')
+
+    def test_unexpired_hold_is_not_reaped(self):
+        self.place([{'product_id': 'prod_1', 'quantity': 2}])
+
+        self.assertEqual(inventory_holds.reap_expired_holds(self.db), 0)
+        self.assertEqual(self.reserved(), 2)
+
+    def test_committed_hold_survives_the_reaper_and_is_consumed_when_shipped(self):
+        self.place([{'product_id': 'prod_1', 'quantity': 2}])
+        self.assertEqual(inventory_holds.commit_order_holds(self.business_context, 'ORD-1'), 1)
+
+        self.assertEqual(inventory_holds.reap_expired_holds(self.db, now=datetime.now() + timedelta(days=1)), 0)
+        self.assertEqual(inventory_holds.fulfill_order_holds(self.db, 'ORD-1'), 1)
+        self.assertEqual(inventory_holds.fulfill_order_holds(self.db, 'ORD-1'), 0)
+
+        inventory_doc = self.db.store['inventory']['inv_1']
+        self.assertEqual((inventory_doc['stock_quantity'], inventory_doc['reserved_quantity']), (3, 0))
+
+    def test_cancelling_releases_committed_holds(self):
+        self.place([{'product_id': 'prod_1', 'quantity': 2}])
+        inventory_holds.commit_order_holds(self.business_context, 'ORD-1')
+
+        self.assertEqual(inventory_holds.release_order_holds(self.business_context, 'ORD-1', status='cancelled'), 1)
+        self.assertEqual(inventory_holds.release_order_holds(self.business_context, 'ORD-1', status='cancelled'), 0)
+
+        self.assertEqual(self.reserved(), 0)
+        self.assertEqual(self.db.store['orders']['ORD-1']['inventory_hold_status'], 'cancelled')
+
+
+class ShardedReservationTest(unittest.TestCase):
+    business_id = 'test_business'
+
+    def setUp(self):
+        patcher = inline_transactions()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.db = FakeFirestore({'inventory': {'inv_1': {
+            'business_id': self.business_id, 'product_id': 'prod_1', 'stock_quantity': 4, 'reserved_quantity': 0
+        }}})
+        self.business_context = {'db': self.db, 'business_id': self.business_id}
+        self.assertTrue(reservations.enable_sharded_reservations(self.business_context, 'prod_1', 2))
+
+    def shard_reserved(self):
+        return [self.db.store['inventory/inv_1/reservation_shards'][str(shard)]['reserved_quantity'] for shard in range(2)]
+
+    def test_reservations_stay_within_the_stock(self):
+        results = [reservations.reserve_stock(self.business_context, 'prod_1', 1) for _ in range(5)]
+
+        self.assertEqual([result['success'] for result in results], [True] * 4 + [False])
+        self.assertEqual(results[-1]['reason'], 'insufficient_stock')
+        self.assertEqual(reservations.get_reserved_quantity(self.business_context, 'prod_1'), 4)
+
+    def test_release_gives_back_the_reservation(self):
+        self.assertTrue(reservations.reserve_stock(self.business_context, 'prod_1', 2)['success'])
+
+        reservations.release_stock(self.business_context, 'prod_1', 2)
+
+        self.assertEqual(self.shard_reserved(), [0, 0])
+
+
+class OrderIdempotencyMarkerTest(unittest.TestCase):
+    business_id = 'test_business'
+
+    def setUp(self):
+        self.db = FakeFirestore({'orders': {'ORD-1': {'business_id': self.business_id, 'status': 'pending'}}})
+        # A user of its own, so keys remembered by other tests don't match
+        self.user_id = f"2332{id(self)}"
+        self.keys = order_idempotency.candidate_keys(self.business_id, self.user_id, [{'product_id': 'prod_1', 'quantity': 1}])
+
+    def add_markers(self, order_id):
+        batch = self.db.batch()
+        order_idempotency.add_markers_to_batch(batch, self.db, self.business_id, self.user_id, self.keys, order_id)
+        batch.commit()
+
+    def test_second_attempt_for_the_same_cart_conflicts(self):
+        from google.api_core.exceptions import Conflict
+
+        self.add_markers('ORD-1')
+
+        with self.assertRaises(Conflict):
+            self.add_markers('ORD-2')
+        self.assertEqual(order_idempotency.find_marked_order(self.db, self.keys), 'ORD-1')
+
+    def test_recent_order_is_found_until_cancelled(self):
+        self.add_markers('ORD-1')
+        self.assertEqual(order_idempotency.find_recent_order_id(self.db, self.business_id, self.user_id), 'ORD-1')
+
+        self.db.store['orders']['ORD-1']['status'] = 'cancelled'
+
+        self.assertIsNone(order_idempotency.find_recent_order_id(self.db, self.business_id, self.user_id))
+
+    def test_expired_marker_is_ignored(self):
+        self.add_markers('ORD-1')
+        for marker in self.db.store['order_idempotency'].values():
+            marker['expires_at'] = datetime.now() - timedelta(seconds=1)
+
+        self.assertIsNone(order_idempotency.find_marked_order(self.db, self.keys))
+        self.assertIsNone(order_idempotency.find_recent_order_id(self.db, self.business_id, self.user_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
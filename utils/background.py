@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
+from config import BACKGROUND_WORKERS, FANOUT_WORKERS
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Shared pool for work that shouldn't block a webhook request
+_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="background")
+
+# Separate pool for fanning out I/O inside a request, so it never waits behind background work
+_fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+
+def run_in_background(func, *args, **kwargs):
+    """Run a function on the shared background pool, logging any exception it raises"""
+    def run():
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Background task {getattr(func, '__name__', func)} failed: {str(e)}")
+            return None
+    
+    return _executor.submit(run)
+
+def map_concurrently(func, items):
+    """Call func on each item, in parallel when there is more than one, and return results in order"""
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    
+    return list(_fanout_executor.map(func, items))
@@ -0,0 +1,164 @@
+"""
+Order IDs
+Time-sortable, collision-resistant IDs in the style of ULIDs
+
+An ID is ORD- followed by 27 Crockford base32 characters: 1 derived from
+the business, 10 encoding the creation time in milliseconds and 16 encoding
+80 random bits. A business's IDs sort by creation time, so its recent orders
+and pagination can be served from document key ranges, and the random part
+keeps IDs from different instances created in the same millisecond apart.
+
+The business character spreads new orders over 32 key ranges instead of
+appending every order of every business at the end of one range, which
+would concentrate writes on a single hot tablet (Firestore's guidance on
+sequential document IDs). Within one business IDs are still sequential;
+that stays well under the write rates where it matters.
+
+Legacy IDs (ORD- followed by 8 hex characters) stay valid; they just carry
+no time, so queries over them fall back to created_at. Some sort between
+time-sortable IDs, so key range readers must skip them.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+ORDER_ID_PREFIX = 'ORD-'
+
+# Crockford base32: no I, L, O or U, so IDs read back unambiguously
+CROCKFORD_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+_DECODE_MAP = {char: value for value, char in enumerate(CROCKFORD_ALPHABET)}
+_READ_ALIASES = str.maketrans({'I': '1', 'L': '1', 'O': '0'})
+
+SHARD_LENGTH = 1
+TIME_LENGTH = 10
+RANDOM_LENGTH = 16
+RANDOM_BITS = 80
+BODY_LENGTH = SHARD_LENGTH + TIME_LENGTH + RANDOM_LENGTH
+
+# Key ranges reach this far past the local clock, for IDs issued by instances whose clocks run ahead
+CLOCK_SKEW_ALLOWANCE = timedelta(minutes=5)
+
+_ORDER_ID_PATTERN = re.compile(rf"^{ORDER_ID_PREFIX}[{CROCKFORD_ALPHABET}]{{{BODY_LENGTH}}}$")
+_LEGACY_ORDER_ID_PATTERN = re.compile(rf"^{ORDER_ID_PREFIX}[0-9A-F]{{8}}$")
+
+# Last time and random part issued, so IDs from one process stay strictly increasing
+_last_issued: Tuple[int, int] = (-1, 0)
+_issue_lock = threading.Lock()
+
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, 32)
+        chars.append(CROCKFORD_ALPHABET[remainder])
+    return ''.join(reversed(chars))
+
+
+def _decode(text: str) -> int:
+    value = 0
+    for char in text:
+        value = value * 32 + _DECODE_MAP[char]
+    return value
+
+
+def _to_millis(moment: datetime) -> int:
+    return int(moment.timestamp() * 1000)
+
+
+def _random_bits() -> int:
+    return int.from_bytes(os.urandom(RANDOM_BITS // 8), 'big')
+
+
+def business_shard(business_id: str) -> str:
+    """The key range character of a business's order IDs"""
+    digest = hashlib.sha256((business_id or '').encode('utf-8')).digest()
+    return CROCKFORD_ALPHABET[digest[0] % len(CROCKFORD_ALPHABET)]
+
+
+def _format_order_id(business_id: str, millis: int, random_part: int) -> str:
+    return f"{ORDER_ID_PREFIX}{business_shard(business_id)}{_encode(millis, TIME_LENGTH)}{_encode(random_part, RANDOM_LENGTH)}"
+
+
+def new_order_id(business_id: str, now: Optional[datetime] = None) -> str:
+    """Generate a new time-sortable order ID for a business, optionally for a given creation time"""
+    global _last_issued
+
+    if now:
+        return _format_order_id(business_id, _to_millis(now), _random_bits())
+
+    millis = int(time.time() * 1000)
+
+    with _issue_lock:
+        last_millis, last_random = _last_issued
+        if millis <= last_millis and last_random < (1 << RANDOM_BITS) - 1:
+            # Same millisecond (or the clock stepped back): keep the order by incrementing
+            millis, random_part = last_millis, last_random + 1
+        else:
+            random_part = _random_bits()
+        _last_issued = (millis, random_part)
+
+    return _format_order_id(business_id, millis, random_part)
+
+
+def is_time_sortable_order_id(order_id: str) -> bool:
+    """Whether an ID uses the time-sortable scheme"""
+    return bool(order_id and _ORDER_ID_PATTERN.match(order_id))
+
+
+def is_legacy_order_id(order_id: str) -> bool:
+    """Whether an ID uses the old ORD- plus 8 hex characters scheme"""
+    return bool(order_id and _LEGACY_ORDER_ID_PATTERN.match(order_id))
+
+
+def normalize_order_id(order_id: str) -> str:
+    """Clean up an order ID typed by a customer, e.g. '#ord-k01j9...' or one with O for 0"""
+    cleaned = (order_id or '').strip().lstrip('#').upper()
+    if not cleaned.startswith(ORDER_ID_PREFIX):
+        return cleaned
+
+    body = cleaned[len(ORDER_ID_PREFIX):]
+    if len(body) == BODY_LENGTH:
+        body = body.translate(_READ_ALIASES)
+    return f"{ORDER_ID_PREFIX}{body}"
+
+
+def order_id_created_at(order_id: str) -> Optional[datetime]:
+    """Creation time encoded in a time-sortable ID, or None for legacy IDs"""
+    if not is_time_sortable_order_id(order_id):
+        return None
+
+    time_start = len(ORDER_ID_PREFIX) + SHARD_LENGTH
+    millis = _decode(order_id[time_start:time_start + TIME_LENGTH])
+    return datetime.fromtimestamp(millis / 1000)
+
+
+def order_id_bound(business_id: str, moment: datetime, upper: bool = False) -> str:
+    """
+    Smallest (or largest) possible ID of a business for a moment
+
+    Use as document key bounds: every ID of the business created at or after
+    `moment` is >= order_id_bound(business_id, moment), and every one created
+    at or before it is <= order_id_bound(business_id, moment, upper=True).
+    """
+    random_part = CROCKFORD_ALPHABET[-1] * RANDOM_LENGTH if upper else CROCKFORD_ALPHABET[0] * RANDOM_LENGTH
+    return f"{ORDER_ID_PREFIX}{business_shard(business_id)}{_encode(_to_millis(moment), TIME_LENGTH)}{random_part}"
+
+
+def order_id_key_range(business_id: str, since: Optional[datetime] = None, before_order_id: Optional[str] = None,
+                       now: Optional[datetime] = None) -> Tuple[str, str]:
+    """
+    Document key bounds [low, high) covering a business's time-sortable IDs created since a time and before an ID
+
+    high never reaches past the current time: most legacy IDs sort above
+    every time-sortable ID, and an open upper bound would read them first.
+    """
+    low = order_id_bound(business_id, since) if since else f"{ORDER_ID_PREFIX}{business_shard(business_id)}"
+    high = order_id_bound(business_id, (now or datetime.now()) + CLOCK_SKEW_ALLOWANCE, upper=True)
+    if before_order_id and before_order_id < high:
+        high = before_order_id
+    return low, high